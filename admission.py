@@ -0,0 +1,379 @@
+# admission.py
+# Admission control trước các route tốn quota upstream: token bucket + hàng đợi ưu tiên.
+#
+#   call     /api/get-ws-url, /signed-url, /conversation-token, /api/bootstrap   ưu tiên cao
+#   preview  /api/tts-stream                                                     ưu tiên thấp
+#
+# Bật mặc định. Mỗi request (theo class):
+#   1. token bucket theo client (IP) và bucket chung của class -> hết budget: 429 + Retry-After ngay.
+#      IP = remote_addr; sau reverse proxy / LB thì mọi user chung 1 IP (chung bucket call) ->
+#      đặt ADMISSION_PROXY_HOPS = số proxy tin cậy để lấy IP thật từ X-Forwarded-For
+#   2. slot in-flight chung (ADMISSION_CAPACITY); preview không được lấy ADMISSION_RESERVE slot
+#      cuối (để dành cho call). Hết slot -> xếp hàng (có giới hạn) theo ưu tiên call > preview;
+#      hàng đầy / chờ quá ADMISSION_QUEUE_TIMEOUT -> 429
+#   3. preview mới của cùng 1 client (X-Client-Id, mỗi tab 1 id) huỷ preview cũ: đang xếp hàng
+#      -> trả 409, đang stream -> dừng stream ở chunk kế tiếp và đóng upstream (cache miss: fill
+#      TTS dùng chung chỉ bị huỷ khi không còn request nào khác đang đọc, xem tts_cache.py)
+#
+# Slot giữ tới khi response (kể cả stream) kết thúc. Dùng chung cho Flask (thread) và Quart
+# (asyncio): state trong 1 threading.Lock, chỉ chờ là khác nhau (Event / Future).
+#
+#   ADMISSION_CALL="rate=1,burst=5,global_rate=20,global_burst=40,queue=32"
+#   ADMISSION_PREVIEW="rate=0.5,burst=3,global_rate=10,global_burst=20,queue=8"
+
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+
+ADMISSION_ENABLED       = (os.getenv("ADMISSION_ENABLED") or "1").lower() in ("1", "true", "yes")
+ADMISSION_CAPACITY      = int(os.getenv("ADMISSION_CAPACITY") or 32)      # request upstream in-flight
+ADMISSION_RESERVE       = int(os.getenv("ADMISSION_RESERVE") or 4)        # slot chỉ call được dùng
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT") or 5)
+ADMISSION_PROXY_HOPS    = int(os.getenv("ADMISSION_PROXY_HOPS") or 0)    # 0 = không tin X-Forwarded-For
+CLIENT_IDLE             = 600.0          # bucket client không dùng quá lâu -> bỏ
+
+ROUTE_CLASSES = {
+    "/api/get-ws-url": "call",
+    "/signed-url": "call",
+    "/conversation-token": "call",
+    "/api/bootstrap": "call",
+    "/api/tts-stream": "preview",
+}
+
+
+def _spec(name, default):
+    # "rate=1,burst=5" -> {"rate": 1.0, "burst": 5.0}; bỏ qua phần sai
+    out = dict(default)
+    for part in (os.getenv(name) or "").split(","):
+        key, _, value = part.partition("=")
+        try:
+            if key.strip() in out:
+                out[key.strip()] = float(value)
+        except ValueError:
+            pass
+    return out
+
+
+def client_ip(remote_addr, forwarded_for=None, hops=ADMISSION_PROXY_HOPS):
+    """
+    IP dùng cho bucket client. hops > 0: lấy phần tử thứ `hops` từ phải của X-Forwarded-For
+    (phần bên trái do client tự ghi, không tin); header thiếu / ngắn hơn -> remote_addr.
+    """
+    if hops > 0 and forwarded_for:
+        chain = [p.strip() for p in forwarded_for.split(",") if p.strip()]
+        if len(chain) >= hops:
+            return chain[-hops]
+    return remote_addr or "-"
+
+
+class Rejected(Exception):
+    def __init__(self, reason, retry_after=None, status=429):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+        self.status = status
+
+    def body(self):
+        out = {"error": "superseded" if self.status == 409 else "too many requests",
+               "reason": self.reason}
+        if self.retry_after is not None:
+            out["retry_after"] = self.retry_after
+        return out
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, now):
+        """
+        -> 0 nếu lấy được 1 token, ngược lại số giây cần chờ (gọi trong lock của Admission).
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else 60.0
+
+    def idle(self, now):
+        return self.tokens + (now - self.updated) * self.rate >= self.burst and \
+            now - self.updated > CLIENT_IDLE
+
+
+class RouteClass:
+    def __init__(self, name, priority, rate, burst, global_rate, global_burst, queue,
+                 supersede=False, reserve=0):
+        self.name = name
+        self.priority = priority          # nhỏ = ưu tiên cao
+        self.rate = rate
+        self.burst = burst
+        self.bucket = TokenBucket(global_rate, global_burst)
+        self.max_queue = int(queue)
+        self.supersede = supersede        # request mới của client huỷ request cũ cùng class
+        self.reserve = reserve            # số slot cuối không được dùng
+        self.inflight = 0
+        self.queued = 0
+        self.stats = {"admitted": 0, "enqueued": 0, "rejected": {}, "superseded": 0}
+
+
+class Ticket:
+    __slots__ = ("cls", "client", "cancelled", "_admission", "_released", "_waiter")
+
+    def __init__(self, admission, cls, client):
+        self._admission = admission
+        self.cls = cls
+        self.client = client
+        self.cancelled = False            # preview bị thay bởi preview mới -> dừng stream
+        self._released = False
+        self._waiter = None
+
+    def release(self):
+        self._admission._release(self)
+
+
+class _Waiter:
+    # sync: threading.Event; async: Future trên loop của request
+    def __init__(self, ticket, loop=None):
+        self.ticket = ticket
+        self.result = None                # "admitted" | Rejected
+        self._loop = loop
+        if loop is None:
+            self._event = threading.Event()
+        else:
+            self._future = loop.create_future()
+
+    def wake(self, result):
+        self.result = result
+        if self._loop is None:
+            self._event.set()
+        else:
+            self._loop.call_soon_threadsafe(
+                lambda: self._future.done() or self._future.set_result(result))
+
+
+class Admission:
+    def __init__(self, capacity=ADMISSION_CAPACITY, reserve=ADMISSION_RESERVE,
+                 queue_timeout=ADMISSION_QUEUE_TIMEOUT):
+        self.capacity = capacity
+        self.queue_timeout = queue_timeout
+        self.classes = {
+            "call": RouteClass("call", 0, **_spec("ADMISSION_CALL", {
+                "rate": 1, "burst": 5, "global_rate": 20, "global_burst": 40, "queue": 32})),
+            "preview": RouteClass("preview", 1, supersede=True, reserve=reserve,
+                                  **_spec("ADMISSION_PREVIEW", {
+                                      "rate": 0.5, "burst": 3, "global_rate": 10,
+                                      "global_burst": 20, "queue": 8})),
+        }
+        self._lock = threading.Lock()
+        self._inflight = 0
+        self._queue = []                  # heap (priority, seq, waiter)
+        self._seq = itertools.count()
+        self._buckets = {}                # (class, client ip) -> TokenBucket
+        self._latest = {}                 # (class, ip, client id) -> Ticket (class supersede)
+        self._checks = 0
+
+    # ---------- admit ----------
+    def _reject(self, cls, reason, retry_after=None, status=429):
+        cls.stats["rejected"][reason] = cls.stats["rejected"].get(reason, 0) + 1
+        return Rejected(reason, None if retry_after is None else max(1, math.ceil(retry_after)),
+                        status)
+
+    def _has_slot(self, cls):
+        return self._inflight < self.capacity - cls.reserve
+
+    def _try(self, cls_name, ip, client_id):
+        """
+        -> (ticket, False) nếu được vào ngay; (ticket, True) nếu phải xếp hàng. Raise Rejected.
+        """
+        cls = self.classes[cls_name]
+        now = time.monotonic()
+        self._prune(now)
+
+        bucket = self._buckets.get((cls_name, ip))
+        if bucket is None:
+            bucket = self._buckets[(cls_name, ip)] = TokenBucket(cls.rate, cls.burst)
+        wait = bucket.take(now)
+        if wait:
+            raise self._reject(cls, "client_rate", wait)
+        wait = cls.bucket.take(now)
+        if wait:
+            raise self._reject(cls, "global_rate", wait)
+
+        ticket = Ticket(self, cls, (ip, client_id))
+        if cls.supersede and client_id:
+            old = self._latest.get((cls_name, ip, client_id))
+            if old is not None:
+                self._cancel(old)
+            self._latest[(cls_name, ip, client_id)] = ticket
+
+        # còn slot và không ai ưu tiên >= đang chờ -> vào luôn
+        if self._has_slot(cls) and not any(w.ticket.cls.priority <= cls.priority for _, _, w in self._queue):
+            self._admit(ticket)
+            return ticket, False
+        if cls.queued >= cls.max_queue:
+            self._forget(ticket)
+            raise self._reject(cls, "queue_full", 1)
+        return ticket, True
+
+    def _admit(self, ticket):
+        self._inflight += 1
+        ticket.cls.inflight += 1
+        ticket.cls.stats["admitted"] += 1
+
+    def _enqueue(self, waiter):
+        cls = waiter.ticket.cls
+        cls.queued += 1
+        cls.stats["enqueued"] += 1
+        waiter.ticket._waiter = waiter
+        heapq.heappush(self._queue, (cls.priority, next(self._seq), waiter))
+
+    def _dequeue(self, waiter):
+        # gọi trong lock; -> True nếu waiter còn trong hàng
+        for i, (_, _, w) in enumerate(self._queue):
+            if w is waiter:
+                self._queue.pop(i)
+                heapq.heapify(self._queue)
+                waiter.ticket.cls.queued -= 1
+                waiter.ticket._waiter = None
+                return True
+        return False
+
+    def _dispatch(self):
+        # gọi trong lock: đưa waiter ưu tiên cao nhất vào slot trống
+        while self._queue:
+            _, _, waiter = self._queue[0]
+            if not self._has_slot(waiter.ticket.cls):
+                # hàng đầu (call) chưa vào được thì preview phía sau cũng không
+                return
+            heapq.heappop(self._queue)
+            waiter.ticket.cls.queued -= 1
+            waiter.ticket._waiter = None
+            self._admit(waiter.ticket)
+            waiter.wake("admitted")
+
+    def _cancel(self, ticket):
+        # gọi trong lock: preview cũ bị thay
+        ticket.cancelled = True
+        ticket.cls.stats["superseded"] += 1
+        waiter = ticket._waiter
+        if waiter is not None and self._dequeue(waiter):
+            ticket._released = True
+            waiter.wake(self._reject(ticket.cls, "superseded", status=409))
+
+    def _forget(self, ticket):
+        ip, client_id = ticket.client
+        key = (ticket.cls.name, ip, client_id)
+        if self._latest.get(key) is ticket:
+            del self._latest[key]
+
+    def _release(self, ticket):
+        with self._lock:
+            if ticket._released:
+                return
+            ticket._released = True
+            self._forget(ticket)
+            self._inflight -= 1
+            ticket.cls.inflight -= 1
+            self._dispatch()
+
+    def _timeout(self, waiter):
+        # chờ quá lâu: nếu vẫn còn trong hàng thì bỏ ra và 429
+        with self._lock:
+            if waiter.result is not None or not self._dequeue(waiter):
+                return None
+            waiter.ticket._released = True
+            self._forget(waiter.ticket)
+            return self._reject(waiter.ticket.cls, "queue_timeout", 1)
+
+    def _prune(self, now):
+        self._checks += 1
+        if self._checks % 256:
+            return
+        for key in [k for k, b in self._buckets.items() if b.idle(now)]:
+            del self._buckets[key]
+
+    # ---------- API ----------
+    def acquire(self, cls_name, ip, client_id=None):
+        """
+        Sync (Flask): -> Ticket (nhớ release()). Raise Rejected (429 / 409).
+        """
+        with self._lock:
+            ticket, queued = self._try(cls_name, ip, client_id)
+            if not queued:
+                return ticket
+            waiter = _Waiter(ticket)
+            self._enqueue(waiter)
+        if not waiter._event.wait(self.queue_timeout):
+            rejected = self._timeout(waiter)
+            if rejected is not None:
+                raise rejected
+        if isinstance(waiter.result, Rejected):
+            raise waiter.result
+        return ticket
+
+    async def aacquire(self, cls_name, ip, client_id=None):
+        with self._lock:
+            ticket, queued = self._try(cls_name, ip, client_id)
+            if not queued:
+                return ticket
+            waiter = _Waiter(ticket, asyncio.get_running_loop())
+            self._enqueue(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter._future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            rejected = self._timeout(waiter)
+            if rejected is not None:
+                raise rejected
+        except asyncio.CancelledError:
+            # client ngắt khi đang chờ: bỏ khỏi hàng, hoặc trả slot nếu vừa được cấp
+            if self._timeout(waiter) is None and waiter.result == "admitted":
+                ticket.release()
+            raise
+        if isinstance(waiter.result, Rejected):
+            raise waiter.result
+        return ticket
+
+    def info(self):
+        with self._lock:
+            return {"enabled": ADMISSION_ENABLED, "proxy_hops": ADMISSION_PROXY_HOPS,
+                    "capacity": self.capacity, "inflight": self._inflight,
+                    "queued": len(self._queue), "clients": len(self._buckets),
+                    "classes": {name: {"priority": c.priority, "inflight": c.inflight, "queued": c.queued,
+                                       "reserve": c.reserve, **c.stats}
+                                for name, c in self.classes.items()}}
+
+
+# =========================================================
+# STREAM GUARD
+# =========================================================
+def guarded(chunks, ticket):
+    # Flask stream: dừng khi preview bị thay. Đóng generator gốc -> relay đóng upstream; fill
+    # cache trả reader, reader cuối thì huỷ fill + đóng upstream
+    try:
+        for chunk in chunks:
+            if ticket.cancelled:
+                break
+            yield chunk
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+async def aguarded(body, ticket):
+    # như guarded(); thoát `async with body` -> aclose generator gốc
+    try:
+        async with body as chunks:
+            async for chunk in chunks:
+                if ticket.cancelled:
+                    break
+                yield chunk
+    finally:
+        ticket.release()
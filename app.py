@@ -1,7 +1,27 @@
-from flask import Flask, send_from_directory, jsonify, render_template, request, Response
-import requests, os
+from flask import (Blueprint, Flask, Response, current_app, g, jsonify, render_template, request,
+                   send_file, send_from_directory)
+import requests, os, json, time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from dotenv import load_dotenv
 from flask_cors import CORS
+from upstream import breakers, http, routes
+from breaker import CircuitOpenError
+from cache import CacheEntry, TTLCache
+from lookup import LookupService, parse_codes, request_payload
+from metrics import Counter, Gauge, GaugeFunc, Histogram, render_prometheus
+from token_pool import POOL_TOKEN_TTL, jwt_expires_at, make_pool, POOL_ENABLED as TOKEN_POOL_ENABLED
+from tts_cache import TTSCache, TTS_CACHE_ENABLED, cache_key, iter_file
+from tts_pipeline import SegmentError, buffered, pipelined, split_text, wants_pipeline
+from stream_relay import metered, relay, stream_aborted, stream_bytes, stream_rate, stream_ttfb
+import assets
+import compression
+from admission import ADMISSION_ENABLED, ROUTE_CLASSES, Admission, Rejected, client_ip, guarded
+import shared_state
+from fast_json import FastJSONProvider
+from voice_index import VoiceIndex, parse_query
+from warmup import WARMUP_CONNECTIONS, Warmup, health
+import tracing
+from profiler import PROFILER_ENABLED, ProfilerBusy, parse_request as parse_profile_request, profiler
 
 load_dotenv()
 
@@ -9,201 +29,751 @@ PORT = int(os.getenv("PORT", "8080"))
 N8N_SIGNED_URL_ENDPOINT = (os.getenv("N8N_SIGNED_URL_ENDPOINT") or "").strip()
 ELEVENLABS_API_KEY = (os.getenv("ELEVENLABS_API_KEY") or "").strip().strip('"').strip("'")
 AGENT_ID = (os.getenv("AGENT_ID") or "").strip()
-BASE = (os.getenv("BASE_API") or "").strip()
+BASE = (os.getenv("BASE_API") or "https://api.elevenlabs.io/v1").strip().rstrip("/")
 
-if not ELEVENLABS_API_KEY or not AGENT_ID:
-    raise RuntimeError("Thiếu ELEVENLABS_API_KEY hoặc AGENT_ID trong .env")
+
+def config_errors():
+    # kiểm tra trong create_app() chứ không raise lúc import module
+    errors = []
+    if not ELEVENLABS_API_KEY or not AGENT_ID:
+        errors.append("Thiếu ELEVENLABS_API_KEY hoặc AGENT_ID trong .env")
+    return errors
 
 HEADERS = {"xi-api-key": ELEVENLABS_API_KEY}
 
-# ✅ CHỈ KHỞI TẠO 1 LẦN
-app = Flask(__name__, static_folder="static", template_folder="templates")
-CORS(app)
+# Cache (giây): agent config / voice list ít đổi -> không cần gọi upstream mỗi page load
+CACHE_TTL_AGENT = int(os.getenv("CACHE_TTL_AGENT", "600"))
+CACHE_TTL_VOICES = int(os.getenv("CACHE_TTL_VOICES", "600"))
+CACHE_STALE_TTL = int(os.getenv("CACHE_STALE_TTL", "86400"))
+ADMIN_TOKEN = (os.getenv("ADMIN_TOKEN") or "").strip()
+
+# =========================================================
+# ERRORS
+# =========================================================
+def error_body(e):
+    """
+    -> (body, status). Circuit open -> 503 + retry_after để client biết chờ bao lâu.
+    """
+    tracing.log("error", error=str(e), type=type(e).__name__)
+    if isinstance(e, CircuitOpenError):
+        return {"error": str(e), "dependency": e.dependency, "retry_after": e.retry_after}, 503
+    return {"error": str(e)}, 500
+
+
+def error_response(e):
+    body, status = error_body(e)
+    resp = jsonify(body)
+    if status == 503:
+        resp.headers["Retry-After"] = str(body["retry_after"])
+    return resp, status
+
+
+# =========================================================
+# RESPONSE SHAPING (dùng chung cho Flask + ASGI)
+# =========================================================
+def summarize_agent(data):
+    conv = data.get("conversation_config") or {}
+    additional = conv.get("additional_languages") or conv.get("languages") or []
+    primary = conv.get("language") or conv.get("primary_language") or "en"
+
+    return {
+        "agent_id": AGENT_ID,
+        "primary_language": primary,
+        "additional_languages": additional,
+        "raw": data
+    }
+
+
+def project_voices(data):
+    voices = data.get("voices") or data.get("items") or data.get("results") or []
+
+    out = []
+    for v in voices:
+        vid = v.get("voice_id") or v.get("id")
+        if not vid:
+            continue
+
+        category = (v.get("category") or "").lower()
+        is_premade = v.get("is_premade") or v.get("premade")
+
+        # only load my voices
+        if category == "premade" or is_premade:
+            continue
+
+        labels = v.get("labels") or {}
+        lang_trained = labels.get("language") or labels.get("lang")
+
+        out.append({
+            "voice_id": vid,
+            "name": v.get("name") or vid,
+            "language_trained": lang_trained,
+            "category": category or None,
+            "labels": labels
+        })
+    return out
+
+
+TTS_MODEL_ID = "eleven_turbo_v2"
+TTS_VOICE_SETTINGS = {"stability": 0.4, "similarity_boost": 0.8}
+
+
+SUPPORTED_LANGUAGES = [
+    {"code":"en","name":"English"},
+    {"code":"ja","name":"Japanese"},
+    {"code":"zh","name":"Chinese"},
+    {"code":"de","name":"German"},
+    {"code":"hi","name":"Hindi"},
+    {"code":"fr","name":"French"},
+    {"code":"ko","name":"Korean"},
+    {"code":"pt","name":"Portuguese"},
+    {"code":"it","name":"Italian"},
+    {"code":"es","name":"Spanish"},
+    {"code":"id","name":"Indonesian"},
+    {"code":"nl","name":"Dutch"},
+    {"code":"tr","name":"Turkish"},
+    {"code":"fil","name":"Filipino"},
+    {"code":"pl","name":"Polish"},
+    {"code":"sv","name":"Swedish"},
+    {"code":"bg","name":"Bulgarian"},
+    {"code":"ro","name":"Romanian"},
+    {"code":"ar","name":"Arabic"},
+    {"code":"cs","name":"Czech"},
+    {"code":"el","name":"Greek"},
+    {"code":"fi","name":"Finnish"},
+    {"code":"hr","name":"Croatian"},
+    {"code":"ms","name":"Malay"},
+    {"code":"sk","name":"Slovak"},
+    {"code":"da","name":"Danish"},
+    {"code":"ta","name":"Tamil"},
+    {"code":"uk","name":"Ukrainian"},
+    {"code":"ru","name":"Russian"},
+]
+
+# Route gắn vào blueprint, chỉ đăng ký vào app trong create_app() (cuối file)
+bp = Blueprint("app", __name__)
+
+# ====== TRACING (tracing.py) ======
+# đăng ký trước mọi hook khác: before chạy đầu tiên, after chạy cuối cùng (sau nén)
+TRACE_EXPOSE_HEADERS = ["X-Request-Id", "traceparent"]
+
+
+def trace_begin(req):
+    # req = flask.request / quart.request
+    return tracing.begin(req.headers, method=req.method, path=req.path,
+                         route=req.url_rule.rule if req.url_rule is not None else "unmatched")
+
+
+def trace_headers(resp, trace):
+    if trace is not None:
+        resp.headers.update(trace.headers())
+    return resp
+
+
+@bp.before_app_request
+def _trace_before():
+    g.trace = trace_begin(request)
+
+
+@bp.after_app_request
+def _trace_after(resp):
+    # ghi trace khi response đóng (stream: khi stream xong / client ngắt)
+    trace = g.pop("trace", None)
+    if trace is not None:
+        resp.call_on_close(lambda: trace.finish(resp.status_code))
+    return trace_headers(resp, trace)
+
+
+@bp.teardown_app_request
+def _trace_teardown(exc):
+    # lỗi trước after_request -> vẫn ghi trace
+    trace = g.pop("trace", None)
+    if trace is not None and exc is not None:
+        trace.finish(500, error=repr(exc))
+    elif trace is not None:
+        trace.finish()
+
+
+@bp.route("/api/traces")
+def traces_info():
+    # trace đã ghi gần nhất (chậm / lỗi / được sample) + trạng thái log sink
+    return jsonify({**tracing.info(), "recent": list(tracing.recent)})
+
+
+@bp.route("/api/profile")
+def profile():
+    """
+    ?seconds=5&hz=100&format=folded|speedscope&idle=0 -> flame graph của cả process (profiler.py).
+    Tắt mặc định (PROFILER_ENABLED); có ADMIN_TOKEN thì bắt buộc header X-Admin-Token.
+    """
+    if not PROFILER_ENABLED:
+        return jsonify({"error": "profiler tắt (PROFILER_ENABLED=1 để bật)"}), 404
+    if ADMIN_TOKEN and request.headers.get("X-Admin-Token") != ADMIN_TOKEN:
+        return jsonify({"error": "forbidden"}), 403
+    try:
+        seconds, hz, fmt, idle = parse_profile_request(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        result = profiler.sample(seconds, hz, idle)
+    except ProfilerBusy as e:
+        return jsonify({"error": str(e)}), 409
+    if fmt == "speedscope":
+        return jsonify(result.speedscope())
+    return Response(result.folded(), mimetype="text/plain")
+
+
+# ====== METRICS (per route) ======
+http_requests = Counter("http_requests_total", "Request theo route / status",
+                        labelnames=("route", "method", "status"))
+http_latency = Histogram("http_request_duration_seconds",
+                         "Thời gian xử lý request (response stream: tới khi trả header)",
+                         labelnames=("route", "method"))
+http_inflight = Gauge("http_requests_inflight", "Request đang xử lý", labelnames=("route",))
+http_errors = Counter("http_request_errors_total", "Request lỗi 5xx theo route", labelnames=("route",))
+
+
+def metrics_start(ctx, rule):
+    # ctx = flask.g / quart.g; route label = rule (vd /api/tts-stream), không dùng path thật
+    ctx.metrics_route = rule.rule if rule is not None else "unmatched"
+    ctx.metrics_t0 = time.perf_counter()
+    http_inflight.inc(route=ctx.metrics_route)
+
+
+def metrics_record(ctx, method, status):
+    route = ctx.get("metrics_route")
+    if route is None:
+        return
+    http_latency.observe(time.perf_counter() - ctx.metrics_t0, route=route, method=method)
+    http_requests.inc(route=route, method=method, status=str(status))
+    if status >= 500:
+        http_errors.inc(route=route)
+
+
+def metrics_end(ctx):
+    route = ctx.pop("metrics_route", None)
+    if route is not None:
+        http_inflight.dec(route=route)
+
+
+@bp.before_app_request
+def _metrics_before():
+    metrics_start(g, request.url_rule)
+
+
+@bp.after_app_request
+def _metrics_after(resp):
+    metrics_record(g, request.method, resp.status_code)
+    return resp
+
+
+@bp.after_app_request
+def _compress(resp):
+    # JSON / text >= COMPRESS_MIN_BYTES -> br/gzip (compression.py)
+    return compression.apply(resp, request.headers.get("Accept-Encoding"))
+
+
+@bp.teardown_app_request
+def _metrics_teardown(exc):
+    metrics_end(g)
+
+
+# ====== ADMISSION CONTROL (admission.py) ======
+admission = Admission()
+
+
+def admission_class(req):
+    # req = flask.request / quart.request
+    rule = req.url_rule.rule if req.url_rule is not None else None
+    return ROUTE_CLASSES.get(rule) if ADMISSION_ENABLED else None
+
+
+def client_keys(req):
+    # bucket theo IP (sau proxy: ADMISSION_PROXY_HOPS); X-Client-Id (mỗi tab 1 id) để preview mới
+    # huỷ preview cũ của đúng tab đó
+    ip = client_ip(req.remote_addr, req.headers.get("X-Forwarded-For"))
+    return ip, (req.headers.get("X-Client-Id") or "")[:64] or None
+
+
+def rejected_response(e):
+    resp = jsonify(e.body())
+    if e.retry_after is not None:
+        resp.headers["Retry-After"] = str(e.retry_after)
+    return resp, e.status
+
+
+@bp.before_app_request
+def _admit():
+    cls = admission_class(request)
+    if cls is None:
+        return None
+    try:
+        with tracing.span("admission", cls=cls):
+            g.admission = admission.acquire(cls, *client_keys(request))
+    except Rejected as e:
+        return rejected_response(e)
+    return None
+
+
+@bp.after_app_request
+def _admission_stream(resp):
+    # stream: giữ slot tới khi stream xong, dừng sớm nếu bị preview mới thay
+    ticket = g.get("admission")
+    if ticket is not None and resp.is_streamed:
+        resp.response = guarded(resp.response, ticket)
+        resp.call_on_close(ticket.release)
+        g.admission = None
+    return resp
+
+
+@bp.teardown_app_request
+def _admission_release(exc):
+    ticket = g.pop("admission", None)
+    if ticket is not None:
+        ticket.release()
+
+
+@bp.route("/api/admission")
+def admission_info():
+    return jsonify(admission.info())
 
 # ====== HOME ======
-@app.get("/")
+def html_page(html):
+    # HTML nén sẵn theo Accept-Encoding + ETag: lần sau chỉ tốn 1 request 304
+    etag, variants = assets.page(html)
+    encoding = assets.negotiate(request.headers.get("Accept-Encoding"), variants)
+    resp = Response(variants[encoding], mimetype="text/html")
+    resp.headers.update(assets.headers(encoding, immutable=False))
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.set_etag(f"{etag}-{encoding or 'identity'}")
+    return resp.make_conditional(request)
+
+
+@bp.get("/")
 def home():
     # nếu bạn để index.html trong templates/
-    return render_template("index.html")
+    return html_page(render_template("index.html"))
     # nếu bạn muốn để index.html ở root thì dùng:
     # return send_from_directory(".", "index.html")
 # ======= Worklet ===============
 # ======= PCM (Pulse Code Modulation) =============
-@app.get("/pcm-worklet.js")
+@bp.get("/pcm-worklet.js")
 def pcm_worklet():
     return send_from_directory("static", "pcm-worklet.js")
 
-@app.route("/api/get-ws-url", methods=["POST"])
-def get_ws_url():
+
+@bp.get(f"{assets.ASSETS_PREFIX}<path:filename>")
+def asset(filename):
+    # tên file có hash -> cache vĩnh viễn (immutable), bản .br / .gz nén sẵn
+    found = assets.lookup(filename, request.headers.get("Accept-Encoding"))
+    if found is None:
+        return jsonify({"error": "not found"}), 404
+    path, encoding, mimetype = found
+    resp = send_file(path, mimetype=mimetype, conditional=False, etag=False)
+    resp.headers.update(assets.headers(encoding))
+    return resp
+
+def mint_call_ws_url():
+    """
+    -> (body, status). Mint 1 signed_url trực tiếp từ ElevenLabs cho call WS.
+    """
     # ✅ đúng endpoint hiện tại
-    url = f"https://api.elevenlabs.io/v1/convai/conversation/get-signed-url?agent_id={AGENT_ID}"
-    headers = {"xi-api-key": ELEVENLABS_API_KEY}
+    url = f"{BASE}/convai/conversation/get-signed-url?agent_id={AGENT_ID}"
 
-    r = requests.get(url, headers=headers, timeout=30)
+    try:
+        r = http.get(url, headers=HEADERS, dependency="elevenlabs_convai")
+    except Exception as e:
+        return error_body(e)
     if r.status_code != 200:
-        return jsonify({"error": r.text}), 500
+        return {"error": r.text}, 500
 
-    body = r.json()
+    with tracing.span("elevenlabs.parse", op="call_ws_url"):
+        body = r.json()
     signed_url = body.get("signed_url")
     if not signed_url:
-        return jsonify({"error": "No signed_url in response", "raw": body}), 500
+        return {"error": "No signed_url in response", "raw": body}, 500
+
+    return {"ws_url": signed_url}, 200
 
-    return jsonify({"ws_url": signed_url})
+
+@bp.route("/api/get-ws-url", methods=["POST"])
+def get_ws_url():
+    return serve_pooled(call_url_pool, mint_call_ws_url)
 
 # ====== TOKEN ======
-@app.route("/conversation-token")
-def conversation_token():
+def mint_conversation_token():
     try:
-        r = requests.get(
+        r = http.get(
             f"{BASE}/convai/conversation/token",
             params={"agent_id": AGENT_ID},
             headers=HEADERS,
-            timeout=20
+            dependency="elevenlabs_convai"
         )
         r.raise_for_status()
-        data = r.json()
+        with tracing.span("elevenlabs.parse", op="token"):
+            data = r.json()
         token = data.get("token") or data.get("conversation_token") or ""
 
         if not token:
-            return jsonify({"error": "Không nhận được token", "raw": data}), 500
-        return jsonify({"token": token})
+            return {"error": "Không nhận được token", "raw": data}, 500
+        return {"token": token}, 200
 
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return error_body(e)
+
+
+@bp.route("/conversation-token")
+def conversation_token():
+    return serve_pooled(token_pool, mint_conversation_token)
 
 
 # ====== AGENT CONFIG ======
-@app.route("/api/agent")
-def get_agent():
-    try:
-        r = requests.get(f"{BASE}/convai/agents/{AGENT_ID}", headers=HEADERS, timeout=20)
-        if r.status_code == 404:
-            r = requests.get(f"{BASE}/agents/{AGENT_ID}", headers=HEADERS, timeout=20)
+agent_cache = TTLCache("agent", CACHE_TTL_AGENT, CACHE_STALE_TTL)
+voices_cache = TTLCache("voices", CACHE_TTL_VOICES, CACHE_STALE_TTL)
+CACHES = {"agent": agent_cache, "voices": voices_cache}
 
-        r.raise_for_status()
-        data = r.json()
 
-        conv = data.get("conversation_config") or {}
-        additional = conv.get("additional_languages") or conv.get("languages") or []
-        primary = conv.get("language") or conv.get("primary_language") or "en"
+def cached_json(entry):
+    # ETag + no-cache: browser luôn revalidate, nhưng chỉ tốn 1 request 304 rỗng
+    resp = jsonify(entry.value)
+    resp.set_etag(entry.etag)
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp.make_conditional(request)
+
+
+# ?fields= cho /api/agent: mặc định chỉ field UI dùng, "raw" (toàn bộ agent config) phải xin rõ
+AGENT_FIELDS = ("agent_id", "primary_language", "additional_languages", "raw")
+AGENT_DEFAULT_FIELDS = ("agent_id", "primary_language", "additional_languages")
+_projections = {}     # (etag, fields) -> CacheEntry
+
+
+def parse_fields(args, allowed, default):
+    fields = tuple(p.strip() for p in (args.get("fields") or "").split(",") if p.strip())
+    unknown = [f for f in fields if f not in allowed]
+    if unknown:
+        raise ValueError(f"unknown field(s): {', '.join(unknown)} (có: {', '.join(allowed)})")
+    return fields or default
 
-        return jsonify({
-            "agent_id": AGENT_ID,
-            "primary_language": primary,
-            "additional_languages": additional,
-            "raw": data
-        })
+
+def project_entry(entry, fields):
+    # CacheEntry chỉ gồm fields (ETag riêng), memo theo phiên bản entry -> không tính lại mỗi request
+    key = (entry.etag, fields)
+    projected = _projections.get(key)
+    if projected is None:
+        projected = _projections[key] = CacheEntry({f: entry.value.get(f) for f in fields})
+        while len(_projections) > 32:
+            _projections.pop(next(iter(_projections)), None)
+    return projected
+
+
+# URL nào đúng với BASE_API thì chỉ probe 1 lần, sau đó gọi thẳng
+agent_route = routes.register("agent", [f"{BASE}/convai/agents/{AGENT_ID}", f"{BASE}/agents/{AGENT_ID}"])
+voices_route = routes.register("voices", [f"{BASE}/voices", f"{BASE}/voices/search"])
+
+
+def fetch_agent():
+    r = agent_route.request(http, headers=HEADERS, dependency="elevenlabs_convai",
+                            op="agents")
+    r.raise_for_status()
+    with tracing.span("agent.parse"):
+        return summarize_agent(r.json())
+
+
+@bp.route("/api/agent")
+def get_agent():
+    # ?fields=agent_id,primary_language,additional_languages,raw (mặc định: không có raw)
+    try:
+        fields = parse_fields(request.args, AGENT_FIELDS, AGENT_DEFAULT_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        return cached_json(project_entry(agent_cache.get(AGENT_ID, fetch_agent), fields))
 
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return error_response(e)
 
 
 # ====== VOICES ======
-@app.route("/api/voices")
+def fetch_voices():
+    r = voices_route.request(http, headers=HEADERS, dependency="elevenlabs_convai",
+                             op="voices")
+    r.raise_for_status()
+    with tracing.span("voices.parse"):
+        return {"voices": project_voices(r.json())}
+
+
+voice_index = VoiceIndex()
+
+
+@bp.route("/api/voices")
 def list_my_voices():
+    # ?lang= &category= &q= (prefix tên) &limit= &cursor= &fields= -> lookup trên voice_index
     try:
-        r = requests.get(f"{BASE}/voices", headers=HEADERS, timeout=20)
-        if r.status_code == 404:
-            r = requests.get(f"{BASE}/voices/search", headers=HEADERS, timeout=20)
+        params = parse_query(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        entry = voices_cache.get("mine", fetch_voices)
+        voice_index.sync(entry.etag, entry.value["voices"])
+        return cached_json(voice_index.query(params))
 
-        r.raise_for_status()
-        data = r.json()
-        voices = data.get("voices") or data.get("items") or data.get("results") or []
+    except Exception as e:
+        return error_response(e)
 
-        out = []
-        for v in voices:
-            vid = v.get("voice_id") or v.get("id")
-            if not vid:
-                continue
 
-            category = (v.get("category") or "").lower()
-            is_premade = v.get("is_premade") or v.get("premade")
+# ====== CACHE ADMIN ======
+@bp.route("/api/cache")
+def cache_info():
+    return jsonify({**{name: c.info() for name, c in CACHES.items()}, "voice_index": voice_index.info()})
 
-            # only load my voices
-            if category == "premade" or is_premade:
-                continue
 
-            labels = v.get("labels") or {}
-            lang_trained = labels.get("language") or labels.get("lang")
+@bp.route("/api/compression")
+def compression_info():
+    return jsonify(compression.info())
 
-            out.append({
-                "voice_id": vid,
-                "name": v.get("name") or vid,
-                "language_trained": lang_trained,
-                "labels": labels
-            })
 
-        return jsonify({"voices": out})
+@bp.route("/api/shared-state")
+def shared_state_info():
+    return jsonify(shared_state.info())
 
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
 
-@app.post("/api/tts-stream")   # ✅ đúng path bạn đang gọi
-def tts_stream():
-    data = request.get_json(silent=True) or {}
-    voice_id = data.get("voice_id")
-    text = data.get("text")
+@bp.post("/api/cache/invalidate")
+def cache_invalidate():
+    # ?name=agent|voices (bỏ trống = xoá hết). Nếu có ADMIN_TOKEN thì bắt buộc header X-Admin-Token
+    if ADMIN_TOKEN and request.headers.get("X-Admin-Token") != ADMIN_TOKEN:
+        return jsonify({"error": "forbidden"}), 403
+
+    name = request.args.get("name")
+    if name and name not in CACHES:
+        return jsonify({"error": f"unknown cache '{name}'"}), 400
+
+    targets = [CACHES[name]] if name else CACHES.values()
+    return jsonify({"invalidated": {c.name: c.invalidate() for c in targets}})
+
+# ====== LOOKUP (mã tour / khách / booking qua n8n, lookup.py) ======
+# mặc định cùng webhook với signed-url, n8n phân nhánh theo "purpose"
+N8N_LOOKUP_ENDPOINT = (os.getenv("N8N_LOOKUP_ENDPOINT") or N8N_SIGNED_URL_ENDPOINT).strip()
+lookups = LookupService()
+CACHES["lookup"] = lookups
+
+
+def fetch_lookup(keys):
+    r = http.post(N8N_LOOKUP_ENDPOINT, json=request_payload(keys), dependency="n8n", op="lookup")
+    r.raise_for_status()
+    with tracing.span("n8n.parse", op="lookup"):
+        return r.json()
 
-    if not voice_id or not text:
-        return jsonify({"error": "voice_id and text are required"}), 400
 
-    url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}/stream"
+@bp.route("/api/lookup", methods=["GET", "POST"])
+def lookup_codes():
+    # GET ?tour=&customer=&order= (nhiều mã: dấu phẩy); POST JSON cùng key hoặc {"codes": [...]}
+    if not N8N_LOOKUP_ENDPOINT:
+        return jsonify({"error": "Thiếu N8N_LOOKUP_ENDPOINT / N8N_SIGNED_URL_ENDPOINT"}), 503
+    data = request.get_json(silent=True) if request.method == "POST" else request.args
+    try:
+        keys = parse_codes(data or {})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"results": lookups.lookup(keys, fetch_lookup)})
+
+
+# ====== TTS STREAM ======
+tts_cache = TTSCache() if TTS_CACHE_ENABLED else None
+
+
+def tts_upstream(voice_id, text):
+    # -> hàm mở stream upstream (requests.Response, stream=True)
+    url = f"{BASE}/text-to-speech/{voice_id}/stream"
     headers = {
         "xi-api-key": ELEVENLABS_API_KEY,
         "Content-Type": "application/json"
     }
     payload = {
         "text": text,
-        "model_id": "eleven_turbo_v2",
-        "voice_settings": {"stability": 0.4, "similarity_boost": 0.8}
+        "model_id": TTS_MODEL_ID,
+        "voice_settings": TTS_VOICE_SETTINGS
     }
+    return lambda: http.post(url, headers=headers, json=payload, stream=True,
+                             dependency="elevenlabs_tts")
+
+
+@bp.route("/api/tts-stream", methods=["GET", "POST"])   # ✅ đúng path bạn đang gọi
+def tts_stream():
+    # POST JSON như cũ; GET ?voice_id=&text= để <audio src> dùng được Range khi cache hit
+    data = request.get_json(silent=True) if request.method == "POST" else request.args
+    data = data or {}
+    voice_id = data.get("voice_id")
+    text = data.get("text")
+
+    if not voice_id or not text:
+        return jsonify({"error": "voice_id and text are required"}), 400
+
+    t0 = time.perf_counter()
+    if wants_pipeline(data.get("pipeline"), text):
+        return tts_pipelined(voice_id, text, t0)
+
+    open_upstream = tts_upstream(voice_id, text)
+    if tts_cache is None:
+        return tts_relay(open_upstream, t0)
+
+    key = cache_key(voice_id, TTS_MODEL_ID, TTS_VOICE_SETTINGS, text)
+    path = tts_cache.lookup(key)
+    if path:
+        # ✅ HIT: không gọi upstream, hỗ trợ Range / If-None-Match
+        resp = send_file(path, mimetype="audio/mpeg", conditional=True, etag=key, max_age=86400)
+        resp.headers["X-TTS-Cache"] = "hit"
+        return resp
+
+    try:
+        fill, err = tts_cache.join_or_start(key, open_upstream)
+    except Exception as e:
+        return error_response(e)
+    if err is not None:
+        return jsonify({"error": err.text}), 500
+
+    # request trùng đang chờ fill của request khác
+    error = fill.wait_ready(timeout=http.timeout[1])
+    if error or not fill.ready:
+        tts_cache.release(fill)
+        return jsonify({"error": error or "TTS upstream timeout"}), 502
+
+    resp = Response(metered(tts_cache.iter_fill(fill), "cache_miss", t0), mimetype="audio/mpeg")
+    resp.headers["X-TTS-Cache"] = "miss"
+    resp.headers["ETag"] = f'"{key}"'
+    return resp
 
-    r = requests.post(url, headers=headers, json=payload, stream=True)
+
+def tts_relay(open_upstream, started_at=None):
+    # không cache: relay thẳng upstream -> client (chunk lớn, gộp chunk, backpressure)
+    try:
+        r = open_upstream()
+    except Exception as e:
+        return error_response(e)
     if r.status_code != 200:
-        return jsonify({"error": r.text}), 500
+        body = r.text
+        r.close()
+        return jsonify({"error": body}), 500
+
+    return Response(relay(r, source="upstream", started_at=started_at), mimetype="audio/mpeg")
+
+
+# ---- pipelined: cắt câu, synthesize song song, nối MP3 theo thứ tự ----
+_tts_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="tts-pipeline")
+
+
+def tts_segment(voice_id, segment):
+    # 1 segment -> iterable bytes đang tải; đi qua cache nếu bật (câu lặp lại = hit)
+    open_upstream = tts_upstream(voice_id, segment)
+    if tts_cache is None:
+        r = open_upstream()
+        if r.status_code != 200:
+            body = r.text
+            r.close()
+            raise SegmentError(r.status_code, body)
+        return buffered(r)
+
+    key = cache_key(voice_id, TTS_MODEL_ID, TTS_VOICE_SETTINGS, segment)
+    path = tts_cache.lookup(key)
+    if path:
+        return iter_file(path)
+    fill, err = tts_cache.join_or_start(key, open_upstream)
+    if err is not None:
+        raise SegmentError(err.status_code, err.text)
+    error = fill.wait_ready(timeout=http.timeout[1])
+    if error or not fill.ready:
+        tts_cache.release(fill)
+        raise SegmentError(502, error or "TTS upstream timeout")
+    return tts_cache.iter_fill(fill)
+
+
+def tts_pipelined(voice_id, text, started_at):
+    segments = split_text(text)
+    audio = pipelined(segments, tracing.bind(lambda seg: tts_segment(voice_id, seg)), _tts_executor)
+    try:
+        # chờ audio của segment đầu: lỗi ở đây vẫn trả được HTTP error bình thường
+        head = next(audio, b"")
+    except Exception as e:
+        return error_response(e)
 
     def generate():
-        for chunk in r.iter_content(1024):
-            if chunk:
-                yield chunk
+        try:
+            yield head
+            yield from audio
+        finally:
+            audio.close()
+
+    resp = Response(metered(generate(), "pipelined", started_at), mimetype="audio/mpeg")
+    resp.headers["X-TTS-Segments"] = str(len(segments))
+    return resp
+
+
+@bp.route("/api/tts-cache")
+def tts_cache_info():
+    return jsonify(tts_cache.info() if tts_cache else {"enabled": False})
 
-    return Response(generate(), mimetype="audio/mpeg")
+
+def tts_stream_summary():
+    # TTFB / throughput / bytes theo nguồn stream (upstream | cache_miss)
+    bytes_total = stream_bytes.snapshot()
+    aborted = stream_aborted.snapshot()
+    return {
+        "ttfb_seconds": stream_ttfb.summary(),
+        "bytes_per_second": stream_rate.summary(),
+        "bytes_total": {k[0]: v for k, v in bytes_total.items()},
+        "aborted": {k[0]: v for k, v in aborted.items()},
+    }
+
+
+@bp.route("/api/tts-stream-stats")
+def tts_stream_stats():
+    return jsonify(tts_stream_summary())
 
 # ====== SUPPORTED LANGUAGES ======
-@app.route("/api/supported-languages")
+@bp.route("/api/supported-languages")
 def supported_languages():
-    langs = [
-        {"code":"en","name":"English"},
-        {"code":"ja","name":"Japanese"},
-        {"code":"zh","name":"Chinese"},
-        {"code":"de","name":"German"},
-        {"code":"hi","name":"Hindi"},
-        {"code":"fr","name":"French"},
-        {"code":"ko","name":"Korean"},
-        {"code":"pt","name":"Portuguese"},
-        {"code":"it","name":"Italian"},
-        {"code":"es","name":"Spanish"},
-        {"code":"id","name":"Indonesian"},
-        {"code":"nl","name":"Dutch"},
-        {"code":"tr","name":"Turkish"},
-        {"code":"fil","name":"Filipino"},
-        {"code":"pl","name":"Polish"},
-        {"code":"sv","name":"Swedish"},
-        {"code":"bg","name":"Bulgarian"},
-        {"code":"ro","name":"Romanian"},
-        {"code":"ar","name":"Arabic"},
-        {"code":"cs","name":"Czech"},
-        {"code":"el","name":"Greek"},
-        {"code":"fi","name":"Finnish"},
-        {"code":"hr","name":"Croatian"},
-        {"code":"ms","name":"Malay"},
-        {"code":"sk","name":"Slovak"},
-        {"code":"da","name":"Danish"},
-        {"code":"ta","name":"Tamil"},
-        {"code":"uk","name":"Ukrainian"},
-        {"code":"ru","name":"Russian"},
-    ]
-    return jsonify({"languages": langs})
+    return jsonify({"languages": SUPPORTED_LANGUAGES})
+
+# ====== UPSTREAM POOL STATS ======
+@bp.route("/api/upstream-stats")
+def upstream_stats():
+    # pool hits / kết nối mới / thời gian chờ theo host -> dùng để chỉnh UPSTREAM_POOL_MAXSIZE
+    return jsonify(http.stats())
+
+
+@bp.route("/api/upstream-status")
+def upstream_status():
+    # trạng thái circuit breaker + read timeout hiện tại theo dependency
+    return jsonify(breakers.info())
+
+
+@bp.route("/api/upstream-routes")
+def upstream_routes():
+    # URL variant đang dùng cho agent / voices
+    return jsonify(routes.info())
+
+
+# ====== PROMETHEUS /metrics ======
+_BREAKER_STATE = {"closed": 0, "half_open": 1, "open": 2}
+
+GaugeFunc("circuit_breaker_state", "0 = closed, 1 = half_open, 2 = open", labelnames=("dependency",),
+          fn=lambda: {(name, ): _BREAKER_STATE[b["state"]] for name, b in breakers.info().items()})
+GaugeFunc("response_cache_events_total", "Sự kiện TTL cache agent / voices", labelnames=("cache", "event"),
+          kind="counter",
+          fn=lambda: {(c.name, ev): n for c in CACHES.values() for ev, n in c.stats.items()})
+GaugeFunc("token_pool_depth", "Số item mint sẵn trong pool", labelnames=("pool",),
+          fn=lambda: {(p.name, ): p.info()["depth"] or 0 for p in TOKEN_POOLS})
+GaugeFunc("tts_cache_bytes", "Dung lượng cache audio TTS trên disk",
+          fn=lambda: {(): tts_cache.info()["bytes"]} if tts_cache else {})
+GaugeFunc("tts_cache_events_total", "Sự kiện cache audio TTS", labelnames=("event",), kind="counter",
+          fn=lambda: {(ev, ): n for ev, n in tts_cache.stats.items()} if tts_cache else {})
+
+
+def metrics_text():
+    return render_prometheus()
+
+
+@bp.route("/metrics")
+def metrics():
+    return Response(metrics_text(), content_type="text/plain; version=0.0.4; charset=utf-8")
 
 # =========================================================
 # N8N SIGNED URL HELPERS (BỔ SUNG NGUYÊN KHỐI)
@@ -233,84 +803,422 @@ def extract_signed_url(r: requests.Response):
     n8n trả application/json + body JSON.
     Nhưng signed_url có thể nằm lồng sâu hoặc key khác.
     """
-    ct = (r.headers.get("content-type") or "").lower()
-    text = r.text.strip()
+    with tracing.span("n8n.parse", op="signed_url") as sp:
+        ct = (r.headers.get("content-type") or "").lower()
+        text = r.text.strip()
+        sp.set(bytes=len(text))
 
-    # 1) Nếu là JSON content-type
-    if "application/json" in ct:
-        data = r.json()
-        signed = find_signed_url_deep(data)
-        return signed or "", data
+        # 1) Nếu là JSON content-type
+        if "application/json" in ct:
+            data = r.json()
+            signed = find_signed_url_deep(data)
+            sp.set(found=bool(signed))
+            return signed or "", data
 
-    # 2) Nếu lỡ content-type sai nhưng body vẫn là JSON
-    try:
-        data = json.loads(text)
-        signed = find_signed_url_deep(data)
-        return signed or "", data
-    except Exception:
-        pass
+        # 2) Nếu lỡ content-type sai nhưng body vẫn là JSON
+        try:
+            data = json.loads(text)
+            signed = find_signed_url_deep(data)
+            sp.set(found=bool(signed), content_type=ct)
+            return signed or "", data
+        except Exception:
+            pass
 
-    # 3) fallback text thẳng
-    return "", {"raw_text": text}
+        # 3) fallback text thẳng
+        sp.set(found=False, content_type=ct)
+        return "", {"raw_text": text}
 
 
 # =========================================================
 # N8N SIGNED URL ROUTE (BỔ SUNG)
 # =========================================================
-@app.route("/signed-url")
-def signed_url():
+SIGNED_URL_STRATEGY = (os.getenv("SIGNED_URL_STRATEGY") or "sequential").strip().lower()
+SIGNED_URL_HEDGE_DELAY = float(os.getenv("SIGNED_URL_HEDGE_DELAY", "1.0"))
+
+signed_url_latency = Histogram(
+    "signed_url_source_seconds", "Latency lấy signed_url theo nguồn",
+    labelnames=("source", "outcome"),
+)
+signed_url_wins = Counter("signed_url_wins_total", "Nguồn thắng khi resolve signed_url",
+                          labelnames=("source", "strategy"))
+
+_hedge_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="signed-url")
+
+
+def signed_from_n8n():
     """
-    Browser -> localhost -> POST n8n -> signed_url
-    fallback ElevenLabs nếu n8n fail/rỗng
+    -> (signed, raw, ok). POST n8n; signed rỗng nếu n8n không trả wss://
     """
-    try:
-        payload = {"purpose": "get_signed_url"}
-        if AGENT_ID:
-            payload["agent_id"] = AGENT_ID
-
-        # ✅ PRIMARY: POST n8n
-        r = requests.post(
-            N8N_SIGNED_URL_ENDPOINT,
-            json=payload,
-            timeout=20
-        )
+    payload = {"purpose": "get_signed_url"}
+    if AGENT_ID:
+        payload["agent_id"] = AGENT_ID
 
+    t0 = time.perf_counter()
+    outcome = "error"
+    try:
+        r = http.post(N8N_SIGNED_URL_ENDPOINT, json=payload, dependency="n8n")
         signed, raw = extract_signed_url(r)
-        print("signed_from_n8n =", signed)
-
+        outcome = "ok" if (r.ok and signed) else ("empty" if r.ok else "error")
         if not r.ok:
-            return jsonify({
-                "error": f"n8n error status={r.status_code}",
-                "raw": raw
-            }), 500
+            raw = {"error": f"n8n error status={r.status_code}", "raw": raw}
+        return signed, raw, r.ok
+    finally:
+        signed_url_latency.observe(time.perf_counter() - t0, source="n8n", outcome=outcome)
 
-        if signed:
-            return jsonify({"signed_url": signed, "source": "n8n"})
 
-        # --- FALLBACK: gọi thẳng ElevenLabs ---
-        r2 = requests.get(
+def signed_from_elevenlabs():
+    """
+    -> (signed, raw, ok). Gọi thẳng ElevenLabs get-signed-url
+    """
+    t0 = time.perf_counter()
+    outcome = "error"
+    try:
+        r2 = http.get(
             f"{BASE}/convai/conversation/get-signed-url",
             params={"agent_id": AGENT_ID},
             headers=HEADERS,
-            timeout=20
+            dependency="elevenlabs_convai"
         )
         r2.raise_for_status()
-        data2 = r2.json()
-        signed2 = data2.get("signed_url")
+        with tracing.span("elevenlabs.parse", op="signed_url"):
+            data2 = r2.json()
+        signed2 = data2.get("signed_url") or ""
+        outcome = "ok" if signed2 else "empty"
+        return signed2, data2, True
+    finally:
+        signed_url_latency.observe(time.perf_counter() - t0, source="elevenlabs", outcome=outcome)
+
+
+SIGNED_URL_SOURCES = {"n8n": signed_from_n8n, "elevenlabs": signed_from_elevenlabs}
 
-        print("signed_from_elevenlabs =", signed2)
 
+def resolve_signed_url():
+    """
+    Browser -> localhost -> POST n8n -> signed_url
+    fallback ElevenLabs nếu n8n fail/rỗng. -> (body, status)
+
+    SIGNED_URL_STRATEGY:
+      sequential  n8n xong (rỗng) mới gọi ElevenLabs — như cũ
+      hedged      n8n chưa trả sau SIGNED_URL_HEDGE_DELAY giây thì gọi thêm ElevenLabs
+      race        gọi cả 2 cùng lúc
+    """
+    if SIGNED_URL_STRATEGY in ("hedged", "race"):
+        delay = 0.0 if SIGNED_URL_STRATEGY == "race" else SIGNED_URL_HEDGE_DELAY
+        return hedged_signed_url(delay)
+
+    try:
+        # ✅ PRIMARY: POST n8n (circuit open -> coi như rỗng, đi thẳng fallback)
+        try:
+            signed, raw, ok = signed_from_n8n()
+        except CircuitOpenError as e:
+            signed, raw, ok = "", {"error": str(e)}, True
+        if not ok:
+            return raw, 500
+
+        if signed:
+            signed_url_wins.inc(source="n8n", strategy="sequential")
+            return {"signed_url": signed, "source": "n8n"}, 200
+
+        # --- FALLBACK: gọi thẳng ElevenLabs ---
+        signed2, data2, _ = signed_from_elevenlabs()
         if not signed2:
-            return jsonify({
+            return {
                 "error": "ElevenLabs fallback cũng không trả signed_url",
                 "raw_from_n8n": raw,
                 "raw_from_elevenlabs": data2
-            }), 500
+            }, 500
+
+        signed_url_wins.inc(source="elevenlabs", strategy="sequential")
+        return {"signed_url": signed2, "source": "elevenlabs"}, 200
+
+    except Exception as e:
+        return error_body(e)
+
+
+def hedged_signed_url(delay):
+    """
+    n8n chạy trước; ElevenLabs bắt đầu sau `delay` giây (hoặc ngay khi n8n lỗi/rỗng).
+    wss:// hợp lệ nào về trước thì thắng, request còn lại bị huỷ/bỏ qua.
+    """
+    strategy = "race" if delay <= 0 else "hedged"
+    futures = {_hedge_executor.submit(tracing.bind(signed_from_n8n)): "n8n"}
+    raws = {}
+    fallback_started = False
+
+    def start_fallback():
+        futures[_hedge_executor.submit(tracing.bind(signed_from_elevenlabs))] = "elevenlabs"
+
+    if delay <= 0:
+        start_fallback()
+        fallback_started = True
+
+    t0 = time.monotonic()
+    while futures:
+        timeout = None if fallback_started else max(0.0, delay - (time.monotonic() - t0))
+        done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done:
+            start_fallback()
+            fallback_started = True
+            continue
+
+        for f in done:
+            source = futures.pop(f)
+            try:
+                signed, raw, _ = f.result()
+            except Exception as e:
+                signed, raw = "", {"error": str(e)}
+            raws[source] = raw
+
+            if signed:
+                # request thua: chưa chạy thì huỷ, đang chạy thì bỏ kết quả
+                for other in futures:
+                    other.cancel()
+                signed_url_wins.inc(source=source, strategy=strategy)
+                return {"signed_url": signed, "source": source}, 200
 
-        return jsonify({"signed_url": signed2, "source": "elevenlabs"})
+        if not fallback_started:
+            start_fallback()
+            fallback_started = True
 
+    return {
+        "error": "Không lấy được signed_url từ n8n lẫn ElevenLabs",
+        "raw_from_n8n": raws.get("n8n"),
+        "raw_from_elevenlabs": raws.get("elevenlabs")
+    }, 500
+
+
+@bp.route("/api/signed-url-stats")
+def signed_url_stats():
+    # histogram latency theo nguồn -> chỉnh SIGNED_URL_HEDGE_DELAY (~p95 của n8n)
+    return jsonify({
+        "strategy": SIGNED_URL_STRATEGY,
+        "hedge_delay": SIGNED_URL_HEDGE_DELAY,
+        "latency": signed_url_latency.summary(),
+        "wins": {",".join(k): v for k, v in signed_url_wins.snapshot().items()},
+    })
+
+
+@bp.route("/signed-url")
+def signed_url():
+    return serve_pooled(text_url_pool, resolve_signed_url)
+
+
+# =========================================================
+# PRE-MINTED SIGNED URL / TOKEN POOL
+# =========================================================
+def pool_minter(resolve):
+    # TokenPool.mint(): chỉ giữ kết quả 200, lỗi thì raise để pool thử lại sau
+    def mint():
+        body, status = resolve()
+        if status != 200:
+            raise RuntimeError(body.get("error") or f"status={status}")
+        return body
+    return mint
+
+
+# SHARED_STATE=sqlite|redis -> pool chung cho mọi worker (shared_state.py)
+# signed URL: TOKEN_POOL_TTL; token: exp trong JWT, không đọc được thì TOKEN_POOL_TOKEN_TTL
+call_url_pool = make_pool("call_ws_url", pool_minter(mint_call_ws_url))
+text_url_pool = make_pool("signed_url", pool_minter(resolve_signed_url))
+token_pool = make_pool("conversation_token", pool_minter(mint_conversation_token),
+                       ttl=POOL_TOKEN_TTL, expires_at=jwt_expires_at("token"))
+TOKEN_POOLS = [call_url_pool, text_url_pool, token_pool]
+
+
+def take_pooled(pool, resolve):
+    # pool có sẵn -> pop local; rỗng/tắt -> mint trực tiếp như cũ. -> (body, status)
+    with tracing.span("token_pool.take", pool=pool.name) as sp:
+        body = pool.take() if TOKEN_POOL_ENABLED else None
+        sp.set(hit=body is not None)
+    if body is not None:
+        return body, 200
+    return resolve()
+
+
+def serve_pooled(pool, resolve):
+    body, status = take_pooled(pool, resolve)
+    resp = jsonify(body)
+    if body.get("retry_after"):
+        resp.headers["Retry-After"] = str(body["retry_after"])
+    return resp, status
+
+
+@bp.route("/api/token-pool")
+def token_pool_info():
+    return jsonify({"enabled": TOKEN_POOL_ENABLED, "pools": {p.name: p.info() for p in TOKEN_POOLS}})
+
+
+# =========================================================
+# BOOTSTRAP (page load: 1 request thay cho agent + voices + languages + signed-url)
+# =========================================================
+# Các nguồn chạy song song ở server -> thời gian = nguồn chậm nhất, không phải tổng.
+# Nguồn nào lỗi / quá BOOTSTRAP_TIMEOUT thì vẫn trả phần còn lại, lỗi ghi vào "errors";
+# fetch chưa xong vẫn chạy tiếp nền và làm ấm cache cho lần sau.
+BOOTSTRAP_TIMEOUT  = float(os.getenv("BOOTSTRAP_TIMEOUT") or 3.0)
+BOOTSTRAP_SECTIONS = ("agent", "voices", "languages", "signed_url")
+BOOTSTRAP_VOICES   = parse_query({"fields": "voice_id,name,language_trained,label"})
+
+_bootstrap_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="bootstrap")
+
+
+def bootstrap_include(args):
+    # ?include=agent,voices -> chỉ các phần đó; bỏ trống = tất cả
+    include = [p.strip() for p in (args.get("include") or "").split(",") if p.strip()]
+    unknown = [p for p in include if p not in BOOTSTRAP_SECTIONS]
+    if unknown:
+        raise ValueError(f"unknown section(s): {', '.join(unknown)} (có: {', '.join(BOOTSTRAP_SECTIONS)})")
+    return [p for p in BOOTSTRAP_SECTIONS if p in include] if include else list(BOOTSTRAP_SECTIONS)
+
+
+def signed_url_value(body, status):
+    if status != 200 or not body.get("signed_url"):
+        raise RuntimeError(body.get("error") or f"status={status}")
+    return body["signed_url"]
+
+
+def bootstrap_payload(include, results, timings):
+    """
+    results: name -> ("ok", value) | ("error", body). -> payload gộp, compact.
+    """
+    out = {"errors": {}, "timings": timings}
+    for name in include:
+        state, value = results.get(name) or ("error", {"error": "timeout", "timeout": BOOTSTRAP_TIMEOUT})
+        if state == "ok":
+            out[name] = value
+        else:
+            out[name] = None
+            out["errors"][name] = value
+    return out
+
+
+def boot_agent():
+    return project_entry(agent_cache.get(AGENT_ID, fetch_agent), AGENT_DEFAULT_FIELDS).value
+
+
+def boot_voices():
+    entry = voices_cache.get("mine", fetch_voices)
+    voice_index.sync(entry.etag, entry.value["voices"])
+    return voice_index.query(BOOTSTRAP_VOICES).value["voices"]
+
+
+def boot_signed_url():
+    return signed_url_value(*take_pooled(text_url_pool, resolve_signed_url))
+
+
+BOOTSTRAP_FETCHERS = {"agent": boot_agent, "voices": boot_voices,
+                      "languages": lambda: SUPPORTED_LANGUAGES, "signed_url": boot_signed_url}
+
+
+def _timed(fn):
+    t0 = time.perf_counter()
+    try:
+        result = ("ok", fn())
     except Exception as e:
-        return jsonify({"error": str(e)}), 500    
+        result = ("error", error_body(e)[0])
+    return result, round((time.perf_counter() - t0) * 1000, 1)
+
+
+@bp.route("/api/bootstrap")
+def bootstrap():
+    try:
+        include = bootstrap_include(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    futures = {_bootstrap_executor.submit(tracing.bind(_timed), BOOTSTRAP_FETCHERS[name]): name
+               for name in include}
+    done, _ = wait(futures, timeout=BOOTSTRAP_TIMEOUT)
+    results, timings = {}, {}
+    for f in done:
+        results[futures[f]], timings[futures[f]] = f.result()
+
+    resp = jsonify(bootstrap_payload(include, results, timings))
+    resp.headers["Cache-Control"] = "no-store"      # có signed_url dùng 1 lần
+    return resp
+
+
+# ====== HEALTH / READINESS ======
+@bp.route("/healthz")
+def healthz():
+    return jsonify(health())
+
+
+@bp.route("/readyz")
+def readyz():
+    # 503 tới khi warm-up xong -> orchestrator chưa route traffic vào instance này
+    info = current_app.extensions["warmup"].info()
+    if info["ready"]:
+        return jsonify(info)
+    resp = jsonify(info)
+    resp.headers["Retry-After"] = "1"
+    return resp, 503
+
+
+# =========================================================
+# WARM-UP
+# =========================================================
+def upstream_urls():
+    return [u for u in (BASE, N8N_SIGNED_URL_ENDPOINT) if u]
+
+
+def warm_assets():
+    # asset có hash + nén sẵn: template dùng asset_url("js/assistant.js")
+    if not assets.ASSETS_ENABLED:
+        return {"skipped": True}
+    return {"files": len(assets.build())}
+
+
+def warm_connections():
+    return [http.preconnect(url, WARMUP_CONNECTIONS) for url in upstream_urls()]
+
+
+def warm_agent():
+    agent_cache.get(AGENT_ID, fetch_agent)
+
+
+def warm_voices():
+    return {"voices": len(voices_cache.get("mine", fetch_voices).value["voices"])}
+
+
+# =========================================================
+# APP FACTORY
+# =========================================================
+def create_app():
+    """
+    Entry point duy nhất (python server.py, gunicorn "app:create_app()", flask --app app).
+    Kiểm tra config, đăng ký route, bắt đầu warm-up nền rồi trả app ngay.
+    """
+    errors = config_errors()
+    if errors:
+        raise RuntimeError("; ".join(errors))
+
+    app = Flask(__name__, static_folder="static", template_folder="templates")
+    app.json = FastJSONProvider(app)
+    CORS(app, expose_headers=TRACE_EXPOSE_HEADERS)
+    app.jinja_env.globals["asset_url"] = assets.url
+    app.register_blueprint(bp)
+
+    warmup = app.extensions["warmup"] = Warmup()
+    warmup.add("assets", warm_assets)
+    warmup.add("connections", warm_connections)
+    warmup.add("agent", warm_agent)
+    warmup.add("voices", warm_voices)
+    warmup.start()
+    return app
+
+
+_app = None
+
+
+def __getattr__(name):
+    # tương thích "app:app" (gunicorn / import cũ): tạo app lần đầu được truy cập
+    global _app
+    if name == "app":
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(name)
+
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=PORT, debug=True)
+    create_app().run(host="0.0.0.0", port=PORT, debug=True)
@@ -0,0 +1,924 @@
+# asgi.py
+# Async (ASGI) serving mode — cùng các route với app.py nhưng upstream I/O là
+# asyncio (httpx.AsyncClient), stream TTS bằng async generator, nên 1 process
+# giữ được hàng nghìn preview stream / token request mà không chiếm worker thread.
+#
+# Chạy production:
+#   python server.py --asgi                         # hoặc python asgi.py: hypercorn, bind 0.0.0.0:$PORT
+#   hypercorn "asgi:create_app()" -b 0.0.0.0:8080 -w 4   # nhiều worker process
+#   uvicorn asgi:create_app --factory --host 0.0.0.0 --port 8080
+
+import asyncio
+import os
+import time
+
+from quart import (Blueprint, Quart, Response, current_app, g, jsonify, render_template, request,
+                   send_file, send_from_directory, websocket)
+from quart.wrappers.response import IterableBody
+from quart_cors import cors
+
+from app import (
+    ADMIN_TOKEN, AGENT_DEFAULT_FIELDS, AGENT_FIELDS, AGENT_ID, BASE, BOOTSTRAP_TIMEOUT,
+    BOOTSTRAP_VOICES, CACHES, ELEVENLABS_API_KEY, HEADERS, N8N_LOOKUP_ENDPOINT,
+    N8N_SIGNED_URL_ENDPOINT, PORT, SIGNED_URL_HEDGE_DELAY, SIGNED_URL_STRATEGY, SUPPORTED_LANGUAGES,
+    TOKEN_POOLS, TOKEN_POOL_ENABLED, TRACE_EXPOSE_HEADERS, TTS_MODEL_ID, TTS_VOICE_SETTINGS,
+    admission, admission_class, agent_cache, agent_route, bootstrap_include, bootstrap_payload,
+    call_url_pool, client_keys, config_errors, error_body, extract_signed_url, http, lookups,
+    metrics_end, metrics_record, metrics_start, metrics_text, parse_fields, project_entry,
+    project_voices, signed_url_latency, signed_url_value, signed_url_wins, summarize_agent,
+    text_url_pool, token_pool, trace_begin, trace_headers, tts_cache, tts_stream_summary,
+    tts_upstream, voice_index, voices_cache, voices_route, warm_assets, warm_connections,
+)
+from lookup import parse_codes, request_payload
+from tts_cache import cache_key
+from tts_pipeline import SegmentError, abuffered, apipelined, split_text, wants_pipeline
+from stream_relay import ametered, arelay
+from breaker import CircuitOpenError
+import call_relay
+from upstream import breakers, make_async_client, routes
+from admission import Rejected, aguarded
+import assets
+import compression
+import shared_state
+from fast_json import FastJSONProvider
+from voice_index import parse_query
+from warmup import Warmup, health
+import tracing
+from profiler import PROFILER_ENABLED, ProfilerBusy, parse_request as parse_profile_request, profiler
+
+# Route gắn vào blueprint, chỉ đăng ký vào app trong create_app() (cuối file)
+bp = Blueprint("asgi", __name__)
+
+client = None
+
+
+# ====== TRACING (tracing.py, hook như app.py) ======
+@bp.before_app_request
+async def _trace_before():
+    g.trace = trace_begin(request)
+
+
+@bp.after_app_request
+async def _trace_after(resp):
+    # stream: ghi trace khi body stream xong; còn lại ghi ngay (hook này chạy cuối)
+    trace = g.pop("trace", None)
+    if trace is not None and isinstance(resp.response, IterableBody):
+        resp.response = IterableBody(traced(resp.response, trace, resp.status_code))
+    elif trace is not None:
+        trace.finish(resp.status_code)
+    return trace_headers(resp, trace)
+
+
+@bp.teardown_app_request
+async def _trace_teardown(exc):
+    trace = g.pop("trace", None)
+    if trace is not None and exc is not None:
+        trace.finish(500, error=repr(exc))
+    elif trace is not None:
+        trace.finish()
+
+
+async def traced(body, trace, status):
+    try:
+        async with body as chunks:
+            async for chunk in chunks:
+                yield chunk
+    finally:
+        trace.finish(status)
+
+
+@bp.route("/api/traces")
+async def traces_info():
+    return jsonify({**tracing.info(), "recent": list(tracing.recent)})
+
+
+@bp.route("/api/profile")
+async def profile():
+    # như app.profile; sample chạy trên thread riêng, event loop vẫn được chụp stack
+    if not PROFILER_ENABLED:
+        return jsonify({"error": "profiler tắt (PROFILER_ENABLED=1 để bật)"}), 404
+    if ADMIN_TOKEN and request.headers.get("X-Admin-Token") != ADMIN_TOKEN:
+        return jsonify({"error": "forbidden"}), 403
+    try:
+        seconds, hz, fmt, idle = parse_profile_request(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        result = await asyncio.to_thread(profiler.sample, seconds, hz, idle)
+    except ProfilerBusy as e:
+        return jsonify({"error": str(e)}), 409
+    if fmt == "speedscope":
+        return jsonify(result.speedscope())
+    return Response(result.folded(), mimetype="text/plain")
+
+
+# ====== METRICS (per route) — dùng chung metric với app.py ======
+@bp.before_app_request
+async def _metrics_before():
+    metrics_start(g, request.url_rule)
+
+
+@bp.after_app_request
+async def _metrics_after(resp):
+    metrics_record(g, request.method, resp.status_code)
+    return resp
+
+
+@bp.after_app_request
+async def _compress(resp):
+    return await compression.aapply(resp, request.headers.get("Accept-Encoding"))
+
+
+@bp.teardown_app_request
+async def _metrics_teardown(exc):
+    metrics_end(g)
+
+
+# ====== ADMISSION CONTROL (admission.py, state dùng chung với app.py) ======
+@bp.before_app_request
+async def _admit():
+    cls = admission_class(request)
+    if cls is None:
+        return None
+    try:
+        with tracing.span("admission", cls=cls):
+            g.admission = await admission.aacquire(cls, *client_keys(request))
+    except Rejected as e:
+        return rejected_response(e)
+    return None
+
+
+@bp.after_app_request
+async def _admission_stream(resp):
+    ticket = g.get("admission")
+    if ticket is not None and isinstance(resp.response, IterableBody):
+        resp.response = IterableBody(aguarded(resp.response, ticket))
+        g.admission = None
+    return resp
+
+
+@bp.teardown_app_request
+async def _admission_release(exc):
+    ticket = g.pop("admission", None)
+    if ticket is not None:
+        ticket.release()
+
+
+@bp.route("/api/admission")
+async def admission_info():
+    return jsonify(admission.info())
+
+
+@bp.before_app_serving
+async def _open_client():
+    global client
+    client = make_async_client()
+    # warm-up cần event loop (prefetch qua async client) -> start ở đây, không phải create_app()
+    current_app.extensions["warmup"].start()
+
+
+@bp.after_app_serving
+async def _close_client():
+    if client is not None:
+        await client.aclose()
+
+
+def error_response(e):
+    body, status = error_body(e)
+    resp = jsonify(body)
+    if status == 503:
+        resp.headers["Retry-After"] = str(body["retry_after"])
+    return resp, status
+
+
+def rejected_response(e):
+    resp = jsonify(e.body())
+    if e.retry_after is not None:
+        resp.headers["Retry-After"] = str(e.retry_after)
+    return resp, e.status
+
+
+# ====== HOME ======
+async def html_page(html):
+    etag, variants = assets.page(html)
+    encoding = assets.negotiate(request.headers.get("Accept-Encoding"), variants)
+    resp = Response(variants[encoding], mimetype="text/html")
+    resp.headers.update(assets.headers(encoding, immutable=False))
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.set_etag(f"{etag}-{encoding or 'identity'}")
+    return await resp.make_conditional(request)
+
+
+@bp.get("/")
+async def home():
+    return await html_page(await render_template("index.html"))
+
+
+@bp.get("/pcm-worklet.js")
+async def pcm_worklet():
+    return await send_from_directory("static", "pcm-worklet.js")
+
+
+@bp.get(f"{assets.ASSETS_PREFIX}<path:filename>")
+async def asset(filename):
+    found = assets.lookup(filename, request.headers.get("Accept-Encoding"))
+    if found is None:
+        return jsonify({"error": "not found"}), 404
+    path, encoding, mimetype = found
+    resp = await send_file(path, mimetype=mimetype, add_etags=False)
+    resp.headers.update(assets.headers(encoding))
+    return resp
+
+
+async def mint_call_ws_url():
+    url = f"{BASE}/convai/conversation/get-signed-url?agent_id={AGENT_ID}"
+
+    try:
+        r = await client.get(url, headers=HEADERS, dependency="elevenlabs_convai")
+    except Exception as e:
+        return error_body(e)
+    if r.status_code != 200:
+        return {"error": r.text}, 500
+
+    with tracing.span("elevenlabs.parse", op="call_ws_url"):
+        body = r.json()
+    signed_url = body.get("signed_url")
+    if not signed_url:
+        return {"error": "No signed_url in response", "raw": body}, 500
+
+    return {"ws_url": signed_url}, 200
+
+
+async def take_pooled(pool, resolve):
+    # pool (thread nền, sync client) có sẵn -> lấy 1 item; rỗng -> mint async trực tiếp
+    with tracing.span("token_pool.take", pool=pool.name) as sp:
+        body = (await pool.atake()) if TOKEN_POOL_ENABLED else None
+        sp.set(hit=body is not None)
+    if body is not None:
+        return body, 200
+    return await resolve()
+
+
+async def serve_pooled(pool, resolve):
+    body, status = await take_pooled(pool, resolve)
+    resp = jsonify(body)
+    if body.get("retry_after"):
+        resp.headers["Retry-After"] = str(body["retry_after"])
+    return resp, status
+
+
+@bp.route("/api/get-ws-url", methods=["POST"])
+async def get_ws_url():
+    if call_relay.RELAY_AVAILABLE:
+        # relay mode: browser nối vào /ws/call (binary frame), server tự mint signed url
+        return jsonify({"ws_url": "/ws/call", "relay": True})
+    return await serve_pooled(call_url_pool, mint_call_ws_url)
+
+
+# ====== CALL WS RELAY ======
+@bp.websocket("/ws/call")
+async def call_ws():
+    if not call_relay.RELAY_AVAILABLE:
+        await websocket.close(1008, "call relay disabled")
+        return
+
+    upstream_url = call_relay.CALL_WS_UPSTREAM
+    if not upstream_url:
+        body = (await call_url_pool.atake()) if TOKEN_POOL_ENABLED else None
+        if body is None:
+            body, status = await mint_call_ws_url()
+            if status != 200:
+                await websocket.close(1011, str(body.get("error"))[:120])
+                return
+        upstream_url = body["ws_url"]
+
+    await websocket.accept()
+    init = call_relay.initiation_message(voice_id=websocket.args.get("voice_id"),
+                                         language=websocket.args.get("language"))
+    try:
+        await call_relay.run(websocket.receive, websocket.send, upstream_url, init)
+    except Exception as e:
+        await websocket.close(1011, str(e)[:120])
+        return
+    await websocket.close(1000)
+
+
+@bp.route("/api/call-relay")
+async def call_relay_info():
+    snap = lambda c: {",".join(k): v for k, v in c.snapshot().items()}
+    return jsonify({
+        "enabled": call_relay.RELAY_AVAILABLE,
+        "sessions": snap(call_relay.relay_sessions),
+        "frames": snap(call_relay.relay_frames),
+        "bytes": snap(call_relay.relay_bytes),
+    })
+
+
+# ====== TOKEN ======
+async def mint_conversation_token():
+    try:
+        r = await client.get(
+            f"{BASE}/convai/conversation/token",
+            params={"agent_id": AGENT_ID},
+            headers=HEADERS,
+            dependency="elevenlabs_convai"
+        )
+        r.raise_for_status()
+        with tracing.span("elevenlabs.parse", op="token"):
+            data = r.json()
+        token = data.get("token") or data.get("conversation_token") or ""
+
+        if not token:
+            return {"error": "Không nhận được token", "raw": data}, 500
+        return {"token": token}, 200
+
+    except Exception as e:
+        return error_body(e)
+
+
+@bp.route("/conversation-token")
+async def conversation_token():
+    return await serve_pooled(token_pool, mint_conversation_token)
+
+
+@bp.route("/api/token-pool")
+async def token_pool_info():
+    return jsonify({"enabled": TOKEN_POOL_ENABLED, "pools": {p.name: p.info() for p in TOKEN_POOLS}})
+
+
+# ====== AGENT CONFIG ======
+async def cached_json(entry):
+    resp = jsonify(entry.value)
+    resp.set_etag(entry.etag)
+    resp.headers["Cache-Control"] = "no-cache"
+    return await resp.make_conditional(request)
+
+
+async def fetch_agent():
+    r = await agent_route.arequest(client, headers=HEADERS, dependency="elevenlabs_convai",
+                                   op="agents")
+    r.raise_for_status()
+    with tracing.span("agent.parse"):
+        return summarize_agent(r.json())
+
+
+@bp.route("/api/agent")
+async def get_agent():
+    try:
+        fields = parse_fields(request.args, AGENT_FIELDS, AGENT_DEFAULT_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        return await cached_json(project_entry(await agent_cache.aget(AGENT_ID, fetch_agent), fields))
+
+    except Exception as e:
+        return error_response(e)
+
+
+# ====== VOICES ======
+async def fetch_voices():
+    r = await voices_route.arequest(client, headers=HEADERS, dependency="elevenlabs_convai",
+                                    op="voices")
+    r.raise_for_status()
+    with tracing.span("voices.parse"):
+        return {"voices": project_voices(r.json())}
+
+
+@bp.route("/api/voices")
+async def list_my_voices():
+    try:
+        params = parse_query(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        entry = await voices_cache.aget("mine", fetch_voices)
+        voice_index.sync(entry.etag, entry.value["voices"])
+        return await cached_json(voice_index.query(params))
+
+    except Exception as e:
+        return error_response(e)
+
+
+# ====== CACHE ADMIN ======
+@bp.route("/api/cache")
+async def cache_info():
+    return jsonify({**{name: c.info() for name, c in CACHES.items()}, "voice_index": voice_index.info()})
+
+
+@bp.route("/api/compression")
+async def compression_info():
+    return jsonify(compression.info())
+
+
+@bp.route("/api/shared-state")
+async def shared_state_info():
+    return jsonify(shared_state.info())
+
+
+@bp.post("/api/cache/invalidate")
+async def cache_invalidate():
+    if ADMIN_TOKEN and request.headers.get("X-Admin-Token") != ADMIN_TOKEN:
+        return jsonify({"error": "forbidden"}), 403
+
+    name = request.args.get("name")
+    if name and name not in CACHES:
+        return jsonify({"error": f"unknown cache '{name}'"}), 400
+
+    targets = [CACHES[name]] if name else CACHES.values()
+    return jsonify({"invalidated": {c.name: c.invalidate() for c in targets}})
+
+
+@bp.route("/api/upstream-stats")
+async def upstream_stats():
+    # pool của client sync (fill TTS cache chạy trên thread); httpx client không có hook đếm pool
+    return jsonify(http.stats())
+
+
+@bp.route("/api/upstream-status")
+async def upstream_status():
+    return jsonify(breakers.info())
+
+
+@bp.route("/api/upstream-routes")
+async def upstream_routes():
+    return jsonify(routes.info())
+
+
+@bp.route("/metrics")
+async def metrics():
+    return Response(metrics_text(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# ====== LOOKUP (xem app.py / lookup.py) ======
+async def fetch_lookup(keys):
+    r = await client.post(N8N_LOOKUP_ENDPOINT, json=request_payload(keys), dependency="n8n", op="lookup")
+    r.raise_for_status()
+    with tracing.span("n8n.parse", op="lookup"):
+        return r.json()
+
+
+@bp.route("/api/lookup", methods=["GET", "POST"])
+async def lookup_codes():
+    if not N8N_LOOKUP_ENDPOINT:
+        return jsonify({"error": "Thiếu N8N_LOOKUP_ENDPOINT / N8N_SIGNED_URL_ENDPOINT"}), 503
+    data = (await request.get_json(silent=True)) if request.method == "POST" else request.args
+    try:
+        keys = parse_codes(data or {})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"results": await lookups.alookup(keys, fetch_lookup)})
+
+
+# ====== TTS STREAM ======
+@bp.route("/api/tts-stream", methods=["GET", "POST"])
+async def tts_stream():
+    data = await request.get_json(silent=True) if request.method == "POST" else request.args
+    data = data or {}
+    voice_id = data.get("voice_id")
+    text = data.get("text")
+
+    if not voice_id or not text:
+        return jsonify({"error": "voice_id and text are required"}), 400
+
+    t0 = time.perf_counter()
+    if wants_pipeline(data.get("pipeline"), text):
+        return await tts_pipelined(voice_id, text, t0)
+    if tts_cache is None:
+        return await tts_relay(voice_id, text, t0)
+
+    key = cache_key(voice_id, TTS_MODEL_ID, TTS_VOICE_SETTINGS, text)
+    path = tts_cache.lookup(key)
+    if path:
+        resp = await send_file(path, mimetype="audio/mpeg", add_etags=False, cache_timeout=86400)
+        resp.set_etag(key)
+        await resp.make_conditional(request, accept_ranges=True,
+                                    complete_length=os.path.getsize(path))
+        resp.headers["X-TTS-Cache"] = "hit"
+        return resp
+
+    # fill chạy trên thread nền (sync client) dùng chung với Flask mode;
+    # ở đây chỉ chờ header upstream trong thread, rồi đọc file bằng async waiter
+    try:
+        fill, err = await join_fill(key, tts_upstream(voice_id, text))
+    except Exception as e:
+        return error_response(e)
+    if err is not None:
+        return jsonify({"error": err.text}), 500
+
+    error = await ready_fill(fill)
+    if error:
+        return jsonify({"error": error}), 502
+
+    resp = Response(ametered(tts_cache.aiter_fill(fill), "cache_miss", t0), mimetype="audio/mpeg")
+    resp.headers["X-TTS-Cache"] = "miss"
+    resp.headers["ETag"] = f'"{key}"'
+    return resp
+
+
+async def join_fill(key, open_upstream):
+    # join_or_start chạy trong thread; task bị huỷ (client ngắt, segment prefetch bị bỏ) giữa
+    # chừng thì thread vẫn lấy 1 chỗ reader -> trả lại khi thread xong
+    task = asyncio.ensure_future(asyncio.to_thread(tts_cache.join_or_start, key, open_upstream))
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        task.add_done_callback(_release_joined)
+        raise
+
+
+def _release_joined(task):
+    if not task.cancelled() and task.exception() is None:
+        fill, _ = task.result()
+        if fill is not None:
+            tts_cache.release(fill)
+
+
+async def ready_fill(fill):
+    # -> lỗi (str) hoặc None; lỗi / bị huỷ khi đang chờ -> trả chỗ reader
+    try:
+        error = await fill.await_ready()
+    except BaseException:
+        tts_cache.release(fill)
+        raise
+    if error:
+        tts_cache.release(fill)
+    return error
+
+
+async def tts_open(voice_id, text):
+    # -> httpx.Response (stream=True) từ ElevenLabs TTS
+    url = f"{BASE}/text-to-speech/{voice_id}/stream"
+    headers = {
+        "xi-api-key": ELEVENLABS_API_KEY,
+        "Content-Type": "application/json"
+    }
+    payload = {
+        "text": text,
+        "model_id": TTS_MODEL_ID,
+        "voice_settings": TTS_VOICE_SETTINGS
+    }
+    return await client.post(url, headers=headers, json=payload, stream=True,
+                             dependency="elevenlabs_tts")
+
+
+async def tts_relay(voice_id, text, started_at=None):
+    try:
+        r = await tts_open(voice_id, text)
+    except Exception as e:
+        return error_response(e)
+    if r.status_code != 200:
+        body = await r.aread()
+        await r.aclose()
+        return jsonify({"error": body.decode("utf-8", "replace")}), 500
+
+    return Response(arelay(r, source="upstream", started_at=started_at), mimetype="audio/mpeg")
+
+
+def _read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def _file_chunks(path):
+    # segment đã cache: file nhỏ (1 câu), đọc 1 lần trong thread
+    yield await asyncio.to_thread(_read_file, path)
+
+
+async def tts_segment(voice_id, segment):
+    if tts_cache is None:
+        r = await tts_open(voice_id, segment)
+        if r.status_code != 200:
+            body = await r.aread()
+            await r.aclose()
+            raise SegmentError(r.status_code, body.decode("utf-8", "replace"))
+        return abuffered(r)
+
+    key = cache_key(voice_id, TTS_MODEL_ID, TTS_VOICE_SETTINGS, segment)
+    path = tts_cache.lookup(key)
+    if path:
+        return _file_chunks(path)
+    fill, err = await join_fill(key, tts_upstream(voice_id, segment))
+    if err is not None:
+        raise SegmentError(err.status_code, err.text)
+    error = await ready_fill(fill)
+    if error:
+        raise SegmentError(502, error)
+    return tts_cache.aiter_fill(fill)
+
+
+async def tts_pipelined(voice_id, text, started_at):
+    segments = split_text(text)
+    audio = apipelined(segments, lambda seg: tts_segment(voice_id, seg))
+    try:
+        head = await audio.__anext__()
+    except StopAsyncIteration:
+        head = b""
+    except Exception as e:
+        return error_response(e)
+
+    async def generate():
+        try:
+            yield head
+            async for chunk in audio:
+                yield chunk
+        finally:
+            await audio.aclose()
+
+    resp = Response(ametered(generate(), "pipelined", started_at), mimetype="audio/mpeg")
+    resp.headers["X-TTS-Segments"] = str(len(segments))
+    return resp
+
+
+@bp.route("/api/tts-cache")
+async def tts_cache_info():
+    return jsonify(tts_cache.info() if tts_cache else {"enabled": False})
+
+
+@bp.route("/api/tts-stream-stats")
+async def tts_stream_stats():
+    return jsonify(tts_stream_summary())
+
+
+# ====== SUPPORTED LANGUAGES ======
+@bp.route("/api/supported-languages")
+async def supported_languages():
+    return jsonify({"languages": SUPPORTED_LANGUAGES})
+
+
+# ====== SIGNED URL (n8n -> fallback ElevenLabs) ======
+async def signed_from_n8n():
+    payload = {"purpose": "get_signed_url"}
+    if AGENT_ID:
+        payload["agent_id"] = AGENT_ID
+
+    t0 = time.perf_counter()
+    outcome = "error"
+    try:
+        r = await client.post(N8N_SIGNED_URL_ENDPOINT, json=payload, dependency="n8n")
+        signed, raw = extract_signed_url(r)
+        outcome = "ok" if (r.is_success and signed) else ("empty" if r.is_success else "error")
+        if not r.is_success:
+            raw = {"error": f"n8n error status={r.status_code}", "raw": raw}
+        return signed, raw, r.is_success
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        raise
+    finally:
+        signed_url_latency.observe(time.perf_counter() - t0, source="n8n", outcome=outcome)
+
+
+async def signed_from_elevenlabs():
+    t0 = time.perf_counter()
+    outcome = "error"
+    try:
+        r2 = await client.get(
+            f"{BASE}/convai/conversation/get-signed-url",
+            params={"agent_id": AGENT_ID},
+            headers=HEADERS,
+            dependency="elevenlabs_convai"
+        )
+        r2.raise_for_status()
+        with tracing.span("elevenlabs.parse", op="signed_url"):
+            data2 = r2.json()
+        signed2 = data2.get("signed_url") or ""
+        outcome = "ok" if signed2 else "empty"
+        return signed2, data2, True
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        raise
+    finally:
+        signed_url_latency.observe(time.perf_counter() - t0, source="elevenlabs", outcome=outcome)
+
+
+async def resolve_signed_url():
+    if SIGNED_URL_STRATEGY in ("hedged", "race"):
+        delay = 0.0 if SIGNED_URL_STRATEGY == "race" else SIGNED_URL_HEDGE_DELAY
+        return await hedged_signed_url(delay)
+
+    try:
+        try:
+            signed, raw, ok = await signed_from_n8n()
+        except CircuitOpenError as e:
+            signed, raw, ok = "", {"error": str(e)}, True
+        if not ok:
+            return raw, 500
+
+        if signed:
+            signed_url_wins.inc(source="n8n", strategy="sequential")
+            return {"signed_url": signed, "source": "n8n"}, 200
+
+        signed2, data2, _ = await signed_from_elevenlabs()
+        if not signed2:
+            return {
+                "error": "ElevenLabs fallback cũng không trả signed_url",
+                "raw_from_n8n": raw,
+                "raw_from_elevenlabs": data2
+            }, 500
+
+        signed_url_wins.inc(source="elevenlabs", strategy="sequential")
+        return {"signed_url": signed2, "source": "elevenlabs"}, 200
+
+    except Exception as e:
+        return error_body(e)
+
+
+async def hedged_signed_url(delay):
+    # như app.hedged_signed_url nhưng request thua bị cancel thật (httpx huỷ kết nối)
+    strategy = "race" if delay <= 0 else "hedged"
+    tasks = {asyncio.ensure_future(signed_from_n8n()): "n8n"}
+    raws = {}
+    fallback_started = False
+
+    def start_fallback():
+        tasks[asyncio.ensure_future(signed_from_elevenlabs())] = "elevenlabs"
+
+    if delay <= 0:
+        start_fallback()
+        fallback_started = True
+
+    loop = asyncio.get_running_loop()
+    t0 = loop.time()
+    try:
+        while tasks:
+            timeout = None if fallback_started else max(0.0, delay - (loop.time() - t0))
+            done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                start_fallback()
+                fallback_started = True
+                continue
+
+            for t in done:
+                source = tasks.pop(t)
+                try:
+                    signed, raw, _ = t.result()
+                except Exception as e:
+                    signed, raw = "", {"error": str(e)}
+                raws[source] = raw
+
+                if signed:
+                    signed_url_wins.inc(source=source, strategy=strategy)
+                    return {"signed_url": signed, "source": source}, 200
+
+            if not fallback_started:
+                start_fallback()
+                fallback_started = True
+    finally:
+        for t in tasks:
+            t.cancel()
+
+    return {
+        "error": "Không lấy được signed_url từ n8n lẫn ElevenLabs",
+        "raw_from_n8n": raws.get("n8n"),
+        "raw_from_elevenlabs": raws.get("elevenlabs")
+    }, 500
+
+
+@bp.route("/api/signed-url-stats")
+async def signed_url_stats():
+    return jsonify({
+        "strategy": SIGNED_URL_STRATEGY,
+        "hedge_delay": SIGNED_URL_HEDGE_DELAY,
+        "latency": signed_url_latency.summary(),
+        "wins": {",".join(k): v for k, v in signed_url_wins.snapshot().items()},
+    })
+
+
+@bp.route("/signed-url")
+async def signed_url():
+    return await serve_pooled(text_url_pool, resolve_signed_url)
+
+
+# =========================================================
+# BOOTSTRAP (xem app.py)
+# =========================================================
+async def boot_agent():
+    return project_entry(await agent_cache.aget(AGENT_ID, fetch_agent), AGENT_DEFAULT_FIELDS).value
+
+
+async def boot_voices():
+    entry = await voices_cache.aget("mine", fetch_voices)
+    voice_index.sync(entry.etag, entry.value["voices"])
+    return voice_index.query(BOOTSTRAP_VOICES).value["voices"]
+
+
+async def boot_languages():
+    return SUPPORTED_LANGUAGES
+
+
+async def boot_signed_url():
+    return signed_url_value(*await take_pooled(text_url_pool, resolve_signed_url))
+
+
+BOOTSTRAP_FETCHERS = {"agent": boot_agent, "voices": boot_voices,
+                      "languages": boot_languages, "signed_url": boot_signed_url}
+
+
+async def _timed(fn):
+    t0 = time.perf_counter()
+    try:
+        result = ("ok", await fn())
+    except Exception as e:
+        result = ("error", error_body(e)[0])
+    return result, round((time.perf_counter() - t0) * 1000, 1)
+
+
+@bp.route("/api/bootstrap")
+async def bootstrap():
+    try:
+        include = bootstrap_include(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # task quá hạn không cancel: chạy tiếp nền để làm ấm cache
+    tasks = {asyncio.ensure_future(_timed(BOOTSTRAP_FETCHERS[name])): name for name in include}
+    done, _ = await asyncio.wait(tasks, timeout=BOOTSTRAP_TIMEOUT)
+    results, timings = {}, {}
+    for t in done:
+        results[tasks[t]], timings[tasks[t]] = t.result()
+
+    resp = jsonify(bootstrap_payload(include, results, timings))
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
+
+
+# =========================================================
+# PRODUCTION LAUNCHER
+# =========================================================
+# ====== HEALTH / READINESS ======
+@bp.route("/healthz")
+async def healthz():
+    return jsonify(health())
+
+
+@bp.route("/readyz")
+async def readyz():
+    info = current_app.extensions["warmup"].info()
+    if info["ready"]:
+        return jsonify(info)
+    resp = jsonify(info)
+    resp.headers["Retry-After"] = "1"
+    return resp, 503
+
+
+# =========================================================
+# APP FACTORY
+# =========================================================
+async def warm_agent():
+    await agent_cache.aget(AGENT_ID, fetch_agent)
+
+
+async def warm_voices():
+    entry = await voices_cache.aget("mine", fetch_voices)
+    return {"voices": len(entry.value["voices"])}
+
+
+def create_app():
+    """
+    Như app.create_app() cho ASGI mode. Warm-up start khi server bắt đầu serve;
+    agent / voices prefetch qua async client để mở sẵn connection của chính client đó.
+    """
+    errors = config_errors()
+    if errors:
+        raise RuntimeError("; ".join(errors))
+
+    app = Quart(__name__, static_folder="static", template_folder="templates")
+    app.json = FastJSONProvider(app)
+    app = cors(app, allow_origin="*", expose_headers=TRACE_EXPOSE_HEADERS)
+    app.jinja_env.globals["asset_url"] = assets.url
+    app.register_blueprint(bp)
+
+    warmup = app.extensions["warmup"] = Warmup()
+    warmup.add("assets", warm_assets)
+    warmup.add("connections", warm_connections)     # pool sync (token pool / mint dùng)
+    warmup.add("agent", warm_agent)
+    warmup.add("voices", warm_voices)
+    return app
+
+
+_app = None
+
+
+def __getattr__(name):
+    # tương thích "asgi:app" (hypercorn / uvicorn không dùng factory)
+    global _app
+    if name == "app":
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(name)
+
+
+def main():
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    config = Config()
+    config.bind = [f"{os.getenv('HOST', '0.0.0.0')}:{PORT}"]
+    config.keep_alive_timeout = 75
+    config.accesslog = "-" if os.getenv("ACCESS_LOG") else None
+
+    asyncio.run(serve(create_app(), config))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+# assets.py
+# Static asset pipeline: tên file theo hash nội dung + bản nén sẵn gzip / brotli.
+#
+#   static/js/assistant.js  ->  .cache/assets/js/assistant.3f9c2a71d0.js (+ .gz, .br)
+#   URL: /assets/js/assistant.3f9c2a71d0.js   Cache-Control: public, max-age=1 năm, immutable
+#
+# Nội dung đổi -> hash đổi -> URL đổi, nên browser cache vĩnh viễn mà không cần revalidate.
+# Tham chiếu giữa các asset (import "./i18n.js", addModule("/pcm-worklet.js")) được viết lại
+# sang tên có hash trước khi tính hash của file chứa nó (dependency trước).
+# Template dùng asset_url("js/assistant.js") thay cho url_for('static', ...).
+#
+#   python assets.py          # build trước (deploy); server cũng tự build lúc khởi động
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+
+try:
+    import brotli
+except ImportError:          # pip install brotli
+    brotli = None
+
+ASSETS_ENABLED   = (os.getenv("ASSETS_FINGERPRINT") or "1").lower() in ("1", "true", "yes")
+ASSETS_SRC       = os.getenv("ASSETS_SRC") or "static"
+ASSETS_DIR       = os.getenv("ASSETS_DIR") or os.path.join(".cache", "assets")
+ASSETS_MIN_BYTES = int(os.getenv("ASSETS_MIN_BYTES") or 512)   # nhỏ hơn -> không nén
+ASSETS_PREFIX    = "/assets/"
+ASSETS_MAX_AGE   = 365 * 86400
+
+EXTENSIONS = (".js", ".mjs", ".css", ".svg", ".json", ".woff2", ".png", ".jpg", ".webp", ".ico")
+COMPRESSIBLE = (".js", ".mjs", ".css", ".svg", ".json", ".html")
+# URL tuyệt đối app phục vụ ngoài /static (vd route /pcm-worklet.js) -> file trong static/
+ALIASES = {"/pcm-worklet.js": "pcm-worklet.js"}
+
+# chuỗi trong quote trỏ tới file asset: "./x.js", "../css/a.css", "/static/js/x.js", "/pcm-worklet.js"
+_REF = re.compile(r"""(["'])((?:\.{1,2}/|/)[^"'\s]+?\.(?:m?js|css|svg|json|woff2|png|jpg|webp|ico))\1""")
+_CSS_URL = re.compile(r"""url\(\s*(["']?)([^"')\s]+)\1\s*\)""")
+
+mimetypes.add_type("text/javascript", ".js")
+mimetypes.add_type("text/javascript", ".mjs")
+
+manifest = {}     # "js/assistant.js" -> "js/assistant.3f9c2a71d0.js"
+_files = {}       # "js/assistant.3f9c2a71d0.js" -> {"": path, "gzip": path.gz, "br": path.br}
+
+
+# =========================================================
+# BUILD
+# =========================================================
+def _sources(src):
+    out = []
+    for root, _, names in os.walk(src):
+        for name in names:
+            if name.endswith(EXTENSIONS):
+                out.append(os.path.relpath(os.path.join(root, name), src).replace(os.sep, "/"))
+    return sorted(out)
+
+
+def _resolve(ref, rel, known):
+    # chuỗi tham chiếu trong file rel -> logical name trong static/, hoặc None
+    if ref in ALIASES:
+        return ALIASES[ref]
+    if ref.startswith("/static/"):
+        target = ref[len("/static/"):]
+    elif ref.startswith("."):
+        target = os.path.normpath(os.path.join(os.path.dirname(rel), ref)).replace(os.sep, "/")
+    else:
+        return None
+    return target if target in known else None
+
+
+def _hashed_ref(ref, rel, target):
+    # giữ kiểu tham chiếu: tương đối -> tương đối (cùng cây thư mục), tuyệt đối -> /assets/...
+    hashed = manifest[target]
+    if ref.startswith("."):
+        out = os.path.relpath(hashed, os.path.dirname(rel) or ".").replace(os.sep, "/")
+        return out if out.startswith(".") else "./" + out
+    return ASSETS_PREFIX + hashed
+
+
+def _write(path, data):
+    # ghi atomically: nhiều worker cùng build không đọc phải file dở
+    if os.path.exists(path):
+        return
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def compress(data):
+    # -> {"gzip": bytes, "br": bytes}, chỉ giữ bản thực sự nhỏ hơn
+    out = {}
+    if len(data) < ASSETS_MIN_BYTES:
+        return out
+    gz = gzip.compress(data, compresslevel=9, mtime=0)
+    if len(gz) < len(data):
+        out["gzip"] = gz
+    if brotli is not None:
+        br = brotli.compress(data, quality=11)
+        if len(br) < len(data):
+            out["br"] = br
+    return out
+
+
+def _build_one(rel, src, out, known, visiting):
+    if rel in manifest:
+        return
+    visiting.add(rel)
+    with open(os.path.join(src, rel), "rb") as f:
+        data = f.read()
+
+    if rel.endswith((".js", ".mjs", ".css")):
+        text = data.decode("utf-8")
+
+        def rewrite(m, quote_group=True):
+            ref = m.group(2)
+            target = _resolve(ref, rel, known)
+            if target is None or target in visiting:
+                return m.group(0)
+            _build_one(target, src, out, known, visiting)
+            new = _hashed_ref(ref, rel, target)
+            return f"{m.group(1)}{new}{m.group(1)}" if quote_group else f"url({m.group(1)}{new}{m.group(1)})"
+
+        text = _REF.sub(rewrite, text)
+        if rel.endswith(".css"):
+            text = _CSS_URL.sub(lambda m: rewrite(m, quote_group=False), text)
+        data = text.encode("utf-8")
+
+    digest = hashlib.sha256(data).hexdigest()[:10]
+    stem, ext = os.path.splitext(rel)
+    hashed = f"{stem}.{digest}{ext}"
+    path = os.path.join(out, hashed)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    _write(path, data)
+
+    variants = {"": path}
+    if ext in COMPRESSIBLE:
+        for encoding, blob in compress(data).items():
+            suffix = ".gz" if encoding == "gzip" else ".br"
+            _write(path + suffix, blob)
+            variants[encoding] = path + suffix
+
+    visiting.discard(rel)
+    manifest[rel] = hashed
+    _files[hashed] = variants
+
+
+def build(src=ASSETS_SRC, out=ASSETS_DIR):
+    """
+    Build toàn bộ asset trong src -> out. -> manifest. File đã có (cùng hash) không ghi lại.
+    """
+    manifest.clear()
+    _files.clear()
+    known = set(_sources(src))
+    for rel in sorted(known):
+        _build_one(rel, src, out, known, set())
+    os.makedirs(out, exist_ok=True)
+    _write_manifest(out)
+    return dict(manifest)
+
+
+def _write_manifest(out):
+    data = json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8")
+    tmp = os.path.join(out, f"manifest.json.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, os.path.join(out, "manifest.json"))
+
+
+# =========================================================
+# SERVE
+# =========================================================
+def url(rel):
+    # dùng trong template: asset_url("js/assistant.js")
+    hashed = manifest.get(rel)
+    return ASSETS_PREFIX + hashed if hashed else f"/static/{rel}"
+
+
+def negotiate(accept_encoding, variants):
+    # -> encoding ("br" | "gzip" | "") theo Accept-Encoding, ưu tiên br
+    accepted = {}
+    for part in (accept_encoding or "").lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip()] = q
+    for encoding in ("br", "gzip"):
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if encoding in variants and q > 0:
+            return encoding
+    return ""
+
+
+def lookup(hashed, accept_encoding):
+    """
+    -> (path, encoding, mimetype) cho /assets/<hashed>, hoặc None nếu không có.
+    """
+    variants = _files.get(hashed)
+    if not variants:
+        return None
+    encoding = negotiate(accept_encoding, variants)
+    mimetype = mimetypes.guess_type(hashed)[0] or "application/octet-stream"
+    return variants[encoding], encoding, mimetype
+
+
+def headers(encoding, immutable=True):
+    out = {"Vary": "Accept-Encoding"}
+    if encoding:
+        out["Content-Encoding"] = encoding
+    if immutable:
+        out["Cache-Control"] = f"public, max-age={ASSETS_MAX_AGE}, immutable"
+    return out
+
+
+_pages = {}   # sha256(html) -> (etag, {"": bytes, "gzip": bytes, "br": bytes})
+
+
+def page(html):
+    """
+    HTML render từ template -> (etag, variants). Nén 1 lần / nội dung, request sau lấy từ memo.
+    """
+    data = html.encode("utf-8") if isinstance(html, str) else html
+    digest = hashlib.sha256(data).hexdigest()
+    entry = _pages.get(digest)
+    if entry is None:
+        variants = {"": data, **compress(data)}
+        entry = _pages[digest] = (digest[:16], variants)
+        while len(_pages) > 16:
+            _pages.pop(next(iter(_pages)))
+    return entry
+
+
+if __name__ == "__main__":
+    built = build()
+    total = {"": 0, "gzip": 0, "br": 0}
+    for hashed in built.values():
+        for encoding, path in _files[hashed].items():
+            total[encoding] += os.path.getsize(path)
+    print(json.dumps(built, indent=2))
+    print(f"{len(built)} file -> {ASSETS_DIR}  raw {total['']} B, gzip {total['gzip']} B, br {total['br']} B"
+          + ("" if brotli else "  (không có brotli: pip install brotli)"))
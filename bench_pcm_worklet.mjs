@@ -0,0 +1,114 @@
+// bench_pcm_worklet.mjs
+// Micro-benchmark chi phí CPU / cấp phát mỗi render quantum (128 sample) của pcm-worklet.
+// Chạy worklet trong node với AudioWorkletProcessor / registerProcessor / sampleRate giả.
+//
+//   node --expose-gc bench_pcm_worklet.mjs                          # static/pcm-worklet.js
+//   git show <rev>:static/pcm-worklet.js > /tmp/old-worklet.js
+//   node --expose-gc bench_pcm_worklet.mjs static/pcm-worklet.js /tmp/old-worklet.js
+//
+// BENCH_RATES=48000,44100,16000  BENCH_SECONDS=60
+// BENCH_VAD=1  bật VAD; tín hiệu thử xen kẽ 2s "nói" / 3s im lặng (nhiễu nền nhỏ) -> so số frame
+//              gửi đi / byte tiết kiệm. BENCH_VAD_OPTIONS='{"comfortMs":500}' chỉnh vadOptions.
+
+import { readFileSync } from "node:fs";
+import { performance } from "node:perf_hooks";
+
+const QUANTUM = 128;
+const RATES = (process.env.BENCH_RATES || "48000,44100,16000").split(",").map(Number);
+const SECONDS = Number(process.env.BENCH_SECONDS || 60); // audio giả lập mỗi lần chạy
+const VAD = ["1", "true", "yes"].includes((process.env.BENCH_VAD || "").toLowerCase());
+const VAD_OPTIONS = JSON.parse(process.env.BENCH_VAD_OPTIONS || "{}");
+
+function load(file, rate) {
+  // bọc source trong Function với các global của AudioWorkletGlobalScope làm tham số
+  // (vm.createContext làm mọi truy cập global như Math chậm đi nhiều lần, đo sai)
+  let Processor = null;
+  const ctx = { frames: 0, bytes: 0, vad: null };
+  const AudioWorkletProcessor = class {
+    constructor() {
+      this.port = { postMessage: (msg) => {
+        if (msg instanceof ArrayBuffer) { ctx.frames++; ctx.bytes += msg.byteLength; }
+        else if (msg?.type === "vad") ctx.vad = { ...msg };
+      } };
+    }
+  };
+  const registerProcessor = (_, cls) => { Processor = cls; };
+  const body = `${readFileSync(file, "utf8")}\n//# sourceURL=${file}`;
+  new Function("sampleRate", "AudioWorkletProcessor", "registerProcessor", body)(
+    rate, AudioWorkletProcessor, registerProcessor);
+  const processorOptions = VAD ? { vad: true, vadOptions: VAD_OPTIONS } : {};
+  return { ctx, node: new Processor({ processorOptions }) };
+}
+
+function run(file, rate) {
+  const { ctx, node } = load(file, rate);
+  // tín hiệu thử: sin 440Hz + nhiễu, cấp phát sẵn để không tính vào worklet
+  const quanta = Math.ceil((SECONDS * rate) / QUANTUM);
+  const block = (b, amp) => {
+    const a = new Float32Array(QUANTUM);
+    for (let i = 0; i < QUANTUM; i++) {
+      const t = (b * QUANTUM + i) / rate;
+      a[i] = amp * Math.sin(2 * Math.PI * 440 * t) + 0.05 * amp * (Math.random() - 0.5);
+    }
+    return [[a]];
+  };
+  const inputs = Array.from({ length: 64 }, (_, b) => block(b, 0.5));
+  // VAD: im lặng = nhiễu nền ~ -70 dBFS
+  const quiet = Array.from({ length: 64 }, (_, b) => block(b, 0.002));
+  const cycle = Math.round((5 * rate) / QUANTUM), talk = Math.round((2 * rate) / QUANTUM);
+  const input = VAD ? (q) => ((q % cycle) < talk ? inputs : quiet)[q & 63] : (q) => inputs[q & 63];
+
+  for (let i = 0; i < 2000; i++) node.process(quiet[i & 63]); // warm-up JIT (VAD: floor = nền)
+  globalThis.gc?.();
+  const heap0 = process.memoryUsage().heapUsed;
+  const frames0 = ctx.frames;
+  const vad0 = ctx.vad;
+
+  const samples = new Float64Array(quanta);
+  const t0 = performance.now();
+  for (let q = 0; q < quanta; q++) {
+    const s = performance.now();
+    node.process(input(q));
+    samples[q] = performance.now() - s;
+  }
+  const total = performance.now() - t0;
+  const heapGrowth = process.memoryUsage().heapUsed - heap0;
+
+  samples.sort();
+  const pct = (p) => samples[Math.min(quanta - 1, Math.floor(p * quanta))] * 1000;
+  const budgetUs = (QUANTUM / rate) * 1e6; // thời gian thực của 1 quantum
+  return {
+    file, rate, quanta,
+    mean_us: (total * 1000) / quanta,
+    p99_us: pct(0.99),
+    max_us: samples[quanta - 1] * 1000,
+    budget_pct: ((total * 1000) / quanta / budgetUs) * 100,
+    heap_growth_kb: heapGrowth / 1024,
+    frames: ctx.frames - frames0,
+    vad: ctx.vad && vad0 ? { frames: ctx.vad.frames - vad0.frames, sent: ctx.vad.sent - vad0.sent,
+                             open: ctx.vad.open - vad0.open, comfort: ctx.vad.comfort - vad0.comfort } : null,
+  };
+}
+
+const files = process.argv.slice(2);
+if (!files.length) files.push("static/pcm-worklet.js");
+
+const rows = [];
+for (const file of files) for (const rate of RATES) rows.push(run(file, rate));
+
+console.log(`${SECONDS}s audio / run, quantum=${QUANTUM}${globalThis.gc ? "" : "  (chạy với --expose-gc để đo heap chính xác hơn)"}`);
+console.table(rows.map((r) => ({
+  file: r.file,
+  rate: r.rate,
+  "mean µs/quantum": r.mean_us.toFixed(2),
+  "p99 µs": r.p99_us.toFixed(2),
+  "max µs": r.max_us.toFixed(1),
+  "% budget": r.budget_pct.toFixed(3),
+  "heap growth KB": r.heap_growth_kb.toFixed(0),
+  frames: r.frames,
+  ...(r.vad && {
+    "speech %": ((r.vad.open / r.vad.frames) * 100).toFixed(1),
+    "saved %": ((1 - r.vad.sent / r.vad.frames) * 100).toFixed(1),
+    comfort: r.vad.comfort,
+  }),
+})));
@@ -0,0 +1,202 @@
+# breaker.py
+# Circuit breaker + adaptive timeout cho từng upstream dependency
+# (n8n webhook, ElevenLabs convai, ElevenLabs TTS).
+#
+#   closed    -> gọi bình thường, ghi nhận kết quả trong cửa sổ trượt
+#   open      -> tỉ lệ lỗi vượt ngưỡng: fail fast (CircuitOpenError) trong open_for giây
+#   half_open -> hết open_for: cho vài request thử; thành công -> closed, lỗi -> open lại
+#
+# Read timeout không cố định 20–30s nữa mà lấy theo p99 latency quan sát được
+# (x multiplier), kẹp trong [floor, ceiling].
+#
+# Có shared backend: worker mở mạch thì ghi "breaker:<name>" (hết hạn sau open_for), worker
+# khác đọc lại tối đa mỗi SHARED_CHECK_EVERY giây và fail fast theo, không tự dò lỗi lại từ đầu.
+
+import math
+import os
+import threading
+import time
+from collections import deque
+
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name) or default)
+    except ValueError:
+        return default
+
+
+FAILURE_RATE   = _env_float("BREAKER_FAILURE_RATE", 0.5)   # tỉ lệ lỗi để mở mạch
+MIN_CALLS      = int(_env_float("BREAKER_MIN_CALLS", 10))  # số call tối thiểu trong cửa sổ
+WINDOW         = _env_float("BREAKER_WINDOW", 30)          # giây
+OPEN_FOR       = _env_float("BREAKER_OPEN_FOR", 15)        # giây fail fast trước khi half-open
+HALF_OPEN_MAX  = int(_env_float("BREAKER_HALF_OPEN_MAX", 1))
+TIMEOUT_MULT   = _env_float("ADAPTIVE_TIMEOUT_MULT", 3.0)
+TIMEOUT_FLOOR  = _env_float("ADAPTIVE_TIMEOUT_FLOOR", 2.0)
+TIMEOUT_MIN_SAMPLES = 20
+SHARED_CHECK_EVERY = 1.0
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name, retry_after):
+        self.dependency = name
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(f"upstream '{name}' tạm thời không khả dụng (circuit open), "
+                         f"thử lại sau {self.retry_after}s")
+
+
+class CircuitBreaker:
+    def __init__(self, name, ceiling, failure_rate=FAILURE_RATE, min_calls=MIN_CALLS,
+                 window=WINDOW, open_for=OPEN_FOR, half_open_max=HALF_OPEN_MAX, shared=None):
+        self.name = name
+        self.ceiling = ceiling                  # read timeout tối đa (giây)
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.open_for = open_for
+        self.half_open_max = half_open_max
+
+        self.state = "closed"
+        self.opened_at = 0.0
+        self._half_open_inflight = 0
+        self._calls = deque()                   # (ts, ok)
+        self._latencies = deque(maxlen=200)     # latency các call thành công
+        self._lock = threading.Lock()
+        self.shared = shared
+        self._shared_checked = 0.0
+        self.stats = {"calls": 0, "failures": 0, "rejected": 0, "opened": 0, "opened_remote": 0}
+
+    # ---------- gate ----------
+    def before(self):
+        """
+        Gọi trước mỗi request; raise CircuitOpenError nếu đang fail fast.
+        """
+        if self.shared is not None and self.state == "closed":
+            self._sync_shared()
+        with self._lock:
+            now = time.monotonic()
+            if self.state == "open":
+                remaining = self.opened_at + self.open_for - now
+                if remaining > 0:
+                    self.stats["rejected"] += 1
+                    raise CircuitOpenError(self.name, remaining)
+                self.state = "half_open"
+                self._half_open_inflight = 0
+
+            if self.state == "half_open":
+                if self._half_open_inflight >= self.half_open_max:
+                    self.stats["rejected"] += 1
+                    raise CircuitOpenError(self.name, 1)
+                self._half_open_inflight += 1
+
+    def record(self, ok, latency=None):
+        with self._lock:
+            now = time.monotonic()
+            self.stats["calls"] += 1
+            if not ok:
+                self.stats["failures"] += 1
+            elif latency is not None:
+                self._latencies.append(latency)
+
+            if self.state == "half_open":
+                self._half_open_inflight = max(0, self._half_open_inflight - 1)
+                if ok:
+                    self.state = "closed"
+                    self._calls.clear()
+                else:
+                    self._open(now)
+                return
+
+            self._calls.append((now, ok))
+            while self._calls and now - self._calls[0][0] > self.window:
+                self._calls.popleft()
+
+            n = len(self._calls)
+            if self.state == "closed" and n >= self.min_calls:
+                failures = sum(1 for _, c_ok in self._calls if not c_ok)
+                if failures / n >= self.failure_rate:
+                    self._open(now)
+
+    def release(self):
+        """
+        Call bị huỷ (vd request thua khi race) — không tính là lỗi của dependency.
+        """
+        with self._lock:
+            if self.state == "half_open":
+                self._half_open_inflight = max(0, self._half_open_inflight - 1)
+
+    def _open(self, now):
+        self.state = "open"
+        self.opened_at = now
+        self.stats["opened"] += 1
+        if self.shared is not None:
+            try:
+                self.shared.set(f"breaker:{self.name}", repr(time.time() + self.open_for).encode(),
+                                self.open_for)
+            except Exception:
+                pass
+
+    def _sync_shared(self):
+        # worker khác đã mở mạch -> mở theo tới cùng thời điểm
+        now = time.monotonic()
+        if now - self._shared_checked < SHARED_CHECK_EVERY:
+            return
+        self._shared_checked = now
+        try:
+            raw = self.shared.get(f"breaker:{self.name}")
+        except Exception:
+            self._shared_checked = now + 30     # backend lỗi: đừng chặn mỗi giây 1 lần
+            return
+        if raw is None:
+            return
+        remaining = float(raw) - time.time()
+        if remaining <= 0:
+            return
+        with self._lock:
+            if self.state == "closed":
+                self.state = "open"
+                self.opened_at = now - (self.open_for - remaining)
+                self.stats["opened_remote"] += 1
+
+    # ---------- adaptive timeout ----------
+    def timeout(self):
+        with self._lock:
+            if len(self._latencies) < TIMEOUT_MIN_SAMPLES:
+                return self.ceiling
+            ordered = sorted(self._latencies)
+        p99 = ordered[min(len(ordered) - 1, int(0.99 * len(ordered)))]
+        return max(TIMEOUT_FLOOR, min(self.ceiling, p99 * TIMEOUT_MULT))
+
+    def info(self):
+        t = self.timeout()
+        with self._lock:
+            now = time.monotonic()
+            n = len(self._calls)
+            failures = sum(1 for _, ok in self._calls if not ok)
+            return {
+                "state": self.state,
+                "failure_rate": round(failures / n, 3) if n else 0.0,
+                "window_calls": n,
+                "read_timeout": round(t, 2),
+                "retry_after": (max(0.0, round(self.opened_at + self.open_for - now, 1))
+                                if self.state == "open" else 0),
+                **self.stats,
+            }
+
+
+class BreakerRegistry:
+    def __init__(self, ceiling, shared=None):
+        self.ceiling = ceiling
+        self.shared = shared
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        b = self._breakers.get(name)
+        if b is None:
+            with self._lock:
+                b = self._breakers.setdefault(name, CircuitBreaker(name, self.ceiling, shared=self.shared))
+        return b
+
+    def info(self):
+        return {name: b.info() for name, b in self._breakers.items()}
@@ -0,0 +1,302 @@
+# cache.py
+# TTL cache cho các dữ liệu upstream ít thay đổi (agent config, voice list).
+#
+# - fresh  (< ttl):                trả ngay từ memory
+# - stale  (ttl .. ttl+stale_ttl): trả bản cũ, refresh nền (stale-while-revalidate)
+# - hết hạn / chưa có:             fetch, nhưng chỉ 1 lần cho mọi request đồng thời
+#                                  (single-flight) — 500 page load = 1 upstream call
+# Nếu refresh lỗi mà vẫn còn bản cũ thì tiếp tục phục vụ bản cũ.
+#
+# Có shared backend (shared_state.py): entry được ghi cả vào backend chung; process nào cần
+# fetch thì đọc backend trước, rồi lấy lock chung -> cả cluster chỉ 1 process gọi upstream.
+
+import asyncio
+import hashlib
+import json
+import threading
+import time
+
+import fast_json
+from shared_state import SHARED_LOCK_TTL, SHARED_LOCK_WAIT, SHARED_POLL, shared as shared_backend
+
+
+class CacheEntry:
+    __slots__ = ("value", "etag", "fetched_at")
+
+    def __init__(self, value, age=0.0):
+        self.value = value
+        self.fetched_at = time.monotonic() - age
+        self.etag = hashlib.sha1(fast_json.dumps(value)).hexdigest()
+
+    def age(self):
+        return time.monotonic() - self.fetched_at
+
+
+class TTLCache:
+    def __init__(self, name, ttl, stale_ttl=0, shared=shared_backend):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._inflight = {}          # key -> threading.Event
+        self._ainflight = {}         # key -> asyncio.Task
+        self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "coalesced": 0,
+                      "refresh_errors": 0, "stale_if_error": 0,
+                      "shared_hits": 0, "shared_waits": 0, "shared_errors": 0}
+
+    # ---------- state ----------
+    def _state(self, entry):
+        if entry is None:
+            return "miss"
+        age = entry.age()
+        if age < self.ttl:
+            return "fresh"
+        if age < self.ttl + self.stale_ttl:
+            return "stale"
+        return "miss"
+
+    def _store(self, key, value, age=0.0):
+        entry = CacheEntry(value, age)
+        with self._lock:
+            self._entries[key] = entry
+        return entry
+
+    def peek(self, key):
+        with self._lock:
+            return self._entries.get(key)
+
+    def invalidate(self, key=None):
+        with self._lock:
+            keys = list(self._entries) if key is None else [key]
+            if key is None:
+                n = len(self._entries)
+                self._entries.clear()
+            else:
+                n = 1 if self._entries.pop(key, None) is not None else 0
+        if self.shared is not None:
+            try:
+                for k in keys:
+                    self.shared.delete(self._skey(k))
+            except Exception:
+                self.stats["shared_errors"] += 1
+        return n
+
+    def info(self):
+        with self._lock:
+            keys = {str(k): {"age": round(e.age(), 1), "etag": e.etag, "state": self._state(e)}
+                    for k, e in self._entries.items()}
+        return {"ttl": self.ttl, "stale_ttl": self.stale_ttl, "entries": keys, **self.stats}
+
+    # ---------- sync (Flask) ----------
+    def get(self, key, fetch):
+        """
+        Trả CacheEntry; fetch() là hàm sync trả value (raise nếu lỗi).
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            state = self._state(entry)
+            if state == "fresh":
+                self.stats["hits"] += 1
+                return entry
+
+            event = self._inflight.get(key)
+            leader = event is None
+            if leader:
+                event = self._inflight[key] = threading.Event()
+
+            if state == "stale":
+                self.stats["stale_hits"] += 1
+                if leader:
+                    threading.Thread(target=self._refresh, args=(key, fetch, event),
+                                     daemon=True).start()
+                return entry
+
+            if leader:
+                self.stats["misses"] += 1
+            else:
+                self.stats["coalesced"] += 1
+
+        if not leader:
+            event.wait()
+            entry = self.peek(key)
+            if entry is None:
+                raise RuntimeError(f"{self.name}: upstream fetch failed")
+            return entry
+
+        try:
+            return self._store(key, *self._load(key, fetch))
+        except Exception:
+            # stale-if-error: upstream lỗi / circuit open mà còn bản cũ thì dùng tạm
+            if entry is not None:
+                with self._lock:
+                    self.stats["stale_if_error"] += 1
+                return entry
+            raise
+        finally:
+            self._finish(key, event)
+
+    def _refresh(self, key, fetch, event):
+        try:
+            loaded = self._load(key, fetch, wait=False)
+            if loaded is not None:
+                self._store(key, *loaded)
+        except Exception:
+            with self._lock:
+                self.stats["refresh_errors"] += 1
+        finally:
+            self._finish(key, event)
+
+    def _finish(self, key, event):
+        with self._lock:
+            self._inflight.pop(key, None)
+        event.set()
+
+    # ---------- async (ASGI) ----------
+    async def aget(self, key, fetch):
+        """
+        Như get() nhưng fetch là coroutine function; single-flight bằng asyncio.Task.
+        """
+        entry = self.peek(key)
+        state = self._state(entry)
+        if state == "fresh":
+            self.stats["hits"] += 1
+            return entry
+
+        task = self._ainflight.get(key)
+        if task is None:
+            task = self._ainflight[key] = asyncio.ensure_future(self._afetch(key, fetch))
+            # refresh nền có thể không ai await -> tránh "exception was never retrieved"
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            if state == "miss":
+                self.stats["misses"] += 1
+        elif state == "miss":
+            self.stats["coalesced"] += 1
+
+        if state == "stale":
+            self.stats["stale_hits"] += 1
+            return entry
+        try:
+            return await asyncio.shield(task)
+        except Exception:
+            if entry is not None:
+                self.stats["stale_if_error"] += 1
+                return entry
+            raise
+
+    async def _afetch(self, key, fetch):
+        try:
+            entry = self.peek(key)
+            stale = self._state(entry) == "stale"
+            loaded = await self._aload(key, fetch, wait=not stale)
+            return entry if loaded is None else self._store(key, *loaded)
+        except Exception:
+            if self.peek(key) is not None:
+                self.stats["refresh_errors"] += 1
+            raise
+        finally:
+            self._ainflight.pop(key, None)
+
+    # ---------- shared backend (distributed single-flight) ----------
+    def _skey(self, key):
+        return f"cache:{self.name}:{key}"
+
+    def _shared_read(self, key):
+        # -> (value, age) | None
+        raw = self.shared.get(self._skey(key))
+        if raw is None:
+            return None
+        data = json.loads(raw)
+        return data["value"], max(0.0, time.time() - data["fetched_at"])
+
+    def _shared_write(self, key, value):
+        raw = json.dumps({"value": value, "fetched_at": time.time()}, default=str)
+        try:
+            self.shared.set(self._skey(key), raw.encode("utf-8"), self.ttl + self.stale_ttl)
+        except Exception:
+            self.stats["shared_errors"] += 1
+
+    def _load(self, key, fetch, wait=True):
+        """
+        -> (value, age) để _store(); None nếu process khác đang refresh (wait=False).
+        Không có backend: chỉ là fetch(). Backend lỗi: fetch() local như cũ.
+        """
+        if self.shared is None:
+            return fetch(), 0.0
+        lock = "lock:" + self._skey(key)
+        deadline = time.monotonic() + SHARED_LOCK_WAIT
+        waited = False
+        while True:
+            try:
+                found = self._shared_read(key)
+                if found is not None and found[1] < self.ttl:
+                    self.stats["shared_hits"] += 1
+                    return found
+                token = self.shared.acquire(lock, SHARED_LOCK_TTL)
+            except Exception:
+                self.stats["shared_errors"] += 1
+                return fetch(), 0.0
+
+            if token is not None:
+                try:
+                    value = fetch()
+                    self._shared_write(key, value)
+                    return value, 0.0
+                finally:
+                    self._release(lock, token)
+
+            # process khác đang fetch: refresh nền thì bỏ qua, request thì chờ kết quả
+            if not wait:
+                return found
+            if found is not None:
+                return found                  # bản cũ (stale) của cluster, dùng tạm
+            if not waited:
+                waited = True
+                self.stats["shared_waits"] += 1
+            if time.monotonic() > deadline:
+                return fetch(), 0.0           # holder treo quá lâu -> tự fetch
+            time.sleep(SHARED_POLL)
+
+    async def _aload(self, key, fetch, wait=True):
+        # như _load() nhưng fetch là coroutine function; I/O backend chạy trong thread
+        if self.shared is None:
+            return await fetch(), 0.0
+        lock = "lock:" + self._skey(key)
+        deadline = time.monotonic() + SHARED_LOCK_WAIT
+        waited = False
+        while True:
+            try:
+                found = await asyncio.to_thread(self._shared_read, key)
+                if found is not None and found[1] < self.ttl:
+                    self.stats["shared_hits"] += 1
+                    return found
+                token = await asyncio.to_thread(self.shared.acquire, lock, SHARED_LOCK_TTL)
+            except Exception:
+                self.stats["shared_errors"] += 1
+                return await fetch(), 0.0
+
+            if token is not None:
+                try:
+                    value = await fetch()
+                    await asyncio.to_thread(self._shared_write, key, value)
+                    return value, 0.0
+                finally:
+                    await asyncio.to_thread(self._release, lock, token)
+
+            if not wait:
+                return found
+            if found is not None:
+                return found                  # bản cũ (stale) của cluster, dùng tạm
+            if not waited:
+                waited = True
+                self.stats["shared_waits"] += 1
+            if time.monotonic() > deadline:
+                return await fetch(), 0.0
+            await asyncio.sleep(SHARED_POLL)
+
+    def _release(self, lock, token):
+        try:
+            self.shared.release(lock, token)
+        except Exception:
+            self.stats["shared_errors"] += 1
@@ -0,0 +1,135 @@
+# call_relay.py
+# Relay WebSocket cuộc gọi: browser <-> server <-> ElevenLabs ConvAI.
+#
+# Browser nói binary frame thay cho base64-trong-JSON:
+#   browser -> server : binary = PCM16 16 kHz mono (1 chunk mic)
+#                       text   = JSON control (user_message, contextual_update, ...) chuyển nguyên
+#   server -> browser : binary = audio agent (đã decode audio_event.audio_base_64)
+#                       text   = JSON event khác (agent_response, interruption, ...) chuyển nguyên
+# Server tự gửi conversation_initiation_client_data (overrides) và tự trả lời ping,
+# browser không phải lo 2 việc đó.
+
+import asyncio
+import base64
+import json
+import os
+
+from metrics import Counter
+
+try:
+    import websockets
+except ImportError:          # pip install websockets
+    websockets = None
+
+CALL_WS_RELAY    = (os.getenv("CALL_WS_RELAY") or "0").lower() in ("1", "true", "yes")
+CALL_WS_UPSTREAM = os.getenv("CALL_WS_UPSTREAM")   # vd ws://127.0.0.1:9920/ (mock_upstream.py)
+RELAY_AVAILABLE  = CALL_WS_RELAY and websockets is not None
+
+relay_frames = Counter("call_relay_frames_total", "Frame đi qua call relay",
+                       labelnames=("direction", "kind"))
+relay_bytes = Counter("call_relay_bytes_total", "Byte payload đi qua call relay (phía browser / upstream)",
+                      labelnames=("side", "direction"))
+relay_sessions = Counter("call_relay_sessions_total", "Phiên call relay đã kết thúc",
+                         labelnames=("outcome",))
+
+
+def initiation_message(voice_id=None, language=None):
+    # cùng shape với client gửi khi nối thẳng
+    overrides = {}
+    if language:
+        overrides["language"] = language
+    if voice_id:
+        overrides["voice_id"] = voice_id
+    return {"type": "conversation_initiation_client_data", "overrides": overrides}
+
+
+def _count(side, direction, payload):
+    relay_bytes.inc(len(payload), side=side, direction=direction)
+
+
+async def _downstream(up, browser_send):
+    # upstream -> browser
+    async for raw in up:
+        _count("upstream", "in", raw)
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            continue
+        kind = data.get("type")
+
+        if kind == "ping":
+            event_id = (data.get("ping_event") or {}).get("event_id")
+            pong = json.dumps({"type": "pong", "event_id": event_id})
+            _count("upstream", "out", pong)
+            await up.send(pong)
+            relay_frames.inc(direction="upstream", kind="ping")
+            continue
+
+        if kind == "audio":
+            b64 = (data.get("audio_event") or {}).get("audio_base_64")
+            if b64:
+                audio = base64.b64decode(b64)
+                _count("browser", "out", audio)
+                await browser_send(audio)
+                relay_frames.inc(direction="downstream", kind="audio")
+            continue
+
+        text = raw if isinstance(raw, str) else raw.decode("utf-8", "replace")
+        _count("browser", "out", text)
+        await browser_send(text)
+        relay_frames.inc(direction="downstream", kind=kind or "other")
+
+
+async def _upstream(up, browser_recv):
+    # browser -> upstream
+    while True:
+        msg = await browser_recv()
+        _count("browser", "in", msg)
+        if isinstance(msg, (bytes, bytearray)):
+            out = json.dumps({"user_audio_chunk": base64.b64encode(msg).decode("ascii")})
+            kind = "audio"
+        else:
+            try:
+                kind = json.loads(msg).get("type") or "other"
+            except (ValueError, AttributeError):
+                continue
+            if kind == "pong":
+                continue                    # ping đã được trả lời ở server
+            out = msg
+        _count("upstream", "out", out)
+        await up.send(out)
+        relay_frames.inc(direction="upstream", kind=kind)
+
+
+async def run(browser_recv, browser_send, upstream_url, init):
+    """
+    browser_recv() -> bytes | str, browser_send(bytes | str): phía browser (Quart websocket).
+    Chạy tới khi 1 trong 2 phía đóng.
+    """
+    outcome = "closed"
+    try:
+        async with websockets.connect(upstream_url, max_size=None, ping_interval=None,
+                                      compression=None) as up:
+            init = json.dumps(init)
+            _count("upstream", "out", init)
+            await up.send(init)
+
+            tasks = [asyncio.ensure_future(_downstream(up, browser_send)),
+                     asyncio.ensure_future(_upstream(up, browser_recv))]
+            try:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for t in tasks:
+                    t.cancel()
+            for t in done:
+                if not t.cancelled() and t.exception() is not None \
+                        and not isinstance(t.exception(), websockets.ConnectionClosed):
+                    raise t.exception()
+    except asyncio.CancelledError:
+        outcome = "browser_gone"
+        raise
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        relay_sessions.inc(outcome=outcome)
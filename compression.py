@@ -0,0 +1,191 @@
+# compression.py
+# Nén response động (JSON / text) theo header Accept-Encoding, ưu tiên br rồi gzip. Flask + Quart.
+#
+# - Chỉ nén mimetype nén được (JSON, text, JS, SVG) và body >= COMPRESS_MIN_BYTES;
+#   audio/mpeg, file gửi bằng send_file, response đã có Content-Encoding (HTML / asset nén sẵn)
+#   thì giữ nguyên.
+# - Body thường: nén 1 lần. Response có ETag -> memo bản nén theo (etag, encoding), nên JSON từ
+#   cache (agent / voices) chỉ tốn CPU nén khi nội dung đổi.
+# - Body stream (text): nén từng chunk + flush -> client vẫn nhận dữ liệu ngay, không đợi hết.
+# - ETag strong -> weak khi nén (byte khác nhau theo encoding), If-None-Match vẫn ra 304.
+#
+#   COMPRESS_ENABLED=1  COMPRESS_MIN_BYTES=1024  COMPRESS_BR_QUALITY=5  COMPRESS_GZIP_LEVEL=6
+
+import os
+import threading
+import zlib
+
+from assets import negotiate
+
+try:
+    import brotli
+except ImportError:          # pip install brotli
+    brotli = None
+
+try:
+    from quart.wrappers.response import DataBody, IterableBody
+except ImportError:          # chỉ cần cho ASGI mode
+    DataBody = IterableBody = None
+
+COMPRESS_ENABLED    = (os.getenv("COMPRESS_ENABLED") or "1").lower() in ("1", "true", "yes")
+COMPRESS_MIN_BYTES  = int(os.getenv("COMPRESS_MIN_BYTES") or 1024)
+COMPRESS_BR_QUALITY = int(os.getenv("COMPRESS_BR_QUALITY") or 5)    # 11 quá chậm cho response động
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL") or 6)
+COMPRESS_MEMO       = 128
+
+COMPRESSIBLE = ("application/json", "application/javascript", "application/x-ndjson",
+                "image/svg+xml", "text/")
+
+_memo = {}                   # (etag, encoding) -> bytes
+_memo_lock = threading.Lock()
+stats = {"compressed": 0, "streamed": 0, "memo_hits": 0, "skipped_small": 0,
+         "bytes_in": 0, "bytes_out": 0}
+
+
+def _encodings():
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=COMPRESS_BR_QUALITY)
+    return zlib.compress(data, COMPRESS_GZIP_LEVEL, wbits=31)    # wbits=31 -> gzip container
+
+
+class StreamCompressor:
+    # nén từng chunk, flush sau mỗi chunk để không giữ dữ liệu lại
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == "br":
+            self._c = brotli.Compressor(quality=COMPRESS_BR_QUALITY)
+        else:
+            self._c = zlib.compressobj(COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def chunk(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        if self.encoding == "br":
+            return self._c.process(data) + self._c.flush()
+        return self._c.compress(data) + self._c.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._c.finish() if self.encoding == "br" else self._c.flush()
+
+
+def choose(resp, accept_encoding):
+    """
+    -> encoding ("br" | "gzip") nếu nên nén response này, ngược lại "".
+    """
+    if not COMPRESS_ENABLED or not accept_encoding:
+        return ""
+    if resp.status_code < 200 or resp.status_code in (204, 206, 304):
+        return ""
+    if "Content-Encoding" in resp.headers or getattr(resp, "direct_passthrough", False):
+        return ""
+    if not (resp.mimetype or "").startswith(COMPRESSIBLE):
+        return ""
+    return negotiate(accept_encoding, _encodings())
+
+
+def _mark(resp, encoding):
+    resp.headers["Content-Encoding"] = encoding
+    resp.vary.add("Accept-Encoding")
+    etag, weak = resp.get_etag()
+    if etag and not weak:
+        resp.set_etag(etag, weak=True)
+
+
+def _compress_body(data, encoding, etag):
+    key = (etag, encoding) if etag else None
+    if key is not None:
+        with _memo_lock:
+            out = _memo.get(key)
+        if out is not None:
+            stats["memo_hits"] += 1
+            return out
+    out = compress(data, encoding)
+    if key is not None:
+        with _memo_lock:
+            _memo[key] = out
+            while len(_memo) > COMPRESS_MEMO:
+                _memo.pop(next(iter(_memo)))
+    return out
+
+
+def _apply_data(resp, data, encoding):
+    # -> True nếu đã thay body bằng bản nén
+    if len(data) < COMPRESS_MIN_BYTES:
+        stats["skipped_small"] += 1
+        return False
+    etag, weak = resp.get_etag()
+    out = _compress_body(data, encoding, None if weak else etag)
+    if len(out) >= len(data):
+        return False
+    stats["compressed"] += 1
+    stats["bytes_in"] += len(data)
+    stats["bytes_out"] += len(out)
+    resp.set_data(out)
+    _mark(resp, encoding)
+    return True
+
+
+# =========================================================
+# FLASK (werkzeug Response)
+# =========================================================
+def _iter_compressed(chunks, encoding):
+    c = StreamCompressor(encoding)
+    try:
+        for chunk in chunks:
+            out = c.chunk(chunk)
+            if out:
+                yield out
+        yield c.finish()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+def apply(resp, accept_encoding):
+    encoding = choose(resp, accept_encoding)
+    if not encoding:
+        return resp
+    if resp.is_streamed:
+        resp.response = _iter_compressed(resp.response, encoding)
+        resp.headers.pop("Content-Length", None)
+        _mark(resp, encoding)
+        stats["streamed"] += 1
+        return resp
+    _apply_data(resp, resp.get_data(), encoding)
+    return resp
+
+
+# =========================================================
+# QUART
+# =========================================================
+async def _aiter_compressed(body, encoding):
+    c = StreamCompressor(encoding)
+    async with body as chunks:
+        async for chunk in chunks:
+            out = c.chunk(chunk)
+            if out:
+                yield out
+    yield c.finish()
+
+
+async def aapply(resp, accept_encoding):
+    encoding = choose(resp, accept_encoding)
+    if not encoding:
+        return resp
+    if isinstance(resp.response, DataBody):
+        _apply_data(resp, await resp.get_data(), encoding)
+    elif isinstance(resp.response, IterableBody):
+        resp.response = IterableBody(_aiter_compressed(resp.response, encoding))
+        resp.headers.pop("Content-Length", None)
+        _mark(resp, encoding)
+        stats["streamed"] += 1
+    return resp
+
+
+def info():
+    return {"enabled": COMPRESS_ENABLED, "min_bytes": COMPRESS_MIN_BYTES,
+            "encodings": list(_encodings()), **stats}
@@ -0,0 +1,42 @@
+# fast_json.py
+# JSON provider dùng orjson cho jsonify() (Flask và Quart dùng chung provider của Flask).
+# orjson nhanh hơn json stdlib vài lần khi serialize payload lớn (voice list, agent raw).
+# Không có orjson -> rơi về json stdlib như cũ.
+
+import json
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:          # pip install orjson
+    orjson = None
+
+_OPTIONS = (orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS) if orjson is not None else 0
+
+
+def dumps(obj, default=str):
+    # -> bytes, key sort sẵn (dùng cho ETag / so sánh nội dung)
+    if orjson is not None:
+        return orjson.dumps(obj, default=default, option=_OPTIONS)
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"), default=default).encode("utf-8")
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=_OPTIONS).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # debug / compact=False -> indent như Flask mặc định
+        if orjson is None or self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=_OPTIONS | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
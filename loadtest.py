@@ -0,0 +1,370 @@
+# loadtest.py
+# Load generator cho app.py (Flask) / asgi.py, chạy với mock_upstream.py để không tốn quota ElevenLabs.
+#
+#   python loadtest.py --spawn flask                       # tự bật mock + server, bắn tải, in bảng
+#   python loadtest.py --spawn asgi --json bench/asgi.json
+#   python loadtest.py --url http://127.0.0.1:8080 --concurrency 1,16,64 --duration 15
+#   python loadtest.py --spawn asgi --compare bench/base.json --max-regression 0.2
+#       -> exit 1 nếu req/s giảm hoặc p95 tăng quá 20% so với baseline (so từng commit)
+#
+# Mỗi mức concurrency: N worker lặp liên tục, mỗi vòng chọn 1 route theo trọng số (--mix).
+# Báo cáo theo route: số request, lỗi, req/s, p50/p95/p99 latency (tới hết body), TTS thêm TTFB.
+# --mock-args chuyển thẳng cho mock_upstream.py, vd "--latency 80 --latency n8n=600 --error-rate 0.02".
+#
+# Lưu ý: client cũng là Python 1 process; ở concurrency rất cao nên xem thêm CPU của loadtest.
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+SHORT_TEXT = ["Xin chào, đây là câu thử giọng nói ngắn."]
+LONG_TEXT = [
+    "Đây là đoạn văn dài dùng để thử chế độ pipelined.",
+    "Mỗi câu được synthesize song song và nối lại theo thứ tự.",
+    "Câu thứ ba thêm một ít nội dung để vượt ngưỡng tối thiểu.",
+    "Câu thứ tư giúp tổng độ dài đủ để cắt thành nhiều segment.",
+    "Và câu cuối cùng kết thúc đoạn văn mẫu này.",
+]
+
+# name -> (method, path, weight mặc định)
+ROUTES = {
+    "index":        ("GET",  "/",                        1),
+    "worklet":      ("GET",  "/pcm-worklet.js",          1),
+    "agent":        ("GET",  "/api/agent",               4),
+    "voices":       ("GET",  "/api/voices?fields=voice_id,name,language_trained,label", 4),
+    "languages":    ("GET",  "/api/supported-languages", 2),
+    "bootstrap":    ("GET",  "/api/bootstrap",           2),
+    "token":        ("GET",  "/conversation-token",      2),
+    "signed_url":   ("GET",  "/signed-url",              2),
+    "ws_url":       ("POST", "/api/get-ws-url",          2),
+    "tts":          ("POST", "/api/tts-stream",          4),
+    "tts_pipeline": ("POST", "/api/tts-stream",          1),
+    "metrics":      ("GET",  "/metrics",                 1),
+    "stats":        ("GET",  "/api/upstream-status",     1),
+}
+TTFB_ROUTES = ("tts", "tts_pipeline")
+
+_nonce = itertools.count(1)
+
+
+# =========================================================
+# REQUEST
+# =========================================================
+def request_body(name, tts_repeat, voice_id):
+    if name not in TTFB_ROUTES:
+        return None
+    sentences = SHORT_TEXT if name == "tts" else LONG_TEXT
+    if random.random() >= tts_repeat:
+        # đánh số mọi câu -> mọi segment đều đi qua upstream, không trúng TTS cache
+        n = next(_nonce)
+        sentences = [f"{s[:-1]} {n}{s[-1]}" for s in sentences]
+    text = " ".join(sentences)
+    body = {"voice_id": voice_id, "text": text}
+    if name == "tts_pipeline":
+        body["pipeline"] = True
+    return body
+
+
+async def one_request(client, name, body):
+    # -> (name, status, latency, ttfb, bytes); status 0 = lỗi kết nối / timeout
+    method, path, _ = ROUTES[name]
+    t0 = time.perf_counter()
+    ttfb = None
+    size = 0
+    try:
+        async with client.stream(method, path, json=body) as r:
+            async for chunk in r.aiter_raw():
+                if ttfb is None:
+                    ttfb = time.perf_counter() - t0
+                size += len(chunk)
+            status = r.status_code
+    except httpx.HTTPError:
+        status = 0
+    return name, status, time.perf_counter() - t0, ttfb, size
+
+
+async def run_level(url, concurrency, duration, weights, tts_repeat, voice_id):
+    names = list(weights)
+    cum = list(itertools.accumulate(weights[n] for n in names))
+    results = []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30.0) as client:
+        deadline = time.perf_counter() + duration
+
+        async def worker():
+            while time.perf_counter() < deadline:
+                name = random.choices(names, cum_weights=cum)[0]
+                results.append(await one_request(client, name, request_body(name, tts_repeat, voice_id)))
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - t0
+    return results, elapsed
+
+
+# =========================================================
+# REPORT
+# =========================================================
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "p99": None}
+    values = sorted(values)
+    pick = lambda p: round(values[min(len(values) - 1, int(p * len(values)))] * 1000, 2)
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99)}
+
+
+def summarize(results, elapsed, concurrency):
+    by_route = {}
+    for name, status, latency, ttfb, size in results:
+        by_route.setdefault(name, []).append((status, latency, ttfb, size))
+
+    routes = {}
+    for name, rows in sorted(by_route.items()):
+        ok = [r for r in rows if 0 < r[0] < 400]
+        statuses = {}
+        for r in rows:
+            statuses[str(r[0])] = statuses.get(str(r[0]), 0) + 1
+        entry = {
+            "requests": len(rows),
+            "errors": len(rows) - len(ok),
+            "rps": round(len(rows) / elapsed, 2),
+            "latency_ms": percentiles([r[1] for r in ok]),
+            "bytes": sum(r[3] for r in ok),
+            "statuses": statuses,
+        }
+        if name in TTFB_ROUTES:
+            entry["ttfb_ms"] = percentiles([r[2] for r in ok if r[2] is not None])
+        routes[name] = entry
+
+    errors = sum(1 for r in results if not 0 < r[1] < 400)
+    return {
+        "concurrency": concurrency,
+        "duration": round(elapsed, 2),
+        "requests": len(results),
+        "errors": errors,
+        "rps": round(len(results) / elapsed, 2),
+        "latency_ms": percentiles([r[2] for r in results if 0 < r[1] < 400]),
+        "routes": routes,
+    }
+
+
+def fmt(v):
+    return "-" if v is None else f"{v:.1f}"
+
+
+def print_level(level):
+    lat = level["latency_ms"]
+    print(f"\n== concurrency {level['concurrency']}: {level['requests']} req in {level['duration']}s"
+          f"  {level['rps']} req/s  errors {level['errors']}"
+          f"  p50/p95/p99 {fmt(lat['p50'])}/{fmt(lat['p95'])}/{fmt(lat['p99'])} ms")
+    print(f"{'route':<14}{'req':>7}{'err':>6}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}   ttfb p50/p95/p99")
+    for name, r in level["routes"].items():
+        lat = r["latency_ms"]
+        ttfb = r.get("ttfb_ms")
+        extra = f"   {fmt(ttfb['p50'])}/{fmt(ttfb['p95'])}/{fmt(ttfb['p99'])}" if ttfb else ""
+        print(f"{name:<14}{r['requests']:>7}{r['errors']:>6}{r['rps']:>9.1f}"
+              f"{fmt(lat['p50']):>9}{fmt(lat['p95']):>9}{fmt(lat['p99']):>9}{extra}")
+
+
+def compare(report, baseline, max_regression):
+    """
+    In chênh lệch so với baseline (cùng concurrency). -> list regression vượt ngưỡng.
+    """
+    base_levels = {lvl["concurrency"]: lvl for lvl in baseline.get("levels", [])}
+    regressions = []
+    print(f"\n== so với baseline {baseline.get('meta', {}).get('git') or '?'}"
+          f" ({baseline.get('meta', {}).get('mode') or '?'})")
+
+    def check(label, new, old, higher_is_better):
+        if not new or not old:
+            return
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        mark = ""
+        if max_regression is not None and worse > max_regression:
+            mark = "  <-- REGRESSION"
+            regressions.append(label)
+        print(f"{label:<40}{old:>10.1f} -> {new:>10.1f}  ({change:+.1%}){mark}")
+
+    for level in report["levels"]:
+        old = base_levels.get(level["concurrency"])
+        if not old:
+            continue
+        c = level["concurrency"]
+        check(f"c={c} req/s", level["rps"], old["rps"], True)
+        check(f"c={c} p95 ms", level["latency_ms"]["p95"], old["latency_ms"]["p95"], False)
+        for name, r in level["routes"].items():
+            o = old["routes"].get(name)
+            if not o:
+                continue
+            check(f"c={c} {name} p95 ms", r["latency_ms"]["p95"], o["latency_ms"]["p95"], False)
+            if "ttfb_ms" in r and "ttfb_ms" in o:
+                check(f"c={c} {name} ttfb p95 ms", r["ttfb_ms"]["p95"], o["ttfb_ms"]["p95"], False)
+    return regressions
+
+
+# =========================================================
+# SPAWN (mock upstream + server)
+# =========================================================
+def spawn(args):
+    """
+    Bật mock_upstream.py + server (flask | asgi) trỏ vào mock. -> (url, [Popen], mode)
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    py = sys.executable
+    mock = f"http://127.0.0.1:{args.mock_http_port}"
+    procs = [subprocess.Popen(
+        [py, os.path.join(here, "mock_upstream.py"), "--http-port", str(args.mock_http_port),
+         "--ws-port", str(args.mock_ws_port), *shlex.split(args.mock_args)],
+        cwd=here, stdout=subprocess.DEVNULL)]
+
+    env = dict(os.environ,
+               BASE_API=f"{mock}/v1",
+               N8N_SIGNED_URL_ENDPOINT=f"{mock}/webhook/signed-url",
+               CALL_WS_UPSTREAM=f"ws://127.0.0.1:{args.mock_ws_port}/",
+               ELEVENLABS_API_KEY="mock-key",   # không bao giờ gửi key thật sang mock
+               AGENT_ID="mock-agent",
+               TTS_CACHE_DIR=tempfile.mkdtemp(prefix="loadtest-tts-"),
+               HOST="127.0.0.1",
+               PORT=str(args.port),
+               # mọi request đều từ 127.0.0.1 -> bucket theo client sẽ chặn gần hết; đo throughput thì tắt
+               ADMISSION_ENABLED=os.environ.get("ADMISSION_ENABLED", "1" if args.admission else "0"))
+    cmd = [py, os.path.join(here, "server.py"), "--host", "127.0.0.1", "--port", str(args.port)]
+    if args.spawn == "asgi":
+        cmd.append("--asgi")
+    procs.append(subprocess.Popen(cmd, cwd=here, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+    return f"http://127.0.0.1:{args.port}", procs
+
+
+def wait_ready(url, procs, timeout=30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        for p in procs:
+            if p.poll() is not None:
+                raise SystemExit(f"process thoát sớm (code {p.returncode}): {p.args}")
+        try:
+            # /readyz: chờ warm-up xong để không đo lúc instance còn lạnh
+            if httpx.get(f"{url}/readyz", timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f"server không sẵn sàng sau {timeout}s: {url}")
+
+
+def git_rev():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return None
+
+
+# =========================================================
+# MAIN
+# =========================================================
+def parse_mix(spec, only):
+    weights = {name: w for name, (_, _, w) in ROUTES.items()}
+    for item in filter(None, (spec or "").split(",")):
+        name, _, w = item.partition("=")
+        if name not in ROUTES:
+            raise SystemExit(f"route không hợp lệ: {name} (chọn trong {', '.join(ROUTES)})")
+        weights[name] = float(w or 1)
+    if only:
+        keep = set(only.split(","))
+        weights = {n: w for n, w in weights.items() if n in keep}
+    weights = {n: w for n, w in weights.items() if w > 0}
+    if not weights:
+        raise SystemExit("không còn route nào để chạy")
+    return weights
+
+
+async def bench(args, url, weights):
+    levels = []
+    if args.warmup > 0:
+        await run_level(url, min(args.concurrency), args.warmup, weights, args.tts_repeat, args.voice_id)
+    for c in args.concurrency:
+        results, elapsed = await run_level(url, c, args.duration, weights, args.tts_repeat, args.voice_id)
+        level = summarize(results, elapsed, c)
+        print_level(level)
+        levels.append(level)
+    return levels
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test app.py / asgi.py")
+    parser.add_argument("--url", default="http://127.0.0.1:8080", help="server đang chạy sẵn")
+    parser.add_argument("--spawn", choices=("flask", "asgi"), help="tự bật mock_upstream.py + server")
+    parser.add_argument("--port", type=int, default=8090, help="port server khi --spawn")
+    parser.add_argument("--mock-http-port", type=int, default=9910)
+    parser.add_argument("--mock-ws-port", type=int, default=9920)
+    parser.add_argument("--mock-args", default="", help="tham số thêm cho mock_upstream.py")
+    parser.add_argument("--admission", action="store_true",
+                        help="--spawn: giữ admission control (429 được đếm như lỗi)")
+    parser.add_argument("--concurrency", default="1,8,32",
+                        type=lambda s: [int(x) for x in s.split(",")])
+    parser.add_argument("--duration", type=float, default=10.0, help="giây / mức concurrency")
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--mix", help="trọng số route, vd tts=10,agent=2,metrics=0")
+    parser.add_argument("--routes", help="chỉ chạy các route này, vd tts,tts_pipeline")
+    parser.add_argument("--tts-repeat", type=float, default=0.0,
+                        help="tỉ lệ request TTS lặp text (trúng cache), 0 = luôn đi upstream")
+    parser.add_argument("--voice-id", default="voice001")
+    parser.add_argument("--json", help="ghi kết quả JSON ra file")
+    parser.add_argument("--compare", help="file JSON baseline để so sánh")
+    parser.add_argument("--max-regression", type=float,
+                        help="exit 1 nếu req/s / p95 tệ hơn baseline quá tỉ lệ này (vd 0.2)")
+    args = parser.parse_args()
+
+    weights = parse_mix(args.mix, args.routes)
+    procs = []
+    url = args.url.rstrip("/")
+    if args.spawn:
+        url, procs = spawn(args)
+    try:
+        wait_ready(url, procs)
+        print(f"target {url} ({args.spawn or 'external'}), routes: "
+              + ", ".join(f"{n}={w:g}" for n, w in weights.items()))
+        levels = asyncio.run(bench(args, url, weights))
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            try:
+                p.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                p.kill()
+
+    report = {
+        "meta": {"git": git_rev(), "mode": args.spawn or "external", "url": url,
+                 "duration": args.duration, "weights": weights, "tts_repeat": args.tts_repeat,
+                 "mock_args": args.mock_args, "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "levels": levels,
+    }
+    if args.json:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json)), exist_ok=True)
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n-> {args.json}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.max_regression)
+        if regressions:
+            print(f"\n{len(regressions)} regression vượt ngưỡng {args.max_regression:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
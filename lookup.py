@@ -0,0 +1,292 @@
+# lookup.py
+# /api/lookup: tra mã tour / khách / booking thẳng qua n8n, không đi vòng qua agent (LLM).
+#
+# - Cache theo từng mã: tìm thấy -> LOOKUP_TTL giây; không thấy -> LOOKUP_NEGATIVE_TTL (ngắn hơn,
+#   mã mới tạo sẽ thấy sớm). Lỗi upstream không cache.
+# - Gộp mã: mọi mã chưa có trong cache của các request tới trong LOOKUP_BATCH_WINDOW ms được gửi
+#   trong 1 call n8n (tối đa LOOKUP_BATCH_MAX mã). Mã đang được tra thì request sau chờ chung.
+#
+# Hợp đồng với n8n (cùng webhook với signed-url, phân biệt bằng "purpose"):
+#   -> {"purpose": "lookup", "codes": [{"type": "tour", "code": "T123"}, ...]}
+#   <- {"results": [{"type": "tour", "code": "T123", "found": true, "data": {...}}, ...]}
+#      (n8n hay bọc trong mảng / {"json": ...}: tìm "results" ở mọi độ sâu; mã không có trong
+#       kết quả = không tìm thấy)
+
+import asyncio
+import os
+import threading
+import time
+
+LOOKUP_TTL          = float(os.getenv("LOOKUP_TTL") or 300)
+LOOKUP_NEGATIVE_TTL = float(os.getenv("LOOKUP_NEGATIVE_TTL") or 30)
+LOOKUP_BATCH_WINDOW = float(os.getenv("LOOKUP_BATCH_WINDOW_MS") or 10) / 1000
+LOOKUP_BATCH_MAX    = int(os.getenv("LOOKUP_BATCH_MAX") or 20)
+LOOKUP_MAX_ENTRIES  = 5000
+
+CODE_TYPES = ("tour", "customer", "order")
+STOP_KEYS = ("itinerary", "stops", "schedule")
+ORDER_KEYS = ("order", "seq", "sequence", "day", "index")
+
+
+def parse_codes(data):
+    """
+    GET ?tour=T1&order=O1,O2 / POST {"tour": ..., "codes": [{"type", "code"}]} -> [(type, code)].
+    Sai -> ValueError.
+    """
+    out = []
+    for t in CODE_TYPES:
+        value = data.get(t)
+        values = value if isinstance(value, list) else str(value or "").split(",")
+        out += [(t, v.strip()) for v in values if isinstance(v, str) and v.strip()]
+    for item in data.get("codes") or []:
+        if not isinstance(item, dict) or item.get("type") not in CODE_TYPES or not item.get("code"):
+            raise ValueError(f"code không hợp lệ: {item!r} (type: {', '.join(CODE_TYPES)})")
+        out.append((item["type"], str(item["code"]).strip()))
+    if not out:
+        raise ValueError(f"cần ít nhất 1 mã: {', '.join(CODE_TYPES)}")
+    if len(out) > LOOKUP_BATCH_MAX:
+        raise ValueError(f"tối đa {LOOKUP_BATCH_MAX} mã / request")
+    return list(dict.fromkeys(out))
+
+
+def request_payload(keys):
+    return {"purpose": "lookup", "codes": [{"type": t, "code": c} for t, c in keys]}
+
+
+def _find_results(obj, depth=0):
+    if depth > 6:
+        return None
+    if isinstance(obj, dict):
+        if isinstance(obj.get("results"), list):
+            return obj["results"]
+        children = obj.values()
+    elif isinstance(obj, list):
+        if obj and all(isinstance(x, dict) and "code" in x for x in obj):
+            return obj
+        children = obj
+    else:
+        return None
+    for child in children:
+        found = _find_results(child, depth + 1)
+        if found is not None:
+            return found
+    return None
+
+
+def _stops(data):
+    # lịch trình theo đúng thứ tự (n8n có thể trả lộn xộn)
+    for key in STOP_KEYS:
+        stops = data.get(key)
+        if isinstance(stops, list):
+            def order(stop):
+                for k in ORDER_KEYS:
+                    if isinstance(stop, dict) and isinstance(stop.get(k), (int, float)):
+                        return stop[k]
+                return 0
+            return sorted(stops, key=order)
+    return None
+
+
+def parse_results(keys, body):
+    """
+    body JSON của n8n -> {(type, code): {"type", "code", "found", "data", "stops"}}.
+    """
+    out = {}
+    for item in _find_results(body) or []:
+        if not isinstance(item, dict):
+            continue
+        key = (item.get("type"), str(item.get("code") or "").strip())
+        if key not in keys:
+            continue
+        data = item.get("data")
+        if data is None:
+            data = {k: v for k, v in item.items() if k not in ("type", "code", "found")}
+        found = item.get("found")
+        found = bool(data) if found is None else bool(found)
+        result = {"type": key[0], "code": key[1], "found": found, "data": data if found else None}
+        if found and isinstance(data, dict):
+            result["stops"] = _stops(data)
+        out[key] = result
+    for key in keys:
+        out.setdefault(key, {"type": key[0], "code": key[1], "found": False, "data": None})
+    return out
+
+
+class _Slot:
+    # kết quả 1 mã đang tra; request khác chờ chung (Event cho thread, Future cho asyncio)
+    def __init__(self):
+        self.result = None
+        self.error = None
+        self._event = threading.Event()
+        self._futures = []
+
+    def set(self, result=None, error=None):
+        self.result, self.error = result, error
+        self._event.set()
+        for loop, fut in self._futures:
+            loop.call_soon_threadsafe(lambda f=fut: f.done() or f.set_result(None))
+
+    def wait(self, timeout):
+        return self._event.wait(timeout)
+
+    async def await_(self, timeout):
+        if self._event.is_set():
+            return True
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._futures.append((loop, fut))
+        if self._event.is_set():
+            return True
+        try:
+            await asyncio.wait_for(fut, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+class _Batch:
+    def __init__(self):
+        self.keys = []
+        self.closed = False
+
+
+class LookupService:
+    def __init__(self, name="lookup", ttl=LOOKUP_TTL, negative_ttl=LOOKUP_NEGATIVE_TTL,
+                 window=LOOKUP_BATCH_WINDOW, max_batch=LOOKUP_BATCH_MAX):
+        self.name = name
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.window = window
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._cache = {}        # (type, code) -> (result, expires_at)
+        self._pending = {}      # (type, code) -> _Slot
+        self._batch = None      # batch đang mở, chưa gửi
+        self.stats = {"hits": 0, "negative_hits": 0, "misses": 0, "coalesced": 0,
+                      "batches": 0, "batched_codes": 0, "errors": 0}
+
+    # ---------- chung ----------
+    def _plan(self, keys):
+        """
+        -> (kết quả có sẵn, slot phải chờ, batch mình phải gửi). Gọi trong lock.
+        """
+        now = time.monotonic()
+        ready, slots, led = {}, {}, []
+        for key in keys:
+            cached = self._cache.get(key)
+            if cached is not None and cached[1] > now:
+                self.stats["hits" if cached[0]["found"] else "negative_hits"] += 1
+                ready[key] = {**cached[0], "cached": True}
+                continue
+            slot = self._pending.get(key)
+            if slot is not None:
+                self.stats["coalesced"] += 1
+                slots[key] = slot
+                continue
+            self.stats["misses"] += 1
+            if self._batch is None or self._batch.closed or len(self._batch.keys) >= self.max_batch:
+                self._batch = _Batch()
+                led.append(self._batch)
+            self._batch.keys.append(key)
+            slots[key] = self._pending[key] = _Slot()
+        return ready, slots, led
+
+    def _close(self, batch):
+        with self._lock:
+            if batch.closed:
+                return
+            batch.closed = True
+            if self._batch is batch:
+                self._batch = None
+            self.stats["batches"] += 1
+            self.stats["batched_codes"] += len(batch.keys)
+
+    def _fill(self, batch, results=None, error=None):
+        now = time.monotonic()
+        with self._lock:
+            if error is not None:
+                self.stats["errors"] += 1
+            for key in batch.keys:
+                slot = self._pending.pop(key, None)
+                if error is None:
+                    result = results[key]
+                    ttl = self.ttl if result["found"] else self.negative_ttl
+                    self._cache[key] = (result, now + ttl)
+                if slot is not None:
+                    slot.set(None if error else results[key], error)
+            while len(self._cache) > LOOKUP_MAX_ENTRIES:
+                self._cache.pop(next(iter(self._cache)))
+
+    @staticmethod
+    def _collect(keys, ready, slots, timeout_ok):
+        out = []
+        for key in keys:
+            if key in ready:
+                out.append(ready[key])
+                continue
+            slot = slots[key]
+            if not timeout_ok.get(key, True) or (slot.result is None and slot.error is None):
+                out.append({"type": key[0], "code": key[1], "error": "lookup timeout"})
+            elif slot.error is not None:
+                out.append({"type": key[0], "code": key[1], "error": slot.error})
+            else:
+                out.append({**slot.result, "cached": False})
+        return out
+
+    # ---------- sync (Flask) ----------
+    def lookup(self, keys, fetch, timeout=30.0):
+        """
+        fetch(keys) -> body JSON của n8n (raise nếu lỗi). -> list kết quả theo thứ tự keys.
+        """
+        with self._lock:
+            ready, slots, led = self._plan(keys)
+        if led:
+            time.sleep(self.window)      # chờ request khác gộp mã vào batch
+        for batch in led:
+            self._close(batch)
+            try:
+                self._fill(batch, parse_results(set(batch.keys), fetch(batch.keys)))
+            except Exception as e:
+                self._fill(batch, error=str(e))
+        waited = {key: slot.wait(timeout) for key, slot in slots.items()}
+        return self._collect(keys, ready, slots, waited)
+
+    # ---------- async (Quart) ----------
+    async def alookup(self, keys, fetch, timeout=30.0):
+        with self._lock:
+            ready, slots, led = self._plan(keys)
+        pending = list(led)
+        try:
+            if led:
+                await asyncio.sleep(self.window)
+            while pending:
+                batch = pending[0]
+                self._close(batch)
+                try:
+                    self._fill(batch, parse_results(set(batch.keys), await fetch(batch.keys)))
+                except Exception as e:
+                    self._fill(batch, error=str(e))
+                pending.pop(0)
+        except asyncio.CancelledError:
+            # client ngắt giữa chừng: request khác đang chờ các mã này không bị treo
+            for batch in pending:
+                self._close(batch)
+                self._fill(batch, error="cancelled")
+            raise
+        waited = {key: await slot.await_(timeout) for key, slot in slots.items()}
+        return self._collect(keys, ready, slots, waited)
+
+    def invalidate(self, key=None):
+        # cùng interface với TTLCache (/api/cache/invalidate?name=lookup); key = (type, code)
+        with self._lock:
+            if key is not None:
+                return 1 if self._cache.pop(key, None) is not None else 0
+            n = len(self._cache)
+            self._cache.clear()
+        return n
+
+    def info(self):
+        with self._lock:
+            return {"ttl": self.ttl, "negative_ttl": self.negative_ttl,
+                    "batch_window_ms": self.window * 1000, "entries": len(self._cache),
+                    "pending": len(self._pending), **self.stats}
@@ -0,0 +1,180 @@
+# metrics.py
+# Counter / Gauge / Histogram nhẹ, thread-safe, không phụ thuộc thư viện ngoài.
+# Histogram dùng bucket cố định (như Prometheus) nên observe() là O(#bucket)
+# và quantile chỉ là ước lượng nội suy trong bucket.
+# render_prometheus() xuất toàn bộ REGISTRY theo text format của Prometheus (/metrics).
+
+import bisect
+import threading
+
+# giây: 5ms .. 30s — đủ cho cả token mint lẫn TTS
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0)
+
+REGISTRY = []
+
+
+def _round(v):
+    return round(v, 4) if v is not None else None
+
+
+def _key(labelnames, labels):
+    return tuple(str(labels.get(n, "")) for n in labelnames)
+
+
+class Counter:
+    def __init__(self, name, help="", labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.append(self)
+
+    def inc(self, amount=1, **labels):
+        k = _key(self.labelnames, labels)
+        with self._lock:
+            self._values[k] = self._values.get(k, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+
+class Gauge:
+    def __init__(self, name, help="", labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.append(self)
+
+    def inc(self, amount=1, **labels):
+        k = _key(self.labelnames, labels)
+        with self._lock:
+            self._values[k] = self._values.get(k, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        k = _key(self.labelnames, labels)
+        with self._lock:
+            self._values[k] = value
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+
+class GaugeFunc:
+    """
+    Giá trị đọc lúc scrape: fn() -> {label tuple: value} (vd depth của token pool).
+    kind="counter" cho các bộ đếm sẵn có dạng dict stats (cache hits, ...).
+    """
+
+    def __init__(self, name, help="", labelnames=(), fn=None, kind="gauge"):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+        self.kind = kind
+        REGISTRY.append(self)
+
+    def snapshot(self):
+        return {tuple(str(v) for v in k): val for k, val in self.fn().items()}
+
+
+class Histogram:
+    def __init__(self, name, help="", labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series = {}         # key -> [counts per bucket (+Inf cuối), sum, count]
+        REGISTRY.append(self)
+
+    def observe(self, value, **labels):
+        k = _key(self.labelnames, labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(k)
+            if s is None:
+                s = self._series[k] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            s[0][i] += 1
+            s[1] += value
+            s[2] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {k: ([*s[0]], s[1], s[2]) for k, s in self._series.items()}
+
+    def quantile(self, q, counts, total):
+        """
+        Ước lượng quantile q từ counts của 1 series (nội suy tuyến tính trong bucket).
+        """
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        lower = 0.0
+        for i, c in enumerate(counts):
+            upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+            if seen + c >= rank and c:
+                return lower + (upper - lower) * ((rank - seen) / c)
+            seen += c
+            lower = upper
+        return self.buckets[-1]
+
+    def summary(self):
+        out = {}
+        for k, (counts, total_sum, n) in self.snapshot().items():
+            name = ",".join(f"{ln}={lv}" for ln, lv in zip(self.labelnames, k)) or "all"
+            out[name] = {
+                "count": n,
+                "avg": round(total_sum / n, 4) if n else None,
+                **{f"p{int(q * 100)}": _round(self.quantile(q, counts, n)) for q in (0.50, 0.95, 0.99)},
+            }
+        return out
+
+
+# =========================================================
+# PROMETHEUS TEXT FORMAT
+# =========================================================
+def _escape(v):
+    return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(str(v))}"' for n, v in pairs) + "}"
+
+
+def _num(v):
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+def render_prometheus(registry=None):
+    lines = []
+    for m in registry if registry is not None else REGISTRY:
+        kind = {Counter: "counter", Histogram: "histogram"}.get(type(m)) or getattr(m, "kind", "gauge")
+        lines.append(f"# HELP {m.name} {m.help}".rstrip())
+        lines.append(f"# TYPE {m.name} {kind}")
+        if kind != "histogram":
+            for k, v in sorted(m.snapshot().items()):
+                lines.append(f"{m.name}{_labels(m.labelnames, k)} {_num(v)}")
+            continue
+        for k, (counts, total_sum, n) in sorted(m.snapshot().items()):
+            cumulative = 0
+            for bound, c in zip((*m.buckets, float("inf")), counts):
+                cumulative += c
+                le = (("le", _num(bound)),)
+                lines.append(f"{m.name}_bucket{_labels(m.labelnames, k, le)} {cumulative}")
+            lines.append(f"{m.name}_sum{_labels(m.labelnames, k)} {_num(total_sum)}")
+            lines.append(f"{m.name}_count{_labels(m.labelnames, k)} {n}")
+    return "\n".join(lines) + "\n"
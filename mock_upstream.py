@@ -0,0 +1,360 @@
+# mock_upstream.py
+# Stand-in local cho upstream ElevenLabs + n8n, để chạy / đo server mà không gọi API thật.
+#
+#   python mock_upstream.py                  # HTTP tại http://127.0.0.1:9910, ConvAI WS tại ws://127.0.0.1:9920/
+#   BASE_API=http://127.0.0.1:9910/v1 N8N_SIGNED_URL_ENDPOINT=http://127.0.0.1:9910/webhook/signed-url \
+#   CALL_WS_RELAY=1 CALL_WS_UPSTREAM=ws://127.0.0.1:9920/ python asgi.py
+#   python loadtest.py --spawn asgi          # tự bật mock + server rồi bắn tải
+#
+# HTTP stand-in (cùng path với ElevenLabs, prefix /v1):
+#   GET  /v1/convai/conversation/get-signed-url   GET /v1/convai/conversation/token
+#   GET  /v1/convai/agents/{id} | /v1/agents/{id} (1 biến thể trả 404, giống fallback thật)
+#   GET  /v1/voices | /v1/voices/search           (như trên)
+#   POST /v1/text-to-speech/{voice}/stream        chunked, độ dài theo text, chia nhịp từng chunk
+#   POST /webhook/...                             n8n: signed_url lồng trong JSON;
+#                                                 {"purpose": "lookup", "codes": [...]} -> lịch trình giả
+#   GET  /__stats                                 đếm request / lỗi inject theo endpoint
+#
+# Latency / jitter / lỗi inject được chỉnh chung hoặc theo endpoint
+# (signed_url, token, agent, voices, tts, n8n):
+#   --latency 50 --latency n8n=800 --jitter 20 --error-rate 0.02 --error-rate tts=0.1
+#
+# ConvAI WS stand-in:
+#   - chờ conversation_initiation_client_data, trả conversation_initiation_metadata
+#   - mỗi MOCK_ECHO_CHUNKS chunk mic -> 1 event "audio" (echo lại PCM nhận được)
+#     + 1 "agent_response"
+#   - gửi "ping" định kỳ, đếm "pong" nhận về
+
+import argparse
+import asyncio
+import base64
+import collections
+import itertools
+import json
+import os
+import random
+import re
+from urllib.parse import parse_qs, urlsplit
+
+import websockets
+
+MOCK_ECHO_CHUNKS = int(os.getenv("MOCK_ECHO_CHUNKS") or 25)     # 25 x 20ms = 0.5s
+MOCK_PING_EVERY  = float(os.getenv("MOCK_PING_EVERY") or 2.0)
+
+# HTTP stand-in
+MOCK_LATENCY_MS    = float(os.getenv("MOCK_LATENCY_MS") or 50)     # trước header (TTFB)
+MOCK_JITTER_MS     = float(os.getenv("MOCK_JITTER_MS") or 20)      # +- đều quanh latency
+MOCK_ERROR_RATE    = float(os.getenv("MOCK_ERROR_RATE") or 0)
+MOCK_ERROR_STATUS  = int(os.getenv("MOCK_ERROR_STATUS") or 500)
+MOCK_TTS_CHUNK     = int(os.getenv("MOCK_TTS_CHUNK") or 4096)      # byte / chunk TTS
+MOCK_TTS_CHUNK_MS  = float(os.getenv("MOCK_TTS_CHUNK_MS") or 20)   # nhịp giữa các chunk TTS
+MOCK_TTS_BYTES_PER_CHAR = int(os.getenv("MOCK_TTS_BYTES_PER_CHAR") or 160)  # ~mp3 128kbps
+MOCK_VOICES        = int(os.getenv("MOCK_VOICES") or 40)
+MOCK_AGENT_ROUTE   = os.getenv("MOCK_AGENT_ROUTE") or "convai"     # convai | legacy
+MOCK_VOICES_ROUTE  = os.getenv("MOCK_VOICES_ROUTE") or "voices"    # voices | search
+
+ENDPOINTS = ("signed_url", "token", "agent", "voices", "tts", "n8n")
+
+_event_ids = itertools.count(1)
+stats = {"sessions": 0, "chunks": 0, "pings": 0, "pongs": 0, "messages": 0}
+http_stats = collections.Counter()
+
+
+async def convai(ws):
+    stats["sessions"] += 1
+    init = json.loads(await ws.recv())
+    if init.get("type") != "conversation_initiation_client_data":
+        await ws.close(1002, "expected conversation_initiation_client_data")
+        return
+    await ws.send(json.dumps({
+        "type": "conversation_initiation_metadata",
+        "conversation_initiation_metadata_event": {
+            "conversation_id": f"mock-{stats['sessions']}",
+            "agent_output_audio_format": "pcm_16000",
+            "overrides": init.get("overrides") or {},
+        },
+    }))
+
+    async def pinger():
+        while True:
+            await asyncio.sleep(MOCK_PING_EVERY)
+            stats["pings"] += 1
+            await ws.send(json.dumps({"type": "ping",
+                                      "ping_event": {"event_id": next(_event_ids), "ping_ms": 0}}))
+
+    ping_task = asyncio.ensure_future(pinger())
+    pending = []
+    try:
+        async for raw in ws:
+            data = json.loads(raw)
+            if "user_audio_chunk" in data:
+                stats["chunks"] += 1
+                pending.append(base64.b64decode(data["user_audio_chunk"]))
+                if len(pending) >= MOCK_ECHO_CHUNKS:
+                    audio, pending = b"".join(pending), []
+                    event_id = next(_event_ids)
+                    await ws.send(json.dumps({
+                        "type": "audio",
+                        "audio_event": {"audio_base_64": base64.b64encode(audio).decode("ascii"),
+                                        "event_id": event_id},
+                    }))
+                    await ws.send(json.dumps({
+                        "type": "agent_response",
+                        "agent_response_event": {"agent_response": f"echo {len(audio)} bytes"},
+                    }))
+            elif data.get("type") == "pong":
+                stats["pongs"] += 1
+            else:
+                stats["messages"] += 1
+    except websockets.ConnectionClosed:
+        pass
+    finally:
+        ping_task.cancel()
+
+
+# =========================================================
+# HTTP STAND-IN (ElevenLabs REST + n8n webhook)
+# =========================================================
+# override theo endpoint từ CLI: {"n8n": 800.0, ...}
+latency_ms = {}
+error_rate = {}
+
+_AGENT_PATHS = {"convai": re.compile(r"^/v1/convai/agents/([^/]+)$"),
+                "legacy": re.compile(r"^/v1/agents/([^/]+)$")}
+_VOICES_PATHS = {"voices": "/v1/voices", "search": "/v1/voices/search"}
+_TTS_PATH = re.compile(r"^/v1/text-to-speech/([^/]+)/stream$")
+_REASONS = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found",
+            429: "Too Many Requests", 500: "Internal Server Error", 502: "Bad Gateway",
+            503: "Service Unavailable"}
+_MP3_FRAME = b"\xff\xfb\x90\x64" + bytes(413)      # 1 frame MPEG1 L3 128kbps 44.1kHz (im lặng)
+
+
+def _lookup(codes):
+    # mã bắt đầu bằng "X" = không tồn tại; còn lại trả lịch trình giả (stops cố ý lộn thứ tự)
+    http_stats["lookup_codes"] += len(codes)
+    out = []
+    for c in codes:
+        code = str(c.get("code") or "")
+        if code.upper().startswith("X"):
+            out.append({"type": c.get("type"), "code": code, "found": False})
+            continue
+        out.append({"type": c.get("type"), "code": code, "found": True, "data": {
+            "title": f"Mock {c.get('type')} {code}",
+            "itinerary": [
+                {"order": 2, "name": "Hội An", "time": "13:00", "hotel": "Mock Riverside"},
+                {"order": 1, "name": "Đà Nẵng", "time": "08:00", "restaurant": "Mock Seafood"},
+                {"order": 3, "name": "Mỹ Sơn", "time": "16:30"},
+            ]}})
+    return out
+
+
+def _voices():
+    # vài voice premade (server lọc bỏ) + voice "của tôi"
+    out = [{"voice_id": f"premade{i}", "name": f"Premade {i}", "category": "premade"}
+           for i in range(3)]
+    langs = ("en", "vi", "ja", "fr")
+    out += [{"voice_id": f"voice{i:03d}", "name": f"Mock voice {i}", "category": "cloned",
+             "labels": {"language": langs[i % len(langs)], "accent": "neutral"}}
+            for i in range(MOCK_VOICES)]
+    return out
+
+
+def _agent(agent_id):
+    return {"agent_id": agent_id, "name": "Mock agent",
+            "conversation_config": {"language": "en",
+                                    "additional_languages": ["vi", "ja"],
+                                    "tts": {"voice_id": "voice000", "agent_output_audio_format": "pcm_16000"}}}
+
+
+def _signed_url(agent_id):
+    n = next(_event_ids)
+    return f"wss://mock.local/v1/convai/conversation?agent_id={agent_id}&conversation_signature=mock{n}"
+
+
+async def _delay(name):
+    base = latency_ms.get(name, MOCK_LATENCY_MS)
+    jitter = MOCK_JITTER_MS
+    await asyncio.sleep(max(0.0, base + random.uniform(-jitter, jitter)) / 1000)
+
+
+def _inject_error(name):
+    return random.random() < error_rate.get(name, MOCK_ERROR_RATE)
+
+
+async def _send(writer, status, body, content_type="application/json"):
+    if not isinstance(body, bytes):
+        body = json.dumps(body).encode()
+    writer.write((f"HTTP/1.1 {status} {_REASONS.get(status, 'Status')}\r\n"
+                  f"Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\n\r\n").encode()
+                 + body)
+    await writer.drain()
+
+
+async def _send_tts(writer, text):
+    # chunked: header ngay sau latency, sau đó từng chunk theo MOCK_TTS_CHUNK_MS
+    total = max(MOCK_TTS_CHUNK, len(text) * MOCK_TTS_BYTES_PER_CHAR)
+    audio = (_MP3_FRAME * (total // len(_MP3_FRAME) + 1))[:total]
+    writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: audio/mpeg\r\nTransfer-Encoding: chunked\r\n\r\n")
+    for i in range(0, total, MOCK_TTS_CHUNK):
+        if i:
+            await asyncio.sleep(MOCK_TTS_CHUNK_MS / 1000)
+        chunk = audio[i:i + MOCK_TTS_CHUNK]
+        writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+        await writer.drain()
+    writer.write(b"0\r\n\r\n")
+    await writer.drain()
+
+
+def _route(method, path):
+    # -> tên endpoint (để chỉnh latency / đếm) hoặc None
+    if method == "GET" and path == "/v1/convai/conversation/get-signed-url":
+        return "signed_url"
+    if method == "GET" and path == "/v1/convai/conversation/token":
+        return "token"
+    if method == "GET" and any(p.match(path) for p in _AGENT_PATHS.values()):
+        return "agent"
+    if method == "GET" and path in _VOICES_PATHS.values():
+        return "voices"
+    if method == "POST" and _TTS_PATH.match(path):
+        return "tts"
+    if method == "POST" and path.startswith("/webhook"):
+        return "n8n"
+    return None
+
+
+async def dispatch(method, target, headers, body, writer):
+    url = urlsplit(target)
+    path, query = url.path, parse_qs(url.query)
+    if path == "/__stats":
+        return await _send(writer, 200, {"http": dict(http_stats), "ws": stats})
+
+    name = _route(method, path)
+    if name is None:
+        http_stats["not_found"] += 1
+        return await _send(writer, 404, {"detail": "Not Found"})
+    if name != "n8n" and not headers.get("xi-api-key"):
+        http_stats[f"{name}:401"] += 1
+        return await _send(writer, 401, {"detail": {"status": "invalid_api_key"}})
+
+    await _delay(name)
+    if _inject_error(name):
+        http_stats[f"{name}:{MOCK_ERROR_STATUS}"] += 1
+        return await _send(writer, MOCK_ERROR_STATUS, {"detail": {"status": "mock_injected_error"}})
+
+    agent_id = (query.get("agent_id") or ["mock-agent"])[0]
+    if name == "agent":
+        m = _AGENT_PATHS[MOCK_AGENT_ROUTE].match(path)
+        if not m:
+            http_stats["agent:404"] += 1
+            return await _send(writer, 404, {"detail": {"status": "not_found"}})
+        http_stats["agent"] += 1
+        return await _send(writer, 200, _agent(m.group(1)))
+    if name == "voices":
+        if path != _VOICES_PATHS[MOCK_VOICES_ROUTE]:
+            http_stats["voices:404"] += 1
+            return await _send(writer, 404, {"detail": {"status": "not_found"}})
+        http_stats["voices"] += 1
+        return await _send(writer, 200, {"voices": _voices()})
+
+    http_stats[name] += 1
+    if name == "signed_url":
+        return await _send(writer, 200, {"signed_url": _signed_url(agent_id)})
+    if name == "token":
+        return await _send(writer, 200, {"token": f"mock-token-{next(_event_ids)}"})
+    if name == "n8n":
+        try:
+            payload = json.loads(body or b"{}")
+        except ValueError:
+            payload = {}
+        if isinstance(payload, dict) and payload.get("purpose") == "lookup":
+            return await _send(writer, 200, [{"json": {"results": _lookup(payload.get("codes") or [])}}])
+        # n8n hay bọc kết quả trong mảng / object lồng -> server phải tìm sâu
+        return await _send(writer, 200, [{"json": {"data": {"signed_url": _signed_url(agent_id)}}}])
+
+    try:
+        text = json.loads(body or b"{}").get("text") or ""
+    except ValueError:
+        return await _send(writer, 400, {"detail": "invalid json"})
+    await _send_tts(writer, text)
+
+
+async def handle_http(reader, writer):
+    # HTTP/1.1 tối giản, có keep-alive (server dùng connection pool)
+    try:
+        while True:
+            line = await reader.readline()
+            if not line.strip():
+                break
+            method, target, _ = line.decode("latin-1").split(" ", 2)
+            headers = {}
+            while True:
+                h = await reader.readline()
+                if h in (b"\r\n", b"\n", b""):
+                    break
+                k, _, v = h.decode("latin-1").partition(":")
+                headers[k.strip().lower()] = v.strip()
+            n = int(headers.get("content-length") or 0)
+            body = await reader.readexactly(n) if n else b""
+            await dispatch(method, target, headers, body, writer)
+            if headers.get("connection", "").lower() == "close":
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+def _per_endpoint(values, target):
+    # "50" -> mặc định cho mọi endpoint; "n8n=800" -> chỉ endpoint đó
+    default = None
+    for v in values or ():
+        name, sep, num = v.partition("=")
+        if not sep:
+            default = float(name)
+        elif name in ENDPOINTS:
+            target[name] = float(num)
+        else:
+            raise SystemExit(f"endpoint không hợp lệ: {name} (chọn trong {', '.join(ENDPOINTS)})")
+    return default
+
+
+async def serve(host, ws_port, http_port=9910):
+    servers = []
+    if http_port:
+        servers.append(await asyncio.start_server(handle_http, host, http_port, backlog=1024))
+        print(f"mock ElevenLabs HTTP: http://{host}:{http_port}/v1  n8n: http://{host}:{http_port}/webhook/signed-url")
+    async with websockets.serve(convai, host, ws_port, max_size=None, compression=None):
+        print(f"mock ConvAI WS: ws://{host}:{ws_port}/")
+        await asyncio.Future()
+
+
+def main():
+    global MOCK_LATENCY_MS, MOCK_JITTER_MS, MOCK_ERROR_RATE, MOCK_ERROR_STATUS
+    global MOCK_AGENT_ROUTE, MOCK_VOICES_ROUTE
+
+    parser = argparse.ArgumentParser(description="Mock upstream ElevenLabs + n8n")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--ws-port", type=int, default=9920)
+    parser.add_argument("--http-port", type=int, default=9910, help="0 = tắt HTTP stand-in")
+    parser.add_argument("--latency", action="append", metavar="[ENDPOINT=]MS")
+    parser.add_argument("--jitter", type=float, metavar="MS")
+    parser.add_argument("--error-rate", action="append", metavar="[ENDPOINT=]RATE")
+    parser.add_argument("--error-status", type=int)
+    parser.add_argument("--agent-route", choices=tuple(_AGENT_PATHS))
+    parser.add_argument("--voices-route", choices=tuple(_VOICES_PATHS))
+    args = parser.parse_args()
+
+    lat = _per_endpoint(args.latency, latency_ms)
+    err = _per_endpoint(args.error_rate, error_rate)
+    MOCK_LATENCY_MS = MOCK_LATENCY_MS if lat is None else lat
+    MOCK_ERROR_RATE = MOCK_ERROR_RATE if err is None else err
+    MOCK_JITTER_MS = MOCK_JITTER_MS if args.jitter is None else args.jitter
+    MOCK_ERROR_STATUS = args.error_status or MOCK_ERROR_STATUS
+    MOCK_AGENT_ROUTE = args.agent_route or MOCK_AGENT_ROUTE
+    MOCK_VOICES_ROUTE = args.voices_route or MOCK_VOICES_ROUTE
+
+    asyncio.run(serve(args.host, args.ws_port, args.http_port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# profiler.py
+# Sampling profiler (opt-in) cho /api/profile: chụp stack của mọi thread PROFILER_HZ lần / giây
+# trong N giây, gộp thành flame graph.
+#
+#   format=folded      "thread;frame;frame;... count" (flamegraph.pl, inferno, speedscope đọc thẳng)
+#   format=speedscope  JSON cho https://www.speedscope.app
+#
+# Đo wall-clock: thread đang chờ I/O (vd đợi n8n trả lời) vẫn hiện ở frame đang chờ — đúng thứ
+# cần xem khi request chậm. Thread rảnh (chờ việc trong pool / select của event loop) bị bỏ, trừ
+# khi ?idle=1. Chỉ 1 phiên profile 1 lúc; tắt mặc định vì chụp stack tốn CPU của chính server.
+#
+#   PROFILER_ENABLED=0  PROFILER_HZ=100  PROFILER_MAX_SECONDS=60
+#   curl -s -H "X-Admin-Token: $ADMIN_TOKEN" "localhost:8080/api/profile?seconds=10" > out.folded
+#   flamegraph.pl out.folded > flame.svg
+
+import collections
+import os
+import sys
+import threading
+import time
+
+PROFILER_ENABLED     = (os.getenv("PROFILER_ENABLED") or "").lower() in ("1", "true", "yes")
+PROFILER_HZ          = int(os.getenv("PROFILER_HZ") or 100)
+PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS") or 60)
+FORMATS = ("folded", "speedscope")
+
+# frame lá = thread đang rảnh chờ việc (file, function)
+IDLE_LEAVES = {
+    ("threading.py", "wait"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),           # ThreadPoolExecutor chờ task (SimpleQueue.get là C)
+    ("socketserver.py", "serve_forever"),
+}
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def parse_request(args):
+    """
+    request.args -> (seconds, hz, format, idle). Sai -> ValueError.
+    """
+    try:
+        seconds = float(args.get("seconds") or 5)
+        hz = int(args.get("hz") or PROFILER_HZ)
+    except ValueError:
+        raise ValueError("seconds / hz phải là số")
+    if not 0 < seconds <= PROFILER_MAX_SECONDS:
+        raise ValueError(f"seconds phải trong (0, {PROFILER_MAX_SECONDS:g}]")
+    if not 1 <= hz <= 1000:
+        raise ValueError("hz phải trong [1, 1000]")
+    fmt = args.get("format") or "folded"
+    if fmt not in FORMATS:
+        raise ValueError(f"format: {', '.join(FORMATS)}")
+    idle = (args.get("idle") or "").lower() in ("1", "true", "yes")
+    return seconds, hz, fmt, idle
+
+
+def _stack(frame):
+    # -> [(file, function, line)] từ ngoài vào trong
+    out = []
+    while frame is not None:
+        code = frame.f_code
+        out.append((os.path.basename(code.co_filename), code.co_name, code.co_firstlineno))
+        frame = frame.f_back
+    out.reverse()
+    return tuple(out)
+
+
+class Profile:
+    def __init__(self, counts, ticks, hz, seconds):
+        self.counts = counts          # (thread name, *stack) -> số sample
+        self.ticks = ticks
+        self.hz = hz
+        self.seconds = seconds
+
+    def folded(self):
+        lines = []
+        for (thread, *stack), n in sorted(self.counts.items(), key=lambda kv: -kv[1]):
+            frames = [thread] + [f"{fn} ({file}:{line})" for file, fn, line in stack]
+            lines.append(";".join(f.replace(";", ":") for f in frames) + f" {n}")
+        return "\n".join(lines) + "\n"
+
+    def speedscope(self):
+        index, frames = {}, []
+
+        def frame_id(frame):
+            if frame not in index:
+                index[frame] = len(frames)
+                name, file, line = frame
+                frames.append({"name": name, "file": file, "line": line} if file else {"name": name})
+            return index[frame]
+
+        samples, weights = [], []
+        for (thread, *stack), n in self.counts.items():
+            ids = [frame_id((f"thread {thread}", None, None))]
+            ids += [frame_id((fn, file, line)) for file, fn, line in stack]
+            samples.append(ids)
+            weights.append(n)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": [{"type": "sampled", "name": f"server {self.seconds:g}s @ {self.hz}Hz",
+                          "unit": "none", "startValue": 0, "endValue": sum(weights),
+                          "samples": samples, "weights": weights}],
+            "exporter": "profiler.py",
+        }
+
+
+class Profiler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stats = {"runs": 0, "busy": 0, "samples": 0}
+
+    def sample(self, seconds, hz=PROFILER_HZ, idle=False):
+        """
+        Chặn thread gọi trong `seconds` giây (ASGI: chạy qua asyncio.to_thread). -> Profile.
+        """
+        if not self._lock.acquire(blocking=False):
+            self.stats["busy"] += 1
+            raise ProfilerBusy("đang có phiên profile khác")
+        try:
+            me = threading.get_ident()
+            counts = collections.Counter()
+            interval = 1.0 / hz
+            ticks = 0
+            deadline = time.perf_counter() + seconds
+            while True:
+                t0 = time.perf_counter()
+                if t0 >= deadline:
+                    break
+                names = {t.ident: t.name for t in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    stack = _stack(frame)
+                    if not idle and stack and stack[-1][:2] in IDLE_LEAVES:
+                        continue
+                    counts[(names.get(ident, str(ident)), *stack)] += 1
+                ticks += 1
+                time.sleep(max(0.0, interval - (time.perf_counter() - t0)))
+            self.stats["runs"] += 1
+            self.stats["samples"] += sum(counts.values())
+            return Profile(counts, ticks, hz, seconds)
+        finally:
+            self._lock.release()
+
+    def info(self):
+        return {"enabled": PROFILER_ENABLED, "hz": PROFILER_HZ, "max_seconds": PROFILER_MAX_SECONDS,
+                "running": self._lock.locked(), **self.stats}
+
+
+profiler = Profiler()
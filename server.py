@@ -1,42 +1,40 @@
-import os, requests
-from flask import Flask, jsonify, send_from_directory
-from flask_cors import CORS
-from dotenv import load_dotenv
-
-load_dotenv()
-API_KEY = os.getenv("ELEVENLABS_API_KEY")
-AGENT_ID = os.getenv("AGENT_ID")
-
-if not API_KEY or not AGENT_ID:
-    raise RuntimeError("Missing ELEVENLABS_API_KEY or AGENT_ID in .env")
+# server.py
+# Entry point duy nhất (thay cho server.py cũ port 8787 và "app copy.py").
+#
+#   python server.py                  # Flask, threaded, bind $HOST:$PORT (mặc định 0.0.0.0:8080)
+#   python server.py --asgi           # ASGI: Quart + hypercorn (như python asgi.py)
+#   SERVER_MODE=asgi python server.py
+#
+# Process manager ngoài dùng thẳng app factory:
+#   gunicorn "app:create_app()" -w 4 -b 0.0.0.0:8080 --threads 8
+#   hypercorn "asgi:create_app()" -w 4 -b 0.0.0.0:8080
+#
+# App nhận traffic ngay; warm-up chạy nền, theo dõi ở /readyz (liveness: /healthz).
+
+import argparse
+import os
 
-app = Flask(__name__, static_folder="static")
-CORS(app)
-
-@app.route("/", methods=["GET"])
-def index():
-    return send_from_directory("static", "index.html")
+from dotenv import load_dotenv
 
-@app.get("/pcm-worklet.js")
-def pcm_worklet():
-    return send_from_directory("static", "pcm-worklet.js")
 
-@app.route("/api/get-ws-url", methods=["POST"])
-def get_ws_url():
-    # ✅ đúng endpoint hiện tại
-    url = f"https://api.elevenlabs.io/v1/convai/conversation/get-signed-url?agent_id={AGENT_ID}"
-    headers = {"xi-api-key": API_KEY}
+def main():
+    load_dotenv()   # PORT / HOST / SERVER_MODE có thể nằm trong .env
+    parser = argparse.ArgumentParser(description="ElevenLabs voice assistant server")
+    parser.add_argument("--asgi", action="store_true", help="chạy ASGI mode (Quart + hypercorn)")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8080")))
+    args = parser.parse_args()
 
-    r = requests.get(url, headers=headers, timeout=30)
-    if r.status_code != 200:
-        return jsonify({"error": r.text}), 500
+    if args.asgi or (os.getenv("SERVER_MODE") or "").lower() == "asgi":
+        os.environ["HOST"], os.environ["PORT"] = args.host, str(args.port)
+        import asgi
+        asgi.main()
+        return
 
-    body = r.json()
-    signed_url = body.get("signed_url")
-    if not signed_url:
-        return jsonify({"error": "No signed_url in response", "raw": body}), 500
+    from app import create_app
+    debug = (os.getenv("FLASK_DEBUG") or "").lower() in ("1", "true", "yes")
+    create_app().run(host=args.host, port=args.port, threaded=True, debug=debug)
 
-    return jsonify({"ws_url": signed_url})
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=8787, debug=True)
\ No newline at end of file
+    main()
@@ -0,0 +1,198 @@
+# shared_state.py
+# State dùng chung giữa nhiều worker / nhiều node: cache agent/voices, token pool, circuit state.
+#
+# Mỗi worker có state riêng trong memory -> N worker = N lần warm / refresh / mint lên upstream.
+# Có backend chung thì:
+#   - TTLCache: 1 process trong cluster refresh (distributed single-flight), process khác đọc kết quả
+#   - TokenPool: 1 pool chung, tốc độ request tính cho cả cluster, mỗi lúc chỉ 1 process mint
+#   - CircuitBreaker: 1 worker mở mạch -> worker khác fail fast theo
+#
+#   SHARED_STATE=memory                         # mặc định: như cũ, state riêng từng process
+#   SHARED_STATE=sqlite:///.cache/state.db      # nhiều worker trên cùng 1 host
+#   SHARED_STATE=redis://127.0.0.1:6379/0       # nhiều node (Redis hoặc server cùng protocol)
+#
+# Backend lỗi (Redis down, ...) thì caller tự rơi về hành vi local, không chặn request.
+
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+try:
+    import redis
+except ImportError:          # pip install redis
+    redis = None
+
+SHARED_STATE        = (os.getenv("SHARED_STATE") or "memory").strip()
+SHARED_STATE_PREFIX = os.getenv("SHARED_STATE_PREFIX") or "eleven:"
+SHARED_LOCK_TTL     = float(os.getenv("SHARED_LOCK_TTL") or 30)     # giây; holder chết -> lock tự hết
+SHARED_LOCK_WAIT    = float(os.getenv("SHARED_LOCK_WAIT") or 10)    # chờ holder tối đa rồi tự fetch
+SHARED_POLL         = 0.05
+
+
+class SQLiteBackend:
+    """
+    1 file SQLite (WAL) cho mọi worker trên cùng host. Thời gian theo wall clock (time.time()).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._db() as db:
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB, expires REAL);
+                CREATE TABLE IF NOT EXISTS items (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                                  key TEXT, value BLOB, expires REAL);
+                CREATE INDEX IF NOT EXISTS items_key ON items (key, id);
+            """)
+
+    def _db(self):
+        # 1 connection / thread / process (connection không được dùng qua fork)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    # ---------- key / value ----------
+    def get(self, key):
+        row = self._db().execute("SELECT value FROM kv WHERE key = ? AND expires > ?",
+                                 (key, time.time())).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value, ttl):
+        self._db().execute("INSERT OR REPLACE INTO kv VALUES (?, ?, ?)", (key, value, time.time() + ttl))
+
+    def delete(self, key):
+        self._db().execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    # ---------- lock ----------
+    def acquire(self, key, ttl):
+        """
+        -> token nếu lấy được lock (chưa ai giữ / lock cũ đã hết hạn), ngược lại None.
+        """
+        token = uuid.uuid4().hex
+        now = time.time()
+        cur = self._db().execute(
+            "INSERT INTO kv VALUES (?, ?, ?) ON CONFLICT(key) DO UPDATE "
+            "SET value = excluded.value, expires = excluded.expires WHERE kv.expires <= ?",
+            (key, token, now + ttl, now))
+        return token if cur.rowcount == 1 else None
+
+    def release(self, key, token):
+        self._db().execute("DELETE FROM kv WHERE key = ? AND value = ?", (key, token))
+
+    # ---------- hàng đợi có hạn dùng ----------
+    def push(self, key, value, expires_at):
+        self._db().execute("INSERT INTO items (key, value, expires) VALUES (?, ?, ?)",
+                           (key, value, expires_at))
+
+    def pop(self, key, min_expires):
+        """
+        -> (value | None, số item bỏ vì hết hạn). Lấy item cũ nhất còn hạn >= min_expires.
+        """
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            expired = db.execute("DELETE FROM items WHERE key = ? AND expires < ?",
+                                 (key, min_expires)).rowcount
+            row = db.execute("SELECT id, value FROM items WHERE key = ? ORDER BY id LIMIT 1",
+                             (key,)).fetchone()
+            if row:
+                db.execute("DELETE FROM items WHERE id = ?", (row[0],))
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        return (row[1] if row else None), expired
+
+    def count(self, key, min_expires):
+        db = self._db()
+        db.execute("DELETE FROM items WHERE key = ? AND expires < ?", (key, min_expires))
+        return db.execute("SELECT COUNT(*) FROM items WHERE key = ?", (key,)).fetchone()[0]
+
+    def info(self):
+        return {"backend": "sqlite", "path": self.path}
+
+
+class RedisBackend:
+    """
+    Redis (hoặc server nói RESP): lock = SET NX PX, hàng đợi = sorted set theo thời điểm hết hạn.
+    """
+    _RELEASE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+    _POP = ("local n = redis.call('zremrangebyscore', KEYS[1], '-inf', '(' .. ARGV[1]) "
+            "local r = redis.call('zpopmin', KEYS[1]) "
+            "return {n, r[1] or false}")
+
+    def __init__(self, url, prefix=SHARED_STATE_PREFIX):
+        self.url = url
+        self.prefix = prefix
+        self._r = redis.Redis.from_url(url, socket_timeout=1.0, socket_connect_timeout=1.0)
+        self._release = self._r.register_script(self._RELEASE)
+        self._pop = self._r.register_script(self._POP)
+
+    def _k(self, key):
+        return self.prefix + key
+
+    def get(self, key):
+        return self._r.get(self._k(key))
+
+    def set(self, key, value, ttl):
+        self._r.set(self._k(key), value, px=max(1, int(ttl * 1000)))
+
+    def delete(self, key):
+        self._r.delete(self._k(key))
+
+    def acquire(self, key, ttl):
+        token = uuid.uuid4().hex
+        ok = self._r.set(self._k(key), token, nx=True, px=max(1, int(ttl * 1000)))
+        return token if ok else None
+
+    def release(self, key, token):
+        self._release(keys=[self._k(key)], args=[token])
+
+    def push(self, key, value, expires_at):
+        # member phải unique trong sorted set -> thêm id phía trước, bỏ đi khi pop
+        member = uuid.uuid4().bytes + value
+        self._r.zadd(self._k(key), {member: expires_at})
+
+    def pop(self, key, min_expires):
+        expired, member = self._pop(keys=[self._k(key)], args=[repr(min_expires)])
+        return (member[16:] if member else None), int(expired)
+
+    def count(self, key, min_expires):
+        pipe = self._r.pipeline()
+        pipe.zremrangebyscore(self._k(key), "-inf", f"({min_expires!r}")
+        pipe.zcard(self._k(key))
+        return pipe.execute()[1]
+
+    def info(self):
+        return {"backend": "redis", "url": self.url.split("@")[-1], "prefix": self.prefix}
+
+
+def open_backend(spec=SHARED_STATE):
+    """
+    "memory" -> None (state local như cũ); "sqlite:///path"; "redis://..." / "rediss://...".
+    """
+    if not spec or spec == "memory":
+        return None
+    if spec.startswith("sqlite://"):
+        # sqlite:///tương/đối.db, sqlite:////tuyệt/đối.db
+        return SQLiteBackend(spec[len("sqlite:///"):] if spec.startswith("sqlite:///")
+                             else spec[len("sqlite://"):])
+    if spec.startswith(("redis://", "rediss://", "unix://")):
+        if redis is None:
+            raise RuntimeError("SHARED_STATE=redis cần package redis (pip install redis)")
+        return RedisBackend(spec)
+    raise RuntimeError(f"SHARED_STATE không hợp lệ: {spec}")
+
+
+shared = open_backend()
+
+
+def info():
+    return shared.info() if shared is not None else {"backend": "memory"}
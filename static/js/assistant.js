@@ -8,10 +8,24 @@
 // <script type="module" src="/static/js/assistant.js"></script>
 
 import { I18N, tUI, applyUILang, FLAG, SHORT } from "./i18n.js";
+import { StreamPlayer, playResponse } from "./player.js";
 
 const SIGNED_URL_ENDPOINT   = "/signed-url";        // text session signed url (Conversation SDK)
 const CALL_WS_URL_ENDPOINT  = "/api/get-ws-url";    // call ws signed url (Flask proxy)
 const VOICES_ENDPOINT       = "/api/voices";        // list voices: voice_id, name, label
+const BOOTSTRAP_ENDPOINT    = "/api/bootstrap";     // page load: agent + voices + languages + signed_url
+const LOOKUP_ENDPOINT       = "/api/lookup";        // tra mã tour / khách / booking thẳng qua n8n
+
+// id theo tab: server dùng để huỷ preview cũ khi tab này chọn voice khác (admission control)
+const CLIENT_ID = sessionStorage.getItem("client_id") || crypto.randomUUID();
+sessionStorage.setItem("client_id", CLIENT_ID);
+const CLIENT_HEADERS = { "X-Client-Id": CLIENT_ID };
+const CALL_JITTER_MS        = 150;                  // jitter buffer call audio
+const PREVIEW_JITTER_MS     = 250;                  // jitter buffer TTS preview
+// VAD mic (pcm-worklet.js): im lặng không gửi frame. hangoverMs phải đủ dài để turn detection của
+// agent thấy người dùng đã nói xong; localStorage.call_vad = "0" để tắt khi debug
+const CALL_VAD = localStorage.getItem("call_vad") !== "0";
+const CALL_VAD_OPTIONS = { snrDb: 9, minDb: -55, attackFrames: 2, hangoverMs: 500, prerollMs: 200, comfortMs: 0 };
 
 // ===== DOM =====
 const chatEl   = document.getElementById("chat");
@@ -44,8 +58,11 @@ let heartbeat = null;
 let callWs = null;
 let callMicCtx = null;
 let callMicStream = null;
-let callAudioQueue = [];
-let callPlaying = false;
+let callPlayer = null;         // StreamPlayer cho audio agent
+let callAudioFormat = "mp3";   // theo conversation_initiation_metadata (vd "pcm_16000")
+let callRelay = false;      // true: WS qua server relay (binary frame), false: nối thẳng ElevenLabs
+let callMicStats = null;    // {type: "vad", frames, sent, ...} mới nhất từ worklet
+let callMicWire = { frames: 0, bytes: 0 };   // byte thực gửi lên WS (base64 JSON / binary)
 
 // ===== VOICE state =====
 let CURRENT_VOICE_ID = null;
@@ -138,66 +155,95 @@ setUILangHeader(localStorage.getItem("ui_lang") || "vi");
 // ===== Load voices =====
 async function loadVoices() {
   try {
-    const res = await fetch("/api/voices", { cache: "no-store" });
+    // chỉ lấy field dropdown cần (label = labels.assistant_voice / voice_label / name, tính ở server)
+    const res = await fetch(`${VOICES_ENDPOINT}?fields=voice_id,name,language_trained,label`, { cache: "no-cache" });
     const data = await res.json();
     if (!res.ok) throw new Error(data.error || "voices error");
+    renderVoices(data.voices || []);
+  } catch (e) {
+    console.error("✗ loadVoices:", e.message);
+    voiceSel.innerHTML = `<option value="default">Default (Agent)</option>`;
+    CURRENT_VOICE_ID = "default";
+    CURRENT_VOICE_LABEL = null;
+  }
+}
 
-    const voices = data.voices || [];
-    voiceSel.innerHTML = "";
-    VOICE_LABEL_MAP = {};   // voice_id → label
-    VOICE_LANG_MAP  = {};   // voice_id → language_trained
+function renderVoices(voices) {
+  voiceSel.innerHTML = "";
+  VOICE_LABEL_MAP = {};   // voice_id → label
+  VOICE_LANG_MAP  = {};   // voice_id → language_trained
 
-    voices.forEach(v => {
-      if (!v.voice_id) return;
+  voices.forEach(v => {
+    if (!v.voice_id) return;
 
-      const voiceId = v.voice_id;
-      const name    = v.name || voiceId;
-      const trained = v.language_trained || null;
+    const voiceId = v.voice_id;
+    const name    = v.name || voiceId;
+    const trained = v.language_trained || null;
 
-      // Lưu vào state
-      // labels trong API của bạn là object, ví dụ: { "assistant_voice": "Piper" }
-      // Bạn sẽ chọn key nào là voice-label để multi-voice (tôi dùng assistant_voice)
-      const label =
-        (v.labels && v.labels.assistant_voice) ||
-        (v.labels && v.labels.voice_label) ||
-        name;
+    // Lưu vào state
+    // label multi-voice: server lấy labels.assistant_voice / labels.voice_label, không có thì name
+    const label = v.label || name;
 
-      VOICE_LABEL_MAP[voiceId] = label;
-      VOICE_LANG_MAP[voiceId]  = trained;
+    VOICE_LABEL_MAP[voiceId] = label;
+    VOICE_LANG_MAP[voiceId]  = trained;
 
-      // UI 
-      const opt = document.createElement("option");
-      opt.value = voiceId;
+    // UI 
+    const opt = document.createElement("option");
+    opt.value = voiceId;
 
-      // Hiển thị luôn language_trained như API trả về
-      const langTag = trained ? ` • ${trained.toUpperCase()}` : "";
-      opt.textContent = `${name}${langTag}`;
+    // Hiển thị luôn language_trained như API trả về
+    const langTag = trained ? ` • ${trained.toUpperCase()}` : "";
+    opt.textContent = `${name}${langTag}`;
 
-      voiceSel.appendChild(opt);
-    });
+    voiceSel.appendChild(opt);
+  });
 
-    // Restore voice đã chọn trước đó
-    const saved = localStorage.getItem("selected_voice");
-    if (saved && VOICE_LABEL_MAP[saved]) {
-      voiceSel.value = saved;
-      CURRENT_VOICE_ID = saved;
-      CURRENT_VOICE_LABEL = VOICE_LABEL_MAP[saved];
-    } else {
-      const first = voiceSel.options[0];
-      if (first) {
-        CURRENT_VOICE_ID = first.value;
-        CURRENT_VOICE_LABEL = VOICE_LABEL_MAP[first.value] || null;
-      }
+  // Restore voice đã chọn trước đó
+  const saved = localStorage.getItem("selected_voice");
+  if (saved && VOICE_LABEL_MAP[saved]) {
+    voiceSel.value = saved;
+    CURRENT_VOICE_ID = saved;
+    CURRENT_VOICE_LABEL = VOICE_LABEL_MAP[saved];
+  } else {
+    const first = voiceSel.options[0];
+    if (first) {
+      CURRENT_VOICE_ID = first.value;
+      CURRENT_VOICE_LABEL = VOICE_LABEL_MAP[first.value] || null;
     }
+  }
+}
+
+// ===== Bootstrap (1 request lúc load: agent + voices + languages + signed_url) =====
+// Server fan-out song song; phần nào lỗi thì nằm trong data.errors -> fallback endpoint riêng.
+let AGENT_INFO = null;            // { agent_id, primary_language, additional_languages }
+let SUPPORTED_LANGS = [];         // [{ code, name }]
+let bootSignedUrl = null;         // signed_url lấy sẵn, dùng 1 lần cho startSession đầu tiên
+let bootSignedAt = 0;
+const BOOT_SIGNED_MAX_AGE_MS = 5 * 60 * 1000;   // signed_url sống ~15 phút, dùng sớm cho chắc
 
+async function bootstrap() {
+  try {
+    const res = await fetch(BOOTSTRAP_ENDPOINT, { cache: "no-store", headers: CLIENT_HEADERS });
+    const data = await res.json();
+    if (!res.ok) throw new Error(data.error || "bootstrap error");
+
+    for (const [name, err] of Object.entries(data.errors || {})) {
+      logDebug(`✗ bootstrap ${name}: ${err.error || err}`);
+    }
+    AGENT_INFO = data.agent || null;
+    SUPPORTED_LANGS = data.languages || [];
+    if (data.signed_url) {
+      bootSignedUrl = data.signed_url;
+      bootSignedAt = Date.now();
+    }
+    if (data.voices) renderVoices(data.voices);
+    else await loadVoices();
   } catch (e) {
-    console.error("✗ loadVoices:", e.message);
-    voiceSel.innerHTML = `<option value="default">Default (Agent)</option>`;
-    CURRENT_VOICE_ID = "default";
-    CURRENT_VOICE_LABEL = null;
+    console.error("✗ bootstrap:", e.message);
+    await loadVoices();
   }
 }
-await loadVoices();
+await bootstrap();
 
 // ===== Session Instruction (TEXT SESSION) =====
 function buildSessionInstruction(){
@@ -216,7 +262,13 @@ function buildSessionInstruction(){
 // ===== Signed URL fetch (text session) =====
 async function fetchSignedUrl(){
   logDebug("→ fetchSignedUrl()");
-  const res = await fetch(SIGNED_URL_ENDPOINT, { cache:"no-store" });
+  if (bootSignedUrl && Date.now() - bootSignedAt < BOOT_SIGNED_MAX_AGE_MS) {
+    const url = bootSignedUrl;
+    bootSignedUrl = null;
+    return url;
+  }
+  bootSignedUrl = null;
+  const res = await fetch(SIGNED_URL_ENDPOINT, { cache:"no-store", headers: CLIENT_HEADERS });
   const data = await res.json();
   if (!res.ok) throw new Error(data.error || "Không lấy được signed_url");
   if (!data.signed_url) throw new Error("signed_url rỗng");
@@ -349,6 +401,19 @@ async function lookupInfo() {
     return;
   }
 
+  // tra thẳng qua server (có cache) -> hiện ngay, không chờ agent gọi tool
+  const results = await lookupDirect({ tour: tourCode, customer: customerCode, order: orderCode });
+  if (results) {
+    results.forEach((r) => addMsg("agent", formatLookup(r)));
+    // agent biết kết quả để trả lời câu hỏi tiếp theo, không phải tra lại
+    if (conversation && connected) {
+      try { conversation.sendContextualUpdate?.("LOOKUP RESULT: " + JSON.stringify(results)); }
+      catch (e) { console.warn(e); }
+    }
+    return;
+  }
+
+  // endpoint lỗi / chưa cấu hình -> nhờ agent tra như cũ
   const payload =
 `LOOKUP REQUEST IN COMPANY SYSTEM:
 - Tour Code: ${tourCode || "N/A"}
@@ -366,6 +431,35 @@ If no data found, clearly say so. Do NOT invent.`;
   await sendCurrentText();
 }
 
+async function lookupDirect(codes) {
+  try {
+    const res = await fetch(LOOKUP_ENDPOINT, {
+      method: "POST",
+      headers: { "Content-Type": "application/json", ...CLIENT_HEADERS },
+      body: JSON.stringify(codes),
+    });
+    if (!res.ok) throw new Error(`HTTP ${res.status}`);
+    const { results } = await res.json();
+    if (results.some((r) => r.error)) throw new Error(results.find((r) => r.error).error);
+    return results;
+  } catch (e) {
+    logDebug("✗ lookup: " + e.message);
+    return null;
+  }
+}
+
+function formatLookup(r) {
+  const head = `${r.type.toUpperCase()} ${r.code}`;
+  if (!r.found) return `${head}: not found.`;
+  const lines = [head + (r.data?.title ? ` — ${r.data.title}` : "")];
+  (r.stops || []).forEach((s, i) => {
+    const extra = [s.time, s.hotel, s.restaurant].filter(Boolean).join(" · ");
+    lines.push(`${i + 1}. ${s.name || s.title || JSON.stringify(s)}${extra ? ` (${extra})` : ""}`);
+  });
+  if (!r.stops) lines.push(JSON.stringify(r.data, null, 2));
+  return lines.join("\n");
+}
+
 // ===== EVENTS (TEXT) =====
 sendBtn.addEventListener("click", sendCurrentText);
 textEl.addEventListener("input", updateSendState);
@@ -375,27 +469,47 @@ textEl.addEventListener("keydown",(e)=>{
 
 
 // ===== Voice change: ONE FLOW for text + call =====
+let previewPlayer = null;
+
+let previewAbort = null;   // preview đang tải -> huỷ khi chọn voice khác
+
 async function previewVoiceStream(voiceId, text) {
-  const r = await fetch("/api/tts-stream", {
-    method: "POST",
-    headers: { "Content-Type": "application/json" },
-    body: JSON.stringify({
-      voice_id: voiceId,
-      text
-    })
-  });
+  if (previewAbort) previewAbort.abort();
+  const abort = previewAbort = new AbortController();
+
+  let r;
+  try {
+    r = await fetch("/api/tts-stream", {
+      method: "POST",
+      headers: { "Content-Type": "application/json", ...CLIENT_HEADERS },
+      body: JSON.stringify({
+        voice_id: voiceId,
+        text
+      }),
+      signal: abort.signal
+    });
+  } catch (e) {
+    if (e.name === "AbortError") return;
+    throw e;
+  }
 
   if (!r.ok) {
+    // 409: đã có preview mới hơn; 429: quá budget -> bỏ qua preview này (không retry)
     const err = await r.text().catch(()=> "");
-    console.error("TTS stream error:", r.status, err);
+    if (r.status !== 409) console.error("TTS stream error:", r.status, err);
     return;
   }
 
-  const blob = await r.blob();
-  const url = URL.createObjectURL(blob);
-  const audio = new Audio(url);
-  audio.onended = () => URL.revokeObjectURL(url);
-  await audio.play().catch(e => console.warn("Autoplay blocked:", e));
+  // phát dần khi chunk về, không chờ tải hết; preview mới thay preview cũ
+  if (previewPlayer) previewPlayer.close();
+  const player = previewPlayer = new StreamPlayer({ format: "mp3", targetDepthMs: PREVIEW_JITTER_MS });
+  try {
+    await playResponse(r, player);
+  } catch (e) {
+    if (e.name === "AbortError") return;
+    throw e;
+  }
+  logDebug("preview audio " + JSON.stringify(player.stats()));
 }
 
 voiceSel.addEventListener("change", async () => {
@@ -444,11 +558,27 @@ voiceSel.addEventListener("change", async () => {
 // ======================================================================
 
 // get signed ws url for call
+// server bật relay -> {ws_url: "/ws/call", relay: true}: server tự mint signed url
 async function getCallWsUrl(){
-  const r = await fetch(CALL_WS_URL_ENDPOINT, {method:"POST"});
+  let r = await fetch(CALL_WS_URL_ENDPOINT, {method:"POST", headers: CLIENT_HEADERS});
+  if (r.status === 429) {
+    // quá budget: chờ theo Retry-After (tối đa 5s) rồi thử lại 1 lần
+    const wait = Math.min(5, Number(r.headers.get("Retry-After")) || 1);
+    logDebug(`… get-ws-url 429, thử lại sau ${wait}s`);
+    await new Promise(res => setTimeout(res, wait * 1000));
+    r = await fetch(CALL_WS_URL_ENDPOINT, {method:"POST", headers: CLIENT_HEADERS});
+  }
   const j = await r.json();
   if(!j.ws_url) throw new Error(j.error||"no ws_url");
-  return j.ws_url;
+  callRelay = !!j.relay;
+  if (!callRelay) return j.ws_url;
+
+  const u = new URL(j.ws_url, location.href);
+  u.protocol = location.protocol === "https:" ? "wss:" : "ws:";
+  const language = VOICE_LANG_MAP[CURRENT_VOICE_ID];
+  if (CURRENT_VOICE_ID) u.searchParams.set("voice_id", CURRENT_VOICE_ID);
+  if (language) u.searchParams.set("language", language);
+  return u.toString();
 }
 
 function callWsSend(obj){
@@ -457,28 +587,50 @@ function callWsSend(obj){
   }
 }
 
-// play call audio
-async function playCallBase64Audio(b64, mime="audio/mpeg"){
-  callAudioQueue.push({b64, mime});
-  if(callPlaying) return;
-  callPlaying = true;
-
-  while(callAudioQueue.length){
-    const {b64, mime} = callAudioQueue.shift();
-    const bytes = Uint8Array.from(atob(b64), c=>c.charCodeAt(0));
-    const blob = new Blob([bytes], {type:mime});
-    const url = URL.createObjectURL(blob);
-    const a = new Audio(url);
-    await a.play().catch(()=>{});
-    await new Promise(r=> a.onended=r);
-    URL.revokeObjectURL(url);
+function bytesToBase64(buf){
+  const bytes = new Uint8Array(buf);
+  let bin = "";
+  for (let i = 0; i < bytes.length; i++) bin += String.fromCharCode(bytes[i]);
+  return btoa(bin);
+}
+
+// 1 chunk mic PCM16 (ArrayBuffer): relay -> binary frame, nối thẳng -> base64 trong JSON
+function callWsSendAudio(buf){
+  if(!callWs || callWs.readyState!==1) return;
+  const msg = callRelay ? buf : JSON.stringify({ user_audio_chunk: bytesToBase64(buf) });
+  callWs.send(msg);
+  callMicWire.frames++;
+  callMicWire.bytes += callRelay ? buf.byteLength : msg.length;
+}
+
+// play call audio (gapless, 1 player cho cả cuộc gọi)
+function playCallAudio(bytes){
+  if (!callPlayer) {
+    callPlayer = new StreamPlayer({ format: callAudioFormat, targetDepthMs: CALL_JITTER_MS });
   }
-  callPlaying = false;
+  callPlayer.push(bytes);
+}
+
+function playCallBase64Audio(b64){
+  playCallAudio(Uint8Array.from(atob(b64), c=>c.charCodeAt(0)));
+}
+
+// barge-in: bỏ ngay audio agent đang chờ phát
+function flushCallAudio(){
+  if (!callPlayer) return;
+  logDebug("call audio flush " + JSON.stringify(callPlayer.stats()));
+  callPlayer.flush();
+}
+
+function closeCallAudio(){
+  if (callPlayer) callPlayer.close();
+  callPlayer = null;
 }
 
 // connect call ws
 function connectCallWs(wsUrl){
   callWs = new WebSocket(wsUrl);
+  callWs.binaryType = "arraybuffer";
  
   callWs.onopen = async ()=>{
   statusEl.textContent = "call connected";
@@ -490,11 +642,13 @@ function connectCallWs(wsUrl){
   if (language) overrides.language = language;   // ví dụ "vi","en","hi"
   if (voice_id) overrides.voice_id = voice_id;
 
-  // ✅ Initiation + overrides chuẩn
-  callWsSend({
-    type: "conversation_initiation_client_data",
-    overrides
-  });
+  // ✅ Initiation + overrides chuẩn (relay: server đã tự gửi)
+  if (!callRelay) {
+    callWsSend({
+      type: "conversation_initiation_client_data",
+      overrides
+    });
+  }
 
   // ✅ fallback ép label nếu overrides bị ignore (Agent chưa bật Allow overrides)
   applyVoiceRuleToCallWs();
@@ -518,9 +672,26 @@ function connectCallWs(wsUrl){
   };
 
   callWs.onmessage = async (ev)=>{
+    if (ev.data instanceof ArrayBuffer) {
+      // relay: binary frame = audio agent
+      playCallAudio(new Uint8Array(ev.data));
+      return;
+    }
     let data;
     try{ data = JSON.parse(ev.data); }catch{ return; }
 
+    if (data.type === "conversation_initiation_metadata") {
+      const fmt = data.conversation_initiation_metadata_event?.agent_output_audio_format;
+      if (fmt && fmt !== callAudioFormat) {
+        callAudioFormat = fmt;
+        closeCallAudio();
+      }
+      return;
+    }
+    if (data.type === "interruption") {
+      flushCallAudio();
+      return;
+    }
     if (data.type === "ping") {
       callWsSend({ type: "pong", event_id: data.ping_event?.event_id });
       return;
@@ -535,7 +706,7 @@ function connectCallWs(wsUrl){
     }
     if (data.type === "audio") {
       const b64 = data.audio_event?.audio_base_64;
-      if (b64) await playCallBase64Audio(b64, "audio/mpeg");
+      if (b64) playCallBase64Audio(b64);
       return;
     }
   };
@@ -549,17 +720,43 @@ async function callStartMicPCM() {
   await callMicCtx.audioWorklet.addModule("/pcm-worklet.js");
 
   const src = callMicCtx.createMediaStreamSource(callMicStream);
-  const worklet = new AudioWorkletNode(callMicCtx, "pcm-worklet");
+  const worklet = new AudioWorkletNode(callMicCtx, "pcm-worklet", {
+    processorOptions: { vad: CALL_VAD, vadOptions: CALL_VAD_OPTIONS },
+  });
+  callMicStats = null;
+  callMicWire = { frames: 0, bytes: 0 };
 
   worklet.port.onmessage = (ev) => {
-    const b64 = ev.data;
-    callWsSend({ user_audio_chunk: b64 });
+    if (ev.data instanceof ArrayBuffer) callWsSendAudio(ev.data);
+    else if (ev.data?.type === "vad") callMicStats = ev.data;
   };
 
   src.connect(worklet);
 }
 
+// tổng kết mic 1 cuộc gọi: tỉ lệ nói / im lặng, byte tiết kiệm nhờ VAD (stats worklet gửi ~1s / lần)
+function callMicSummary() {
+  const st = callMicStats;
+  if (!st || !st.frames) return null;
+  const perFrame = callMicWire.frames ? callMicWire.bytes / callMicWire.frames : st.frameBytes;
+  const skipped = st.frames - st.sent;
+  return {
+    seconds: Math.round((st.frames * st.frameBytes) / 2 / 16000),   // PCM16 @16kHz
+    speech_pct: Math.round((st.open / st.frames) * 1000) / 10,
+    silence_pct: Math.round((1 - st.open / st.frames) * 1000) / 10,
+    frames_sent: st.sent,
+    frames_skipped: skipped,
+    comfort_frames: st.comfort,
+    wire_kb_sent: Math.round(callMicWire.bytes / 1024),
+    wire_kb_saved: Math.round((skipped * perFrame) / 1024),
+    noise_floor_db: st.floorDb,
+  };
+}
+
 function callStopMicPCM() {
+  const summary = callMicSummary();
+  if (summary) logDebug("call mic VAD " + JSON.stringify(summary));
+  callMicStats = null;
   if (callMicStream) callMicStream.getTracks().forEach(t => t.stop());
   if (callMicCtx) callMicCtx.close();
   callMicStream = null;
@@ -570,6 +767,7 @@ function callStopMicPCM() {
 async function restartCallWs(){
   try{
     callStopMicPCM();
+    closeCallAudio();
     if (callWs) callWs.close();
   }catch{}
   callWs = null;
@@ -605,6 +803,7 @@ async function endCall(){
   heartbeat = null;
 
   callStopMicPCM();
+  closeCallAudio();
   if(callWs) callWs.close();
   callWs = null;
 
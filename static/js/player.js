@@ -0,0 +1,418 @@
+// static/js/player.js
+// Engine phát audio streaming liền mạch (gapless) cho call audio + TTS preview.
+// Thay cho kiểu 1 Blob + 1 <audio> cho mỗi chunk (có gap decode/startup giữa các chunk).
+//
+//  - audio/mpeg (mp3): MediaSource + 1 SourceBuffer "sequence" trên 1 <audio> duy nhất
+//  - PCM16 (pcm_16000, ...): Web Audio, lên lịch AudioBuffer nối tiếp nhau
+//  - không có MSE cho mp3 (vd iOS Safari cũ): gom chunk tới ranh giới frame mp3 (chunk mạng cắt
+//    giữa frame), decodeAudioData từng lô frame trọn vẹn rồi lên lịch
+//
+// Jitter buffer: chỉ bắt đầu phát khi đã có targetDepthMs audio (hoặc stream đã end);
+// hụt dữ liệu giữa chừng -> đếm underrun, chờ đầy lại tới target rồi phát tiếp.
+// flush(): barge-in / interruption -> dừng ngay, bỏ toàn bộ buffer.
+//
+//   const p = new StreamPlayer({ format: "mp3", targetDepthMs: 150 });
+//   p.push(bytes); ...; p.end();   await p.done;
+//   p.stats() -> { queuedMs, maxQueuedMs, avgQueuedMs, underruns, chunks, bytes, startupMs }
+
+function parseFormat(format) {
+  // "pcm_16000" | "pcm" | "mp3_44100_128" | "audio/mpeg"
+  const m = /^pcm(?:_(\d+))?$/.exec(format || "");
+  if (m) return { kind: "pcm", sampleRate: Number(m[1] || 16000) };
+  return { kind: "mp3", mime: "audio/mpeg" };
+}
+
+function toBytes(chunk) {
+  return chunk instanceof Uint8Array ? chunk : new Uint8Array(chunk);
+}
+
+// ---------- mp3 frame (MPEG 1 / 2 / 2.5 Layer III) ----------
+const MP3_KBPS_V1 = [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320];
+const MP3_KBPS_V2 = [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160];
+const MP3_RATES = [44100, 48000, 32000];
+const MP3_BATCH_BYTES = 8 * 1024;   // ~0.5 s @128kbps: ít lô -> ít chỗ nối giữa các lần decode
+
+function mp3FrameLength(b, i) {
+  // header frame tại b[i] -> độ dài frame (byte), 0 nếu không phải header hợp lệ
+  if (b[i] !== 0xff || (b[i + 1] & 0xe0) !== 0xe0) return 0;
+  const ver = (b[i + 1] >> 3) & 3, layer = (b[i + 1] >> 1) & 3;
+  const bri = b[i + 2] >> 4, sri = (b[i + 2] >> 2) & 3, pad = (b[i + 2] >> 1) & 1;
+  if (ver === 1 || layer !== 1 || bri === 0 || bri === 15 || sri === 3) return 0;
+  const v1 = ver === 3;
+  const kbps = (v1 ? MP3_KBPS_V1 : MP3_KBPS_V2)[bri];
+  const rate = MP3_RATES[sri] >> (v1 ? 0 : ver === 2 ? 1 : 2);
+  return Math.floor(((v1 ? 144000 : 72000) * kbps) / rate) + pad;
+}
+
+function mp3Boundary(b, first) {
+  // -> số byte đầu của b gồm trọn các frame; phần sau là frame dở, chờ chunk kế
+  let i = 0;
+  if (first && b.length >= 10 && b[0] === 0x49 && b[1] === 0x44 && b[2] === 0x33) {
+    // tag "ID3" đầu stream: đi kèm lô đầu, không dò sync bên trong
+    i = 10 + (((b[6] & 0x7f) << 21) | ((b[7] & 0x7f) << 14) | ((b[8] & 0x7f) << 7) | (b[9] & 0x7f));
+  }
+  let end = 0;
+  while (i + 4 <= b.length) {
+    const n = mp3FrameLength(b, i);
+    if (!n) { i++; continue; }    // rác / mất sync -> dò tiếp
+    if (i + n > b.length) break;
+    i += n;
+    end = i;
+  }
+  return end;
+}
+
+export class StreamPlayer {
+  constructor({ format = "mp3", targetDepthMs = 150, audioContext = null } = {}) {
+    this.format = parseFormat(format);
+    this.targetDepth = targetDepthMs / 1000;
+    this._ctx = audioContext;
+    this._ownsCtx = false;   // ctx tự tạo -> close() đóng luôn; ctx của caller thì để nguyên
+    this._closed = false;
+    this._ended = false;
+    this._resetStats();
+
+    this.done = new Promise((resolve) => { this._resolveDone = resolve; });
+
+    const mseOk = this.format.kind === "mp3" && window.MediaSource
+      && MediaSource.isTypeSupported(this.format.mime);
+    this._backend = mseOk ? "mse" : "webaudio";
+    if (mseOk) this._openMse();
+    else this._openWebAudio();
+  }
+
+  // ---------- public ----------
+  push(chunk) {
+    if (this._closed) return;
+    const bytes = toBytes(chunk);
+    if (!bytes.length) return;
+    if (this._t0 === null) this._t0 = performance.now();
+    this._stats.chunks++;
+    this._stats.bytes += bytes.length;
+    if (this._backend === "mse") this._mseAppend(bytes);
+    else if (this.format.kind === "pcm") this._pcmSchedule(bytes);
+    else this._decodeSchedule(bytes);
+  }
+
+  end() {
+    // hết dữ liệu: phát nốt những gì còn trong buffer
+    this._ended = true;
+    if (this._backend === "mse") {
+      this._mseMaybeEnd();
+      this._checkDone();
+    } else if (this.format.kind === "mp3") {
+      // decode nốt phần còn gom; done chỉ resolve khi các lô đã decode xong và phát hết
+      this._decodeBatch(true);
+      const gen = this._gen;
+      this._decodeChain.then(() => {
+        if (gen !== this._gen) return;
+        this._waMaybePrime(true);
+        this._checkDone();
+      });
+    } else {
+      this._waMaybePrime(true);
+      this._checkDone();
+    }
+  }
+
+  flush() {
+    // barge-in: dừng ngay, bỏ buffer, player dùng tiếp được cho lượt sau
+    this._stats.flushes++;
+    if (this._backend === "mse") {
+      this._closeMse();
+      this._openMse();
+    } else {
+      for (const src of this._sources) { try { src.stop(); } catch {} }
+      this._sources.clear();
+      this._pending = [];
+      this._nextTime = 0;
+      this._primed = false;
+      this._carry = null;
+      this._mp3 = null;
+      this._mp3First = true;
+      this._gen++;           // lô đang decode dở thuộc lượt cũ -> bỏ
+      this._decoding = 0;
+    }
+    this._ended = false;
+    this._t0 = null;
+    this._resolveDone?.();
+    this.done = new Promise((resolve) => { this._resolveDone = resolve; });
+  }
+
+  close() {
+    if (this._closed) return;
+    this.flush();
+    this._closed = true;
+    if (this._backend === "mse") this._closeMse();
+    if (this._ownsCtx && this._ctx) {
+      // trình duyệt giới hạn số AudioContext đang mở
+      this._ctx.close().catch(() => {});
+      this._ownsCtx = false;
+    }
+  }
+
+  get queuedMs() {
+    // độ sâu hàng đợi = phần audio đã nhận mà chưa phát
+    if (this._backend === "mse") {
+      const a = this._audio, b = this._sb?.buffered;
+      if (!a || !b || !b.length) return 0;
+      return Math.max(0, b.end(b.length - 1) - a.currentTime) * 1000;
+    }
+    const ctx = this._ctx;
+    const pending = this._pending.reduce((s, p) => s + p.duration, 0);
+    const scheduled = ctx ? Math.max(0, this._nextTime - ctx.currentTime) : 0;
+    return (scheduled + pending) * 1000;
+  }
+
+  stats() {
+    const s = this._stats;
+    return {
+      backend: this._backend,
+      queuedMs: Math.round(this.queuedMs),
+      maxQueuedMs: Math.round(s.maxQueued),
+      avgQueuedMs: s.samples ? Math.round(s.sumQueued / s.samples) : 0,
+      underruns: s.underruns,
+      flushes: s.flushes,
+      chunks: s.chunks,
+      bytes: s.bytes,
+      startupMs: s.startupMs,
+    };
+  }
+
+  // ---------- stats ----------
+  _resetStats() {
+    this._t0 = null;
+    this._stats = { chunks: 0, bytes: 0, underruns: 0, flushes: 0, maxQueued: 0,
+                    sumQueued: 0, samples: 0, startupMs: null };
+  }
+
+  _sample() {
+    const q = this.queuedMs;
+    const s = this._stats;
+    s.samples++;
+    s.sumQueued += q;
+    if (q > s.maxQueued) s.maxQueued = q;
+  }
+
+  _started() {
+    if (this._stats.startupMs === null && this._t0 !== null) {
+      this._stats.startupMs = Math.round(performance.now() - this._t0);
+    }
+  }
+
+  _checkDone() {
+    if (!this._ended) return;
+    if (this._backend === "mse") return; // resolve ở sự kiện "ended"
+    if (this._decoding || this._pending.length || this._sources.size) return;
+    this._resolveDone?.();
+  }
+
+  // ---------- MSE backend ----------
+  _openMse() {
+    this._queue = [];
+    this._primed = false;
+    const audio = this._audio = new Audio();
+    const ms = this._ms = new MediaSource();
+    this._sb = null;
+    audio.src = URL.createObjectURL(ms);
+    ms.addEventListener("sourceopen", () => {
+      URL.revokeObjectURL(audio.src);
+      if (this._ms !== ms) return;            // đã flush trước khi open
+      const sb = this._sb = ms.addSourceBuffer(this.format.mime);
+      sb.mode = "sequence";
+      sb.addEventListener("updateend", () => { if (this._sb === sb) this._msePump(); });
+      this._msePump();
+    }, { once: true });
+    audio.addEventListener("waiting", () => {
+      // hụt dữ liệu giữa chừng -> chờ đầy lại tới target
+      if (this._audio !== audio || this._ended || !this._primed) return;
+      this._stats.underruns++;
+      this._primed = false;
+      audio.pause();
+    });
+    audio.addEventListener("ended", () => { if (this._audio === audio) this._resolveDone?.(); });
+  }
+
+  _closeMse() {
+    const a = this._audio;
+    if (!a) return;
+    a.pause();
+    a.removeAttribute("src");
+    a.load();
+    this._audio = null;
+    this._ms = null;
+    this._sb = null;
+    this._queue = [];
+  }
+
+  _mseAppend(bytes) {
+    this._queue.push(bytes);
+    this._msePump();
+  }
+
+  _msePump() {
+    const sb = this._sb;
+    if (!sb || sb.updating) return;
+    if (this._queue.length) {
+      // gộp các chunk đang chờ thành 1 lần append
+      const parts = this._queue;
+      this._queue = [];
+      let data = parts[0];
+      if (parts.length > 1) {
+        data = new Uint8Array(parts.reduce((n, p) => n + p.length, 0));
+        let off = 0;
+        for (const p of parts) { data.set(p, off); off += p.length; }
+      }
+      try {
+        sb.appendBuffer(data);
+      } catch (e) {
+        console.warn("StreamPlayer append failed:", e);
+      }
+      return;
+    }
+    this._sample();
+    this._mseMaybePlay();
+    this._mseMaybeEnd();
+  }
+
+  _mseMaybePlay() {
+    if (this._primed || !this._audio) return;
+    if (this.queuedMs / 1000 >= this.targetDepth || this._ended) {
+      this._primed = true;
+      this._audio.play().then(() => this._started())
+        .catch((e) => console.warn("Autoplay blocked:", e));
+    }
+  }
+
+  _mseMaybeEnd() {
+    if (!this._ended || !this._sb || this._sb.updating || this._queue.length) return;
+    if (this._ms.readyState === "open") {
+      try { this._ms.endOfStream(); } catch {}
+    }
+    this._mseMaybePlay();
+  }
+
+  // ---------- Web Audio backend ----------
+  _openWebAudio() {
+    if (!this._ctx) {
+      const opts = this.format.kind === "pcm" ? { sampleRate: this.format.sampleRate } : {};
+      try { this._ctx = new AudioContext(opts); } catch { this._ctx = new AudioContext(); }
+      this._ownsCtx = true;
+    }
+    this._sources = new Set();
+    this._pending = [];      // AudioBuffer chờ đủ target depth
+    this._nextTime = 0;
+    this._primed = false;
+    this._decodeChain = Promise.resolve();
+    this._carry = null;      // byte lẻ khi chunk PCM16 bị cắt giữa sample
+    this._mp3 = null;        // byte mp3 chưa decode (frame dở ở cuối)
+    this._mp3First = true;
+    this._gen = 0;
+    this._decoding = 0;      // lô mp3 đang chờ decode (done chưa được resolve)
+  }
+
+  _pcmSchedule(bytes) {
+    if (this._carry) {
+      const merged = new Uint8Array(this._carry.length + bytes.length);
+      merged.set(this._carry, 0);
+      merged.set(bytes, this._carry.length);
+      bytes = merged;
+      this._carry = null;
+    }
+    if (bytes.length & 1) {
+      this._carry = bytes.slice(bytes.length - 1);
+      bytes = bytes.subarray(0, bytes.length - 1);
+    }
+    const n = bytes.length >> 1;
+    if (!n) return;
+    const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.length);
+    const buf = this._ctx.createBuffer(1, n, this.format.sampleRate);
+    const ch = buf.getChannelData(0);
+    for (let i = 0; i < n; i++) ch[i] = view.getInt16(i * 2, true) / 32768;
+    this._enqueue(buf);
+  }
+
+  _decodeSchedule(bytes) {
+    // không có MSE: gom tới ranh giới frame, decode tuần tự từng lô để giữ đúng thứ tự
+    if (this._mp3) {
+      const merged = new Uint8Array(this._mp3.length + bytes.length);
+      merged.set(this._mp3, 0);
+      merged.set(bytes, this._mp3.length);
+      this._mp3 = merged;
+    } else {
+      this._mp3 = bytes.slice();
+    }
+    if (this._mp3.length >= MP3_BATCH_BYTES) this._decodeBatch(false);
+  }
+
+  _decodeBatch(final) {
+    const b = this._mp3;
+    if (!b || !b.length) return;
+    const n = final ? b.length : mp3Boundary(b, this._mp3First);
+    if (!n) return;
+    const copy = b.slice(0, n).buffer;
+    this._mp3 = n < b.length ? b.slice(n) : null;
+    this._mp3First = false;
+    const gen = this._gen;
+    this._decoding++;
+    this._decodeChain = this._decodeChain
+      .then(() => (this._closed || gen !== this._gen ? null : this._ctx.decodeAudioData(copy)))
+      .then((buf) => { if (buf && !this._closed && gen === this._gen) this._enqueue(buf); })
+      .catch((e) => console.warn("StreamPlayer decode failed:", e))
+      .finally(() => { if (gen === this._gen) this._decoding--; });
+  }
+
+  _enqueue(buf) {
+    const ctx = this._ctx;
+    if (ctx.state === "suspended") ctx.resume().catch(() => {});
+    if (this._primed && this._nextTime < ctx.currentTime) {
+      // phát hết buffer trước khi chunk mới tới
+      this._stats.underruns++;
+      this._primed = false;
+    }
+    this._pending.push(buf);
+    this._waMaybePrime(false);
+    this._sample();
+  }
+
+  _waMaybePrime(force) {
+    const ctx = this._ctx;
+    if (!this._primed) {
+      const depth = this._pending.reduce((s, b) => s + b.duration, 0);
+      if (!this._pending.length || (depth < this.targetDepth && !force && !this._ended)) return;
+      this._primed = true;
+      this._nextTime = ctx.currentTime + 0.01;
+    }
+    for (const buf of this._pending) {
+      const src = ctx.createBufferSource();
+      src.buffer = buf;
+      src.connect(ctx.destination);
+      src.onended = () => {
+        this._sources.delete(src);
+        this._checkDone();
+      };
+      src.start(this._nextTime);
+      this._sources.add(src);
+      this._nextTime += buf.duration;
+      this._started();
+    }
+    this._pending = [];
+  }
+}
+
+// Phát 1 fetch Response (vd /api/tts-stream) ngay khi từng chunk về, không chờ r.blob().
+export async function playResponse(response, player) {
+  const reader = response.body.getReader();
+  try {
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      player.push(value);
+    }
+    player.end();
+  } catch (e) {
+    player.end();
+    throw e;
+  }
+  return player.done;
+}
@@ -1,104 +1,257 @@
-// ===== Base64 encoder (works in AudioWorklet, no btoa) =====
-function base64Encode(bytes) {
-  const base64abc = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/";
-  let result = '';
-  let i;
-  const len = bytes.length;
-
-  for (i = 2; i < len; i += 3) {
-    result += base64abc[bytes[i - 2] >> 2];
-    result += base64abc[((bytes[i - 2] & 3) << 4) | (bytes[i - 1] >> 4)];
-    result += base64abc[((bytes[i - 1] & 15) << 2) | (bytes[i] >> 6)];
-    result += base64abc[bytes[i] & 63];
-  }
-  if (i === len + 1) {
-    result += base64abc[bytes[i - 2] >> 2];
-    result += base64abc[(bytes[i - 2] & 3) << 4];
-    result += "==";
-  }
-  if (i === len) {
-    result += base64abc[bytes[i - 2] >> 2];
-    result += base64abc[((bytes[i - 2] & 3) << 4) | (bytes[i - 1] >> 4)];
-    result += base64abc[(bytes[i - 1] & 15) << 2];
-    result += "=";
-  }
-  return result;
-}
+// static/pcm-worklet.js
+// Mic -> PCM16 mono @16kHz, frame ~20ms (320 sample), postMessage ArrayBuffer (transfer).
+//
+// process() chạy trên audio thread mỗi 128 sample nên không cấp phát gì trong đó:
+//  - ring buffer Float32 cấp phát sẵn cho input (không merge / slice mảng mới)
+//  - resample tuyến tính đọc thẳng từ ring, low-pass chống alias (tuỳ chọn) khi hạ rate
+//  - pack thẳng vào Int16Array của frame; frame đầy -> transfer buffer, cấp frame mới
+//    (1 lần / 20ms, không phải mỗi quantum)
+// Base64 cho WS JSON làm ở main thread, không còn trên audio thread.
+//
+// VAD (processorOptions.vad): lúc im lặng không gửi frame (hoặc chỉ 1 comfort frame / comfortMs).
+//  - mỗi frame: năng lượng (dBFS) + zero-crossing rate, cộng dồn ngay trong _push
+//  - có tiếng = dB > minDb, dB > noise floor + snrDb, zcr < zcrMax (loại hiss / nhiễu trắng)
+//  - noise floor: frame đầu làm mốc, bám xuống ngay, lên chậm -> tự thích nghi với phòng ồn
+//  - attackFrames frame có tiếng liên tiếp mới mở gate (bỏ tiếng click); mở -> gửi luôn prerollMs
+//    trước đó (đầu câu không bị cụt); hết tiếng vẫn gửi thêm hangoverMs (đuôi câu + khoảng lặng
+//    để turn detection phía agent nhận ra người dùng nói xong)
+//  - frame pre-roll là buffer cấp sẵn, xoay vòng; chỉ cấp phát lúc mở gate
+//  - mỗi ~1s postMessage {type: "vad", ...} (đếm frame / byte) cho main thread
+//
+// processorOptions: { targetSampleRate = 16000, frameSize = 320, antiAlias = true,
+//   vad = false, vadOptions: { snrDb = 9, minDb = -55, zcrMax = 0.6, attackFrames = 2,
+//                              hangoverMs = 500, prerollMs = 200, comfortMs = 0 } }
+
+const RING_SIZE = 8192; // lũy thừa 2, > vài quantum @ 48kHz
+const FLOOR_RISE_DB = 0.02; // noise floor tăng tối đa / frame (~1 dB/s) khi đang có tiếng
+const FLOOR_FOLLOW = 0.05;  // lúc im lặng: floor tiến về mức hiện tại 5% / frame
+const STATS_EVERY = 50;     // frame (~1s) / lần gửi stats
 
 class PCMWorkletProcessor extends AudioWorkletProcessor {
-  constructor() {
+  constructor(options) {
     super();
-    this.targetSR = 16000;
+    const opts = options?.processorOptions || {};
+    this.targetSR = opts.targetSampleRate || 16000;
     this.inSR = sampleRate; // sample rate thực tế của AudioContext
     this.ratio = this.inSR / this.targetSR;
+    this.frameSize = opts.frameSize || 320; // ~20ms @16kHz
 
-    this._inBuf = new Float32Array(0);
-    this._outBuf = [];
-    this._needOut = 320; // ~20ms @16kHz
+    this._ring = new Float32Array(RING_SIZE);
+    this._mask = RING_SIZE - 1;
+    this._written = 0; // tổng sample đã ghi vào ring
+    this._pos = 0;     // vị trí (thực) của sample output kế tiếp, theo sample input
+
+    this._frame = new Int16Array(this.frameSize);
+    this._fill = 0;
+
+    this._vad = !!opts.vad;
+    if (this._vad) this._initVad(opts.vadOptions || {});
+
+    // biquad low-pass (Butterworth, RBJ cookbook) tại 0.45 x target rate
+    this._aa = this.ratio > 1 && opts.antiAlias !== false;
+    if (this._aa) {
+      const w0 = 2 * Math.PI * (0.45 * this.targetSR) / this.inSR;
+      const alpha = Math.sin(w0) / (2 * Math.SQRT1_2);
+      const cos = Math.cos(w0);
+      const a0 = 1 + alpha;
+      this._b0 = (1 - cos) / 2 / a0;
+      this._b1 = (1 - cos) / a0;
+      this._b2 = this._b0;
+      this._a1 = -2 * cos / a0;
+      this._a2 = (1 - alpha) / a0;
+      this._x1 = this._x2 = this._y1 = this._y2 = 0;
+    }
   }
 
-  _appendInput(samples) {
-    const merged = new Float32Array(this._inBuf.length + samples.length);
-    merged.set(this._inBuf, 0);
-    merged.set(samples, this._inBuf.length);
-    this._inBuf = merged;
+  _initVad(o) {
+    const frameMs = (this.frameSize / this.targetSR) * 1000;
+    const frames = (ms) => Math.max(0, Math.round(ms / frameMs));
+    this._snrDb = o.snrDb ?? 9;
+    this._minDb = o.minDb ?? -55;
+    this._zcrMax = o.zcrMax ?? 0.6;
+    this._attack = Math.max(1, o.attackFrames ?? 2);
+    this._hangover = frames(o.hangoverMs ?? 500);
+    this._comfort = frames(o.comfortMs ?? 0); // 0 = im lặng thì không gửi gì
+
+    this._sumSq = 0;
+    this._zc = 0;
+    this._lastPos = true;
+    this._floorDb = null;
+    this._open = false;
+    this._run = 0;   // frame có tiếng liên tiếp (lúc gate đóng)
+    this._hang = 0;  // frame hangover còn lại (lúc gate mở)
+    this._quiet = 0; // frame đã bỏ từ comfort frame / lúc đóng gate gần nhất
+
+    // pre-roll: ring frame cấp sẵn, chứa cả attack frame
+    const n = frames(o.prerollMs ?? 200) + this._attack;
+    this._pre = Array.from({ length: n }, () => new Int16Array(this.frameSize));
+    this._preHead = 0; // slot ghi kế tiếp
+    this._preLen = 0;
+
+    this._stats = { type: "vad", frames: 0, voiced: 0, open: 0, sent: 0, comfort: 0, opens: 0,
+                    frameBytes: this.frameSize * 2, floorDb: 0 };
   }
 
-  _resampleTo16k() {
-    if (this._inBuf.length < this.ratio + 1) return;
-
-    const out = [];
-    let idx = 0;
-    while (idx + 1 < this._inBuf.length) {
-      const i0 = Math.floor(idx);
-      const i1 = i0 + 1;
-      const frac = idx - i0;
-      const s = this._inBuf[i0] * (1 - frac) + this._inBuf[i1] * frac;
-      out.push(s);
-      idx += this.ratio;
+  _push(s) {
+    // float [-1, 1] -> int16, frame đầy thì gửi đi (VAD: qua gate)
+    s = s > 1 ? 1 : (s < -1 ? -1 : s);
+    this._frame[this._fill++] = s < 0 ? s * 0x8000 : s * 0x7fff;
+    if (this._vad) {
+      this._sumSq += s * s;
+      if ((s >= 0) !== this._lastPos) {
+        this._zc++;
+        this._lastPos = s >= 0;
+      }
     }
+    if (this._fill === this.frameSize) {
+      this._fill = 0;
+      if (this._vad) this._gate();
+      else this._emit();
+    }
+  }
 
-    // giữ lại phần dư
-    const remainStart = Math.floor(idx);
-    this._inBuf = this._inBuf.slice(remainStart);
-
-    return out;
+  _emit() {
+    const buf = this._frame.buffer;
+    this.port.postMessage(buf, [buf]);
+    this._frame = new Int16Array(this.frameSize);
   }
 
-  process(inputs) {
-    const input = inputs[0];
-    if (!input || input.length === 0) return true;
+  _voiced() {
+    const n = this.frameSize;
+    const db = 10 * Math.log10(this._sumSq / n + 1e-12);
+    const zcr = this._zc / n;
+    this._sumSq = 0;
+    this._zc = 0;
 
-    const samples = input[0];
-    this._appendInput(samples);
+    if (this._floorDb === null) this._floorDb = db; // giả định đầu cuộc gọi là im lặng
+    const floor = this._floorDb;
+    const voiced = db > this._minDb && db > floor + this._snrDb && zcr < this._zcrMax;
+    if (db < floor) this._floorDb = db;
+    else if (!voiced) this._floorDb = floor + (db - floor) * FLOOR_FOLLOW;
+    else this._floorDb = floor + FLOOR_RISE_DB;
+    return voiced;
+  }
 
-    const resampled = (this.inSR === this.targetSR)
-      ? Array.from(samples)
-      : this._resampleTo16k();
+  _gate() {
+    const st = this._stats;
+    const voiced = this._voiced();
+    st.frames++;
+    if (voiced) st.voiced++;
 
-    if (resampled && resampled.length) {
-      for (const s0 of resampled) {
-        const s = Math.max(-1, Math.min(1, s0));
-        this._outBuf.push(s);
+    if (this._open) {
+      this._hang = voiced ? this._hangover : this._hang - 1;
+      if (this._hang >= 0) {
+        st.open++;
+        st.sent++;
+        this._emit();
+        this._report();
+        return;
       }
+      // hết hangover: đóng gate, frame này thành pre-roll như lúc im lặng
+      this._open = false;
+      this._run = 0;
+      this._quiet = 0;
+    }
+
+    // gate đóng: frame vào pre-roll
+    this._stashPreroll();
+    this._run = voiced ? this._run + 1 : 0;
+    if (this._run >= this._attack) {
+      this._open = true;
+      this._hang = this._hangover;
+      st.opens++;
+      st.open++;
+      this._flushPreroll();
+    } else if (this._comfort && ++this._quiet >= this._comfort) {
+      // comfort frame = frame mới nhất; frame cũ hơn trong pre-roll bỏ luôn (giữ đúng thứ tự)
+      this._quiet = 0;
+      st.comfort++;
+      st.sent++;
+      const i = (this._preHead - 1 + this._pre.length) % this._pre.length;
+      const buf = this._pre[i].buffer;
+      this.port.postMessage(buf, [buf]);
+      this._pre[i] = new Int16Array(this.frameSize);
+      this._preLen = 0;
+    }
+    this._report();
+  }
+
+  _stashPreroll() {
+    // đổi chỗ: frame vừa xong vào ring, buffer cũ nhất của ring thành frame kế tiếp
+    const pre = this._pre;
+    const old = pre[this._preHead];
+    pre[this._preHead] = this._frame;
+    this._frame = old;
+    this._preHead = (this._preHead + 1) % pre.length;
+    if (this._preLen < pre.length) this._preLen++;
+  }
+
+  _flushPreroll() {
+    const pre = this._pre;
+    let i = (this._preHead - this._preLen + pre.length) % pre.length;
+    for (let k = 0; k < this._preLen; k++, i = (i + 1) % pre.length) {
+      const buf = pre[i].buffer;
+      this.port.postMessage(buf, [buf]);
+      pre[i] = new Int16Array(this.frameSize);
     }
+    this._stats.sent += this._preLen;
+    this._preLen = 0;
+  }
 
-    // xuất chunk ~20ms
-    while (this._outBuf.length >= this._needOut) {
-      const chunk = this._outBuf.splice(0, this._needOut);
-      const pcm16 = new Int16Array(chunk.length);
+  _report() {
+    const st = this._stats;
+    if (st.frames % STATS_EVERY !== 0) return;
+    st.floorDb = Math.round(this._floorDb * 10) / 10;
+    this.port.postMessage(st); // structured clone: main thread nhận bản sao
+  }
 
-      for (let i = 0; i < chunk.length; i++) {
-        pcm16[i] = chunk[i] * 32767;
+  _write(samples) {
+    const ring = this._ring, mask = this._mask;
+    let w = this._written;
+    if (!this._aa) {
+      for (let i = 0; i < samples.length; i++) ring[(w++) & mask] = samples[i];
+    } else {
+      const b0 = this._b0, b1 = this._b1, b2 = this._b2, a1 = this._a1, a2 = this._a2;
+      let x1 = this._x1, x2 = this._x2, y1 = this._y1, y2 = this._y2;
+      for (let i = 0; i < samples.length; i++) {
+        const x = samples[i];
+        const y = b0 * x + b1 * x1 + b2 * x2 - a1 * y1 - a2 * y2;
+        x2 = x1; x1 = x; y2 = y1; y1 = y;
+        ring[(w++) & mask] = y;
       }
+      this._x1 = x1; this._x2 = x2; this._y1 = y1; this._y2 = y2;
+    }
+    this._written = w;
+  }
+
+  _resample() {
+    // nội suy tuyến tính giữa ring[i0], ring[i0 + 1]; giữ phần dư cho quantum sau
+    const ring = this._ring, mask = this._mask, ratio = this.ratio;
+    let pos = this._pos;
+    while (pos + 1 < this._written) {
+      const i0 = Math.floor(pos);
+      const frac = pos - i0;
+      const a = ring[i0 & mask];
+      this._push(a + (ring[(i0 + 1) & mask] - a) * frac);
+      pos += ratio;
+    }
+    this._pos = pos;
+  }
 
-      const bytes = new Uint8Array(pcm16.buffer);
-      const b64 = base64Encode(bytes);
-      this.port.postMessage(b64);
+  process(inputs) {
+    const input = inputs[0];
+    if (!input || input.length === 0) return true;
+
+    const samples = input[0];
+    if (this.ratio === 1) {
+      for (let i = 0; i < samples.length; i++) this._push(samples[i]);
+      return true;
     }
 
+    this._write(samples);
+    this._resample();
     return true;
   }
 }
 
-registerProcessor("pcm-worklet", PCMWorkletProcessor);
\ No newline at end of file
+registerProcessor("pcm-worklet", PCMWorkletProcessor);
@@ -0,0 +1,299 @@
+# stream_relay.py
+# Relay stream upstream -> client cho /api/tts-stream.
+#
+# - đọc upstream theo RELAY_READ_SIZE thay vì 1024 byte cố định
+# - gộp các chunk nhỏ tới RELAY_COALESCE_BYTES hoặc tới khi byte đầu tiên trong
+#   buffer đã chờ RELAY_COALESCE_MS (đỡ hàng trăm write/syscall nhỏ mỗi giây)
+# - reader -> queue giới hạn RELAY_MAX_BUFFER: client đọc chậm thì queue đầy,
+#   reader dừng đọc và TCP upstream tự backpressure, RAM không phình
+# - client ngắt -> generator bị close -> đóng upstream ngay, không đọc nốt
+# - upstream lỗi giữa chừng -> gửi nốt buffer, log rồi ném lại (đếm aborted, client thấy stream cụt)
+# - đo TTFB và bytes/sec cho từng stream
+
+import asyncio
+import os
+import queue
+import threading
+import time
+
+import tracing
+from metrics import Counter, Gauge, Histogram
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name) or default)
+    except ValueError:
+        return default
+
+
+RELAY_READ_SIZE      = _env_int("RELAY_READ_SIZE", 8192)
+RELAY_COALESCE_BYTES = _env_int("RELAY_COALESCE_BYTES", 16384)
+RELAY_COALESCE_MS    = _env_int("RELAY_COALESCE_MS", 40)
+RELAY_MAX_BUFFER     = _env_int("RELAY_MAX_BUFFER", 256 * 1024)
+
+stream_ttfb = Histogram("tts_stream_ttfb_seconds", "Thời gian tới byte audio đầu tiên gửi client",
+                        labelnames=("source",))
+stream_rate = Histogram("tts_stream_bytes_per_second", "Throughput mỗi stream",
+                        labelnames=("source",),
+                        buckets=(4e3, 8e3, 16e3, 32e3, 64e3, 128e3, 256e3, 512e3, 1e6, 4e6))
+stream_bytes = Counter("tts_stream_bytes_total", "Tổng byte audio đã stream", labelnames=("source",))
+stream_aborted = Counter("tts_stream_aborted_total", "Stream bị client ngắt / upstream lỗi giữa chừng",
+                         labelnames=("source",))
+stream_inflight = Gauge("tts_streams_inflight", "Stream audio đang gửi cho client", labelnames=("source",))
+
+_EOF = object()
+
+
+class StreamMeter:
+    def __init__(self, source, started_at=None):
+        self.source = source
+        self.started_at = started_at or time.perf_counter()
+        self.first_byte_at = None
+        self.bytes = 0
+        stream_inflight.inc(source=source)
+
+    def sent(self, n):
+        if self.first_byte_at is None:
+            self.first_byte_at = time.perf_counter()
+            stream_ttfb.observe(self.first_byte_at - self.started_at, source=self.source)
+        self.bytes += n
+
+    def finish(self, completed):
+        stream_inflight.dec(source=self.source)
+        stream_bytes.inc(self.bytes, source=self.source)
+        if not completed:
+            stream_aborted.inc(source=self.source)
+        if completed and self.first_byte_at is not None:
+            elapsed = time.perf_counter() - self.first_byte_at
+            if elapsed > 0:
+                stream_rate.observe(self.bytes / elapsed, source=self.source)
+
+
+class Chunks:
+    """
+    Iterator bọc generator bytes; close() luôn chạy on_close (1 lần), kể cả khi chưa next() lần
+    nào — close() generator chưa bắt đầu không chạy finally của nó (vd segment prefetch bị bỏ).
+    """
+
+    def __init__(self, chunks, on_close):
+        self._chunks = chunks
+        self._on_close = on_close
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._chunks)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        on_close, self._on_close = self._on_close, None
+        try:
+            self._chunks.close()
+        finally:
+            if on_close is not None:
+                on_close()
+
+
+class AsyncChunks:
+    """
+    Như Chunks cho async generator; on_close là coroutine function.
+    """
+
+    def __init__(self, chunks, on_close):
+        self._chunks = chunks
+        self._on_close = on_close
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self._chunks.__anext__()
+        except BaseException:
+            await self.aclose()
+            raise
+
+    async def aclose(self):
+        on_close, self._on_close = self._on_close, None
+        try:
+            await self._chunks.aclose()
+        finally:
+            if on_close is not None:
+                await on_close()
+
+
+def _upstream_error(source, e):
+    tracing.log("tts_stream_error", source=source, error=str(e), type=type(e).__name__)
+
+
+# =========================================================
+# SYNC (Flask / WSGI)
+# =========================================================
+def metered(chunks, source, started_at=None):
+    """
+    Bọc 1 generator bytes: đo TTFB / throughput, không đổi dữ liệu.
+    """
+    meter = StreamMeter(source, started_at)
+    completed = False
+    try:
+        for chunk in chunks:
+            meter.sent(len(chunk))
+            yield chunk
+        completed = True
+    finally:
+        meter.finish(completed)
+        close = getattr(chunks, "close", None)
+        if close:
+            close()
+
+
+def relay(response, source="upstream", started_at=None, read_size=RELAY_READ_SIZE,
+          coalesce_bytes=RELAY_COALESCE_BYTES, coalesce_ms=RELAY_COALESCE_MS,
+          max_buffer=RELAY_MAX_BUFFER):
+    """
+    Generator relay từ requests.Response (stream=True) ra client.
+    """
+    q = queue.Queue(maxsize=max(1, max_buffer // read_size))
+    stop = threading.Event()
+
+    def put(item):
+        # put có timeout để reader không kẹt mãi khi client đã bỏ đi
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def reader():
+        item = _EOF
+        try:
+            for chunk in response.iter_content(read_size):
+                if stop.is_set():
+                    return
+                if chunk:
+                    put(chunk)
+        except Exception as e:
+            item = e
+        put(item)
+
+    threading.Thread(target=reader, name=f"relay-{source}", daemon=True).start()
+
+    def pump():
+        budget = coalesce_ms / 1000.0
+        buf = bytearray()
+        first_at = None
+        try:
+            while True:
+                timeout = None if not buf else max(0.0, budget - (time.monotonic() - first_at))
+                try:
+                    item = q.get(timeout=timeout)
+                except queue.Empty:
+                    item = None                   # hết latency budget -> flush
+
+                if isinstance(item, Exception):
+                    if buf:
+                        yield bytes(buf)
+                    _upstream_error(source, item)
+                    raise item
+                if item is _EOF:
+                    if buf:
+                        yield bytes(buf)
+                    return
+                if item is not None:
+                    if not buf:
+                        first_at = time.monotonic()
+                    buf += item
+                    if len(buf) < coalesce_bytes and time.monotonic() - first_at < budget:
+                        continue
+                yield bytes(buf)
+                buf.clear()
+        finally:
+            # client ngắt / xong: dừng reader, đóng upstream (không drain)
+            stop.set()
+            response.close()
+
+    return metered(pump(), source, started_at)
+
+
+# =========================================================
+# ASYNC (ASGI)
+# =========================================================
+async def ametered(chunks, source, started_at=None):
+    meter = StreamMeter(source, started_at)
+    completed = False
+    try:
+        async for chunk in chunks:
+            meter.sent(len(chunk))
+            yield chunk
+        completed = True
+    finally:
+        meter.finish(completed)
+        aclose = getattr(chunks, "aclose", None)
+        if aclose:
+            await aclose()
+
+
+def arelay(response, source="upstream", started_at=None, read_size=RELAY_READ_SIZE,
+           coalesce_bytes=RELAY_COALESCE_BYTES, coalesce_ms=RELAY_COALESCE_MS,
+           max_buffer=RELAY_MAX_BUFFER):
+    """
+    Như relay() cho httpx.Response (stream=True); reader là asyncio.Task.
+    """
+    q = asyncio.Queue(maxsize=max(1, max_buffer // read_size))
+
+    async def reader():
+        try:
+            async for chunk in response.aiter_bytes(read_size):
+                if chunk:
+                    await q.put(chunk)
+            await q.put(_EOF)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await q.put(e)
+
+    async def pump():
+        task = asyncio.ensure_future(reader())
+        budget = coalesce_ms / 1000.0
+        loop = asyncio.get_running_loop()
+        buf = bytearray()
+        first_at = None
+        try:
+            while True:
+                try:
+                    if buf:
+                        remaining = max(0.0, budget - (loop.time() - first_at))
+                        item = await asyncio.wait_for(q.get(), remaining)
+                    else:
+                        item = await q.get()
+                except asyncio.TimeoutError:
+                    item = None
+
+                if isinstance(item, Exception):
+                    if buf:
+                        yield bytes(buf)
+                    _upstream_error(source, item)
+                    raise item
+                if item is _EOF:
+                    if buf:
+                        yield bytes(buf)
+                    return
+                if item is not None:
+                    if not buf:
+                        first_at = loop.time()
+                    buf += item
+                    if len(buf) < coalesce_bytes and loop.time() - first_at < budget:
+                        continue
+                yield bytes(buf)
+                buf.clear()
+        finally:
+            task.cancel()
+            await response.aclose()
+
+    return ametered(pump(), source, started_at)
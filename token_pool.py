@@ -0,0 +1,297 @@
+# token_pool.py
+# Pool signed_url / conversation token đã mint sẵn.
+#
+# Mỗi item chỉ dùng 1 lần (1 conversation), có hạn dùng. Thread nền giữ pool ở
+# độ sâu mục tiêu tính theo tốc độ request gần đây, bỏ item sắp hết hạn.
+# Hạn dùng: exp upstream ghi trong item nếu đọc được (conversation token là JWT), không thì TTL
+# riêng theo loại pool — signed URL không mang hạn, ElevenLabs cho sống 15 phút kể từ lúc mint.
+# take() chỉ là 1 lần pop local; pool rỗng thì caller tự mint trực tiếp như cũ.
+#
+# SharedTokenPool (SHARED_STATE=sqlite|redis): 1 pool chung cho mọi worker. Tốc độ request
+# đếm cho cả cluster, mỗi lúc chỉ 1 process giữ lock mint -> không mint gấp N lần.
+
+import asyncio
+import base64
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+
+from shared_state import SHARED_LOCK_TTL, shared as shared_backend
+
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name) or default)
+    except ValueError:
+        return default
+
+
+POOL_ENABLED   = (os.getenv("TOKEN_POOL_ENABLED") or "1").lower() in ("1", "true", "yes")
+POOL_MIN       = int(_env_float("TOKEN_POOL_MIN", 1))       # độ sâu tối thiểu khi có traffic
+POOL_MAX       = int(_env_float("TOKEN_POOL_MAX", 8))       # độ sâu tối đa
+POOL_TTL       = _env_float("TOKEN_POOL_TTL", 600)          # hạn dùng signed URL (upstream: 15 phút)
+POOL_TOKEN_TTL = _env_float("TOKEN_POOL_TOKEN_TTL", 300)    # hạn tối đa conversation token (exp JWT thấp hơn thì theo exp)
+POOL_MARGIN    = _env_float("TOKEN_POOL_MARGIN", 60)        # bỏ item còn < margin giây
+POOL_HORIZON   = _env_float("TOKEN_POOL_HORIZON", 10)       # đủ item cho N giây traffic
+POOL_IDLE      = _env_float("TOKEN_POOL_IDLE", 900)         # không có request -> ngừng mint
+RATE_WINDOW    = 60.0
+
+
+def jwt_expires_at(field):
+    """
+    -> fn(value) đọc claim exp (unix time) của JWT value[field]; không phải JWT -> None.
+    Không verify chữ ký: chỉ để biết lúc nào bỏ item khỏi pool.
+    """
+    def expires_at(value):
+        try:
+            payload = value[field].split(".")[1]
+            claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+            return float(claims["exp"])
+        except Exception:
+            return None
+    return expires_at
+
+
+class TokenPool:
+    def __init__(self, name, mint, min_depth=POOL_MIN, max_depth=POOL_MAX,
+                 ttl=POOL_TTL, margin=POOL_MARGIN, horizon=POOL_HORIZON, idle=POOL_IDLE,
+                 expires_at=None):
+        """
+        mint() -> value (raise nếu lỗi). value được trả nguyên cho caller.
+        expires_at(value) -> hạn upstream (unix time) hoặc None; ttl là hạn tối đa / mặc định.
+        """
+        self.name = name
+        self.mint = mint
+        self.min_depth = min_depth
+        self.max_depth = max_depth
+        self.ttl = ttl
+        self.expires_at = expires_at
+        self.margin = margin
+        self.horizon = horizon
+        self.idle = idle
+
+        self._items = deque()                 # (value, expires_at)
+        self._requests = deque()              # timestamps trong RATE_WINDOW
+        self._cond = threading.Condition()
+        self._thread = None
+        self._mint_latency = None             # EWMA
+        self._last_request_at = None
+        self.stats = {"hits": 0, "misses": 0, "minted": 0, "expired": 0, "mint_errors": 0}
+
+    # ---------- public ----------
+    def start(self):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"token-pool-{self.name}",
+                                                daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def take(self):
+        """
+        Pop 1 item còn hạn, hoặc None nếu pool rỗng.
+        """
+        now = time.monotonic()
+        with self._cond:
+            self._requests.append(now)
+            self._last_request_at = now
+            self._drop_expired(now)
+            if self._items:
+                value, _ = self._items.popleft()
+                self.stats["hits"] += 1
+            else:
+                value = None
+                self.stats["misses"] += 1
+            self._cond.notify()
+        if self._thread is None:
+            self.start()
+        return value
+
+    async def atake(self):
+        # ASGI: pop local không chặn event loop
+        return self.take()
+
+    def info(self):
+        with self._cond:
+            now = time.monotonic()
+            return {
+                "depth": len(self._items),
+                "ttl": self.ttl,
+                "target": self._target(now),
+                "rate_per_sec": round(self._rate(now), 3),
+                "mint_latency": round(self._mint_latency, 3) if self._mint_latency else None,
+                **self.stats,
+            }
+
+    # ---------- internals ----------
+    def _lifetime(self, value):
+        # giây còn dùng được tính từ lúc mint: exp upstream nếu có, không quá ttl
+        if self.expires_at is not None:
+            exp = self.expires_at(value)
+            if exp is not None:
+                return min(self.ttl, exp - time.time())
+        return self.ttl
+
+    def _drop_expired(self, now):
+        while self._items and self._items[0][1] - now < self.margin:
+            self._items.popleft()
+            self.stats["expired"] += 1
+
+    def _rate(self, now):
+        while self._requests and now - self._requests[0] > RATE_WINDOW:
+            self._requests.popleft()
+        return len(self._requests) / RATE_WINDOW
+
+    def _target(self, now):
+        if self._last_request_at is None or now - self._last_request_at > self.idle:
+            return 0
+        want = math.ceil(self._rate(now) * self.horizon)
+        return max(self.min_depth, min(self.max_depth, want))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                self._drop_expired(now)
+                need = self._target(now) - len(self._items)
+                if need <= 0:
+                    # ngủ tới khi item đầu sắp hết hạn hoặc có request mới
+                    wake = (self._items[0][1] - self.margin - now) if self._items else RATE_WINDOW
+                    self._cond.wait(timeout=max(1.0, min(wake, RATE_WINDOW)))
+                    continue
+
+            t0 = time.monotonic()
+            try:
+                value = self.mint()
+            except Exception:
+                with self._cond:
+                    self.stats["mint_errors"] += 1
+                time.sleep(2.0)
+                continue
+
+            took = time.monotonic() - t0
+            with self._cond:
+                self._mint_latency = took if self._mint_latency is None else (
+                    0.8 * self._mint_latency + 0.2 * took)
+                self._items.append((value, t0 + self._lifetime(value)))
+                self.stats["minted"] += 1
+
+
+class SharedTokenPool(TokenPool):
+    """
+    Như TokenPool nhưng item / request / lock nằm trong shared backend (thời gian wall clock).
+    Value phải serialize được bằng JSON.
+    """
+    POLL = 1.0      # không được notify khi worker khác take() -> kiểm tra định kỳ
+
+    def __init__(self, name, mint, shared, **kwargs):
+        super().__init__(name, mint, **kwargs)
+        self.shared = shared
+        self._key = f"pool:{name}"
+        self._req_key = f"pool:{name}:requests"
+        self._last_key = f"pool:{name}:last_request"
+        self._lock_key = f"lock:pool:{name}"
+        self.stats["shared_errors"] = 0
+
+    def take(self):
+        now = time.time()
+        try:
+            self.shared.push(self._req_key, b"", now + RATE_WINDOW)
+            self.shared.set(self._last_key, b"1", self.idle)
+            raw, expired = self.shared.pop(self._key, now + self.margin)
+        except Exception:
+            with self._cond:
+                self.stats["shared_errors"] += 1
+                self.stats["misses"] += 1
+            return None
+
+        value = json.loads(raw) if raw is not None else None
+        with self._cond:
+            self.stats["expired"] += expired
+            self.stats["hits" if value is not None else "misses"] += 1
+            self._cond.notify()
+        if self._thread is None:
+            self.start()
+        return value
+
+    async def atake(self):
+        # I/O backend (SQLite / Redis) chạy trong thread, không chặn event loop
+        return await asyncio.to_thread(self.take)
+
+    def info(self):
+        now = time.time()
+        try:
+            depth = self.shared.count(self._key, now + self.margin)
+            rate, target = self._shared_target(now)
+        except Exception:
+            depth, rate, target = None, None, None
+        with self._cond:
+            return {
+                "shared": True,
+                "depth": depth,
+                "ttl": self.ttl,
+                "target": target,
+                "rate_per_sec": round(rate, 3) if rate is not None else None,
+                "mint_latency": round(self._mint_latency, 3) if self._mint_latency else None,
+                **self.stats,
+            }
+
+    def _shared_target(self, now):
+        # -> (rate cả cluster, độ sâu mục tiêu)
+        rate = self.shared.count(self._req_key, now) / RATE_WINDOW
+        if self.shared.get(self._last_key) is None:
+            return rate, 0
+        want = math.ceil(rate * self.horizon)
+        return rate, max(self.min_depth, min(self.max_depth, want))
+
+    def _run(self):
+        while True:
+            token = None
+            try:
+                now = time.time()
+                need = self._shared_target(now)[1] - self.shared.count(self._key, now + self.margin)
+                if need > 0:
+                    token = self.shared.acquire(self._lock_key, SHARED_LOCK_TTL)
+            except Exception:
+                with self._cond:
+                    self.stats["shared_errors"] += 1
+                time.sleep(2.0)
+                continue
+
+            if token is None:
+                # đủ item, hoặc process khác đang mint
+                with self._cond:
+                    self._cond.wait(timeout=self.POLL)
+                continue
+
+            t0 = time.monotonic()
+            try:
+                value = self.mint()
+                self.shared.push(self._key, json.dumps(value).encode("utf-8"),
+                                 time.time() + self._lifetime(value))
+            except Exception:
+                with self._cond:
+                    self.stats["mint_errors"] += 1
+                time.sleep(2.0)
+                continue
+            finally:
+                try:
+                    self.shared.release(self._lock_key, token)
+                except Exception:
+                    pass
+
+            took = time.monotonic() - t0
+            with self._cond:
+                self._mint_latency = took if self._mint_latency is None else (
+                    0.8 * self._mint_latency + 0.2 * took)
+                self.stats["minted"] += 1
+
+
+def make_pool(name, mint, shared=shared_backend, **kwargs):
+    # có shared backend -> pool chung cho cả cluster, không thì pool local như cũ
+    if shared is not None:
+        return SharedTokenPool(name, mint, shared, **kwargs)
+    return TokenPool(name, mint, **kwargs)
@@ -0,0 +1,335 @@
+# tracing.py
+# Trace theo request: trace id, span quanh call upstream / bước parse, log JSON qua sink bất đồng bộ.
+#
+# - Mỗi request 1 trace id: lấy từ header traceparent (W3C) / X-Request-Id nếu client gửi, không
+#   có thì sinh mới. Response trả lại X-Request-Id + traceparent; call upstream (upstream.py) mang
+#   traceparent + X-Request-Id -> log n8n / ElevenLabs ghép được với log của mình.
+# - span("n8n.parse"): đo 1 bước; upstream.py tự mở span "upstream.<op>" cho mọi call upstream.
+#   Span gắn vào trace hiện tại qua contextvars (Flask: thread, Quart: task, asyncio.to_thread tự
+#   copy); submit vào ThreadPoolExecutor thì bọc bind(fn).
+# - Hết request (stream: khi đóng response) -> 1 dòng JSON {trace_id, route, status, ms, spans}
+#   vào LogSink: queue + thread ghi riêng, request chỉ put_nowait (không bao giờ chờ I/O log);
+#   queue đầy -> bỏ dòng, đếm dropped.
+# - TRACE_SAMPLE: tỉ lệ trace được ghi; request lỗi (>= 500), chậm hơn TRACE_SLOW_MS, hoặc client
+#   gửi traceparent có cờ sampled thì luôn ghi. Span nào cũng vào histogram trace_span_seconds.
+#
+#   TRACE_ENABLED=1  TRACE_SAMPLE=0.1  TRACE_SLOW_MS=1000  TRACE_LOG=-  (- = stderr, hoặc path file)
+
+import collections
+import contextvars
+import os
+import queue
+import random
+import secrets
+import sys
+import threading
+import time
+
+import fast_json
+from metrics import Histogram
+
+TRACE_ENABLED   = (os.getenv("TRACE_ENABLED") or "1").lower() in ("1", "true", "yes")
+TRACE_SAMPLE    = float(os.getenv("TRACE_SAMPLE") or 0.1)
+TRACE_SLOW_MS   = float(os.getenv("TRACE_SLOW_MS") or 1000)
+TRACE_LOG       = (os.getenv("TRACE_LOG") or "-").strip()
+TRACE_PROPAGATE = (os.getenv("TRACE_PROPAGATE") or "1").lower() in ("1", "true", "yes")
+TRACE_QUEUE     = 10000          # dòng log chờ ghi tối đa
+TRACE_MAX_SPANS = 200            # span / trace (stream dài không phình vô hạn)
+TRACE_RECENT    = 50             # trace gần nhất giữ cho /api/traces
+
+span_duration = Histogram("trace_span_seconds", "Thời gian theo span (call upstream, bước parse)",
+                          labelnames=("span",))
+
+_trace = contextvars.ContextVar("trace", default=None)
+_span = contextvars.ContextVar("span", default=None)
+
+
+def _now_ms(t0):
+    return round((time.perf_counter() - t0) * 1000, 2)
+
+
+def _is_trace_id(value):
+    # 32 hex, khác toàn 0 (W3C)
+    try:
+        return len(value) == 32 and int(value, 16) != 0
+    except ValueError:
+        return False
+
+
+def parse_traceparent(value):
+    """
+    "00-<trace id 32 hex>-<span id 16 hex>-<flags>" -> (trace_id, parent_id, sampled) hoặc None.
+    """
+    parts = (value or "").strip().lower().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16 or len(parts[3]) != 2:
+        return None
+    try:
+        int(parts[2], 16)
+        flags = int(parts[3], 16)
+    except ValueError:
+        return None
+    if not _is_trace_id(parts[1]):
+        return None
+    return parts[1], parts[2], bool(flags & 1)
+
+
+# =========================================================
+# SPAN / TRACE
+# =========================================================
+class Span:
+    def __init__(self, trace, name, parent_id, attrs):
+        self.trace = trace
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attrs = attrs
+        self.offset_ms = _now_ms(trace.t0) if trace is not None else 0.0
+        self.ms = None
+        self._t0 = time.perf_counter()
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def end(self, **attrs):
+        # gọi nhiều lần -> chỉ lần đầu có hiệu lực
+        if self.ms is not None:
+            return
+        self.attrs.update(attrs)
+        self.ms = _now_ms(self._t0)
+        span_duration.observe(self.ms / 1000, span=self.name)
+        if self.trace is not None:
+            self.trace.add(self)
+
+    def record(self):
+        return {"name": self.name, "span_id": self.span_id, "parent_id": self.parent_id,
+                "start_ms": self.offset_ms, "ms": self.ms, **self.attrs}
+
+
+class Trace:
+    def __init__(self, trace_id=None, parent_id=None, sampled=False, request_id=None):
+        self.trace_id = trace_id or secrets.token_hex(16)
+        self.request_id = request_id or self.trace_id
+        self.span_id = secrets.token_hex(8)          # root span = chính request
+        self.parent_id = parent_id
+        self.sampled = sampled or random.random() < TRACE_SAMPLE
+        self.started_at = time.time()
+        self.t0 = time.perf_counter()
+        self.attrs = {}
+        self.spans = []
+        self.dropped = 0
+        self.done = False
+        self._lock = threading.Lock()
+
+    def traceparent(self, span_id=None):
+        return f"00-{self.trace_id}-{span_id or self.span_id}-{'01' if self.sampled else '00'}"
+
+    def headers(self, span_id=None):
+        # header gửi kèm call upstream / trả về client
+        return {"traceparent": self.traceparent(span_id), "X-Request-Id": self.request_id}
+
+    def add(self, span):
+        with self._lock:
+            if self.done:
+                return
+            if len(self.spans) >= TRACE_MAX_SPANS:
+                self.dropped += 1
+                return
+            self.spans.append(span)
+
+    def finish(self, status=None, **attrs):
+        with self._lock:
+            if self.done:
+                return
+            self.done = True
+            spans = list(self.spans)
+        ms = _now_ms(self.t0)
+        self.attrs.update(attrs)
+        stats["traces"] += 1
+        if not (self.sampled or (status or 0) >= 500 or ms >= TRACE_SLOW_MS):
+            return
+        record = {"ts": round(self.started_at, 3), "event": "request", "trace_id": self.trace_id,
+                  "request_id": self.request_id, "span_id": self.span_id,
+                  "parent_id": self.parent_id, "status": status, "ms": ms, **self.attrs, "spans": [s.record() for s in spans]}
+        if self.dropped:
+            record["dropped_spans"] = self.dropped
+        stats["logged"] += 1
+        recent.append(record)
+        sink.emit(record)
+
+
+class _NoopSpan:
+    span_id = None
+
+    def set(self, **attrs):
+        pass
+
+    def end(self, **attrs):
+        pass
+
+
+NOOP = _NoopSpan()
+stats = {"traces": 0, "logged": 0}
+recent = collections.deque(maxlen=TRACE_RECENT)
+
+
+def begin(headers, **attrs):
+    """
+    Mở trace cho request hiện tại (headers = request.headers). -> Trace (None nếu tắt).
+    """
+    if not TRACE_ENABLED:
+        return None
+    # X-Request-Id của client (proxy / LB) giữ nguyên để trả lại; trace id luôn đúng chuẩn W3C
+    rid = "".join(c for c in (headers.get("X-Request-Id") or "")[:64] if c.isalnum() or c in "-_")
+    parsed = parse_traceparent(headers.get("traceparent"))
+    if parsed is not None:
+        trace = Trace(*parsed, request_id=rid or None)
+    else:
+        trace = Trace(rid.lower() if _is_trace_id(rid) else None, request_id=rid or None)
+    trace.attrs.update(attrs)
+    _trace.set(trace)
+    _span.set(None)
+    return trace
+
+
+def current():
+    return _trace.get()
+
+
+def start_span(name, **attrs):
+    """
+    Span mở tay, đóng bằng .end(**attrs) (vd call upstream dạng stream: đóng khi đóng response).
+    Không đổi span cha của context -> dùng được cả khi end() ở thread / task khác.
+    """
+    if not TRACE_ENABLED:
+        return NOOP
+    trace, parent = _trace.get(), _span.get()
+    if parent is not None:
+        parent_id = parent.span_id
+    else:
+        parent_id = trace.span_id if trace is not None else None
+    return Span(trace, name, parent_id, attrs)
+
+
+class span:
+    """
+    with span("n8n.parse", op="signed_url") as s: ...  (lỗi -> attr error = tên exception)
+    """
+
+    def __init__(self, name, **attrs):
+        self._span = start_span(name, **attrs)
+        self._token = None
+
+    def __enter__(self):
+        if self._span is not NOOP:
+            self._token = _span.set(self._span)
+        return self._span
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._token is not None:
+            _span.reset(self._token)
+        self._span.end(**({"error": exc_type.__name__} if exc_type is not None else {}))
+        return False
+
+
+def bind(fn):
+    # fn chạy trên thread khác (executor) vẫn thấy trace / span cha của request hiện tại
+    ctx = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return ctx.copy().run(fn, *args, **kwargs)
+
+    return run
+
+
+def outgoing_headers(span_id=None):
+    # -> header trace cho call upstream ({} nếu không có trace / tắt propagate)
+    trace = _trace.get()
+    if trace is None or not TRACE_PROPAGATE:
+        return {}
+    return trace.headers(span_id)
+
+
+def log(event, **fields):
+    """
+    Log có cấu trúc ngoài trace (lỗi, sự kiện hiếm) qua cùng sink, kèm trace_id nếu đang trong request.
+    """
+    trace = _trace.get()
+    sink.emit({"ts": round(time.time(), 3), "event": event,
+               "trace_id": trace.trace_id if trace is not None else None, **fields})
+
+
+# =========================================================
+# LOG SINK (thread riêng, request không bao giờ chờ I/O)
+# =========================================================
+class LogSink:
+    def __init__(self, target=TRACE_LOG, maxsize=TRACE_QUEUE):
+        self.target = target
+        self._queue = queue.Queue(maxsize)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.stats = {"emitted": 0, "written": 0, "dropped": 0, "errors": 0, "open_errors": 0}
+
+    def emit(self, record):
+        # record không được sửa sau khi emit (serialize ở thread ghi)
+        self._start()
+        try:
+            self._queue.put_nowait(record)
+            self.stats["emitted"] += 1
+        except queue.Full:
+            self.stats["dropped"] += 1
+
+    def _start(self):
+        # start lười: sau fork (gunicorn / hypercorn -w) mỗi worker có thread ghi riêng
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="trace-log", daemon=True)
+                self._thread.start()
+
+    def _open(self):
+        if self.target == "-":
+            return sys.stderr
+        return open(self.target, "a", encoding="utf-8", buffering=1)
+
+    def _run(self):
+        # thread ghi không được chết (emit sẽ spawn lại liên tục): mở file lỗi -> ghi ra stderr
+        try:
+            out = self._open()
+        except Exception as e:
+            self.stats["open_errors"] += 1
+            out = sys.stderr
+            print(f"trace log: không mở được {self.target!r} ({e}), ghi ra stderr", file=out)
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < 256:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = []
+            for r in batch:
+                # serialize từng dòng: 1 record hỏng không kéo cả batch theo
+                try:
+                    lines.append(fast_json.dumps(r).decode("utf-8") + "\n")
+                except Exception:
+                    self.stats["errors"] += 1
+            if not lines:
+                continue
+            try:
+                out.write("".join(lines))
+                out.flush()
+                self.stats["written"] += len(lines)
+            except Exception:
+                self.stats["errors"] += len(lines)
+
+    def info(self):
+        return {"target": self.target, "queued": self._queue.qsize(), **self.stats}
+
+
+sink = LogSink()
+
+
+def info():
+    return {"enabled": TRACE_ENABLED, "sample": TRACE_SAMPLE, "slow_ms": TRACE_SLOW_MS,
+            "propagate": TRACE_PROPAGATE, **stats, "sink": sink.info()}
@@ -0,0 +1,388 @@
+# tts_cache.py
+# Cache audio TTS trên disk, content-addressed theo
+# (voice_id, model_id, voice_settings, text đã chuẩn hoá), LRU giới hạn dung lượng.
+#
+# Miss: 1 thread nền bơm stream upstream vào file .part; mọi client (kể cả
+# client đầu tiên) đọc đuổi theo file đang ghi -> vừa stream cho client vừa ghi
+# cache, và N request giống nhau cùng lúc chỉ tốn 1 upstream stream.
+# Fill xong thì rename .part -> .mp3 và đưa vào LRU index. Lỗi ở bất kỳ bước nào (kể cả rename)
+# -> fill báo lỗi cho reader; reader không thấy byte mới quá TTS_FILL_STALL_TIMEOUT giây thì bỏ fill.
+# Reader gặp lỗi giữa chừng thì ném FillError (như stream_relay: stream bị đếm aborted, client
+# thấy response cụt chứ không phải 200 "đủ").
+# Reader cuối cùng bỏ đi (client ngắt, preview bị thay) khi fill chưa xong -> huỷ fill, đóng
+# upstream ngay, không tải nốt clip không ai nghe (và không cache bản dở).
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+import uuid
+from collections import OrderedDict
+
+import tracing
+from stream_relay import RELAY_READ_SIZE, AsyncChunks, Chunks
+
+TTS_CACHE_ENABLED   = (os.getenv("TTS_CACHE_ENABLED") or "1").lower() in ("1", "true", "yes")
+TTS_CACHE_DIR       = os.getenv("TTS_CACHE_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), ".cache", "tts")
+TTS_CACHE_MAX_BYTES = int(float(os.getenv("TTS_CACHE_MAX_MB") or 500) * 1024 * 1024)
+TTS_FILL_STALL      = float(os.getenv("TTS_FILL_STALL_TIMEOUT") or 30)   # giây không có byte mới
+PART_STALE          = 3600        # .part cũ hơn (mtime) mới coi là rác của lần chạy trước
+FILL_CHUNK = 16 * 1024
+
+_WS = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    return _WS.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+def cache_key(voice_id, model_id, voice_settings, text):
+    raw = json.dumps(
+        [voice_id, model_id, voice_settings or {}, normalize_text(text)],
+        sort_keys=True, ensure_ascii=False, separators=(",", ":"),
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def iter_file(path, chunk_size=FILL_CHUNK):
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                return
+            yield data
+
+
+class FillError(Exception):
+    """
+    Fill lỗi / bị bỏ khi reader đang đọc dở.
+    """
+
+
+def _fill_error(fill, reason):
+    tracing.log("tts_fill_error", key=fill.key, error=reason)
+    return FillError(reason)
+
+
+class Fill:
+    """
+    1 lần synthesize đang chạy. Reader đọc file `path` tới `size`, chờ thêm dữ liệu
+    cho tới khi done.
+    """
+
+    def __init__(self, key, path):
+        self.key = key
+        self.path = path
+        self.size = 0
+        self.ready = False                # upstream đã trả 200 (hoặc đã lỗi)
+        self.done = False
+        self.error = None
+        self.readers = 0                  # request đang / sẽ đọc (giữ bởi TTSCache._lock)
+        self.upstream = None              # requests.Response đang bơm
+        self.cond = threading.Condition()
+        self._async_waiters = []          # (loop, asyncio.Event)
+
+    def _notify(self):
+        # gọi khi đang giữ self.cond
+        self.cond.notify_all()
+        waiters, self._async_waiters = self._async_waiters, []
+        for loop, ev in waiters:
+            loop.call_soon_threadsafe(ev.set)
+
+    def wait_ready(self, timeout=None):
+        with self.cond:
+            self.cond.wait_for(lambda: self.ready, timeout)
+            return self.error
+
+    async def await_ready(self):
+        while True:
+            with self.cond:
+                if self.ready:
+                    return self.error
+                ev = asyncio.Event()
+                self._async_waiters.append((asyncio.get_running_loop(), ev))
+            await ev.wait()
+
+    def _set_ready(self):
+        with self.cond:
+            self.ready = True
+            self._notify()
+
+    def wait(self, offset, timeout=1.0):
+        with self.cond:
+            if self.size <= offset and not self.done:
+                self.cond.wait(timeout)
+            return self.size, self.done
+
+    async def await_data(self, offset, timeout=1.0):
+        with self.cond:
+            if self.size > offset or self.done:
+                return self.size, self.done
+            ev = asyncio.Event()
+            self._async_waiters.append((asyncio.get_running_loop(), ev))
+        try:
+            await asyncio.wait_for(ev.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        with self.cond:
+            return self.size, self.done
+
+
+class TTSCache:
+    def __init__(self, directory=TTS_CACHE_DIR, max_bytes=TTS_CACHE_MAX_BYTES):
+        self.dir = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._index = OrderedDict()       # key -> size, cũ nhất trước
+        self._bytes = 0
+        self._fills = {}                  # key -> Fill
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0,
+                      "fill_errors": 0, "cancelled": 0}
+        os.makedirs(self.dir, exist_ok=True)
+        self._load_index()
+
+    def _path(self, key):
+        return os.path.join(self.dir, key + ".mp3")
+
+    def _load_index(self):
+        entries = []
+        for name in os.listdir(self.dir):
+            full = os.path.join(self.dir, name)
+            if name.endswith(".part"):
+                # fill dở dang từ lần chạy trước; .part mới có thể là fill đang chạy của worker
+                # khác dùng chung thư mục (gunicorn / hypercorn -w N) -> không đụng
+                try:
+                    if time.time() - os.stat(full).st_mtime > PART_STALE:
+                        os.remove(full)
+                except OSError:
+                    pass
+                continue
+            if not name.endswith(".mp3"):
+                continue
+            st = os.stat(full)
+            entries.append((st.st_mtime, name[:-4], st.st_size))
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._bytes += size
+        self._evict()
+
+    # ---------- lookup ----------
+    def lookup(self, key):
+        """
+        -> path file đã cache (và đánh dấu mới dùng) hoặc None.
+        """
+        with self._lock:
+            if key not in self._index:
+                return None
+            self._index.move_to_end(key)
+            self.stats["hits"] += 1
+        path = self._path(key)
+        try:
+            os.utime(path)                # giữ thứ tự LRU qua restart
+        except FileNotFoundError:
+            with self._lock:
+                self._bytes -= self._index.pop(key, 0)
+            return None
+        return path
+
+    def join_or_start(self, key, open_upstream):
+        """
+        -> (Fill, None) hoặc (None, response lỗi từ upstream).
+        open_upstream() trả requests.Response (stream=True); status != 200 thì
+        trả lại cho caller, không tạo fill. Fill lấy từ request khác có thể chưa
+        ready -> caller gọi fill.wait_ready()/await_ready() trước khi trả 200.
+        Mỗi lần trả Fill = 1 chỗ reader, iter_fill / aiter_fill trả lại khi kết thúc;
+        caller bỏ ngang trước khi đọc (chờ ready lỗi / timeout) thì gọi release(fill).
+        """
+        with self._lock:
+            fill = self._fills.get(key)
+            if fill is not None:
+                self.stats["coalesced"] += 1
+                fill.readers += 1
+                return fill, None
+            fill = self._fills[key] = Fill(key, os.path.join(
+                self.dir, f"{key}.{uuid.uuid4().hex[:8]}.part"))
+            fill.readers = 1
+            self.stats["misses"] += 1
+            open(fill.path, "wb").close()
+
+        try:
+            r = open_upstream()
+        except BaseException:
+            self._abort(fill, "upstream error")
+            raise
+        if r.status_code != 200:
+            self._abort(fill, f"upstream status={r.status_code}")
+            r.content                     # đọc body lỗi rồi đóng, caller vẫn dùng r.text được
+            r.close()
+            return None, r
+
+        fill.upstream = r
+        fill._set_ready()
+        threading.Thread(target=self._pump, args=(fill, r), name=f"tts-fill-{key[:8]}",
+                         daemon=True).start()
+        return fill, None
+
+    # ---------- fill ----------
+    def _pump(self, fill, r):
+        try:
+            with open(fill.path, "ab") as f:
+                for chunk in r.iter_content(RELAY_READ_SIZE):
+                    if not chunk:
+                        continue
+                    f.write(chunk)
+                    f.flush()
+                    with fill.cond:
+                        if fill.error is not None:    # đã bị bỏ (stall / huỷ) -> thôi tải
+                            return
+                        fill.size += len(chunk)
+                        fill._notify()
+        except Exception as e:
+            self._abort(fill, str(e))     # huỷ đóng r giữa chừng cũng vào đây (no-op)
+            return
+        finally:
+            r.close()
+
+        if fill.size == 0:
+            self._abort(fill, "upstream trả audio rỗng")
+            return
+
+        final = self._path(fill.key)
+        try:
+            with fill.cond:
+                if fill.done:             # reader đã bỏ fill vì stall
+                    return
+                os.replace(fill.path, final)
+                fill.path = final
+                fill.done = True
+                fill._notify()
+        except Exception as e:
+            # vd .part bị xoá ngoài ý muốn -> reader phải thấy lỗi, không chờ mãi
+            self._abort(fill, f"finalize: {e}")
+            return
+        with self._lock:
+            if self._fills.get(fill.key) is fill:
+                self._fills.pop(fill.key)
+            self._bytes -= self._index.pop(fill.key, 0)
+            self._index[fill.key] = fill.size
+            self._bytes += fill.size
+            self._evict()
+
+    def _abort(self, fill, reason, stat="fill_errors"):
+        with self._lock:
+            # chỉ gỡ đúng fill này (key có thể đã có fill mới)
+            if self._fills.get(fill.key) is fill:
+                self._fills.pop(fill.key)
+        with fill.cond:
+            if fill.done:
+                return
+            self.stats[stat] += 1
+            fill.error = reason
+            fill.ready = True
+            fill.done = True
+            fill._notify()
+        try:
+            os.remove(fill.path)
+        except OSError:
+            pass
+
+    def release(self, fill):
+        # trả 1 chỗ reader; reader cuối mà fill chưa xong -> huỷ + đóng upstream ngay
+        with self._lock:
+            fill.readers -= 1
+            if fill.readers > 0 or self._fills.get(fill.key) is not fill:
+                return
+            self._fills.pop(fill.key)     # request mới cùng key sẽ tạo fill mới
+        self._abort(fill, "cancelled", stat="cancelled")
+        if fill.upstream is not None:
+            try:
+                fill.upstream.close()     # pump đang chờ chunk -> lỗi đọc -> thoát
+            except Exception:
+                pass
+
+    def _evict(self):
+        # gọi khi đang giữ self._lock
+        while self._bytes > self.max_bytes and len(self._index) > 1:
+            key, size = self._index.popitem(last=False)
+            self._bytes -= size
+            self.stats["evictions"] += 1
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    # ---------- readers ----------
+    def iter_fill(self, fill, chunk_size=FILL_CHUNK):
+        """
+        Iterator sync: đọc đuổi theo file đang ghi tới khi fill xong. Hết / lỗi / close() (kể cả
+        khi chưa đọc byte nào) -> trả chỗ reader.
+        """
+        return Chunks(self._read_fill(fill, chunk_size), lambda: self.release(fill))
+
+    def aiter_fill(self, fill, chunk_size=FILL_CHUNK):
+        async def release():
+            self.release(fill)
+
+        return AsyncChunks(self._aread_fill(fill, chunk_size), release)
+
+    def _read_fill(self, fill, chunk_size):
+        with fill.cond:
+            f = open(fill.path, "rb")     # fd vẫn hợp lệ sau rename .part -> .mp3
+        offset = 0
+        progress_at = time.monotonic()
+        try:
+            while True:
+                size, done = fill.wait(offset)
+                if fill.error:
+                    raise _fill_error(fill, fill.error)
+                if size > offset:
+                    progress_at = time.monotonic()
+                elif not done and time.monotonic() - progress_at > TTS_FILL_STALL:
+                    self._abort(fill, "fill stalled")
+                    raise _fill_error(fill, "fill stalled")
+                while offset < size:
+                    data = f.read(min(chunk_size, size - offset))
+                    if not data:
+                        break
+                    offset += len(data)
+                    yield data
+                if done and offset >= fill.size:
+                    return
+        finally:
+            f.close()
+
+    async def _aread_fill(self, fill, chunk_size):
+        with fill.cond:
+            f = open(fill.path, "rb")
+        offset = 0
+        progress_at = time.monotonic()
+        try:
+            while True:
+                size, done = await fill.await_data(offset)
+                if fill.error:
+                    raise _fill_error(fill, fill.error)
+                if size > offset:
+                    progress_at = time.monotonic()
+                elif not done and time.monotonic() - progress_at > TTS_FILL_STALL:
+                    self._abort(fill, "fill stalled")
+                    raise _fill_error(fill, "fill stalled")
+                while offset < size:
+                    data = f.read(min(chunk_size, size - offset))
+                    if not data:
+                        break
+                    offset += len(data)
+                    yield data
+                if done and offset >= fill.size:
+                    return
+        finally:
+            f.close()
+
+    def info(self):
+        with self._lock:
+            return {"dir": self.dir, "entries": len(self._index), "bytes": self._bytes,
+                    "max_bytes": self.max_bytes, "inflight": len(self._fills), **self.stats}
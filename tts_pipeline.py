@@ -0,0 +1,259 @@
+# tts_pipeline.py
+# Pipelined TTS cho text dài: cắt text theo câu / mệnh đề, synthesize segment đầu
+# ngay, prefetch N segment kế tiếp song song, rồi nối MP3 theo đúng thứ tự ra
+# 1 response stream duy nhất -> time-to-first-audio chỉ phụ thuộc câu đầu.
+#
+# Opt-in: TTS_PIPELINE=1 (mặc định cho text dài) hoặc {"pipeline": true} theo request.
+
+import asyncio
+import os
+import queue
+import re
+import threading
+from collections import deque
+
+from stream_relay import RELAY_READ_SIZE, AsyncChunks, Chunks
+from tts_cache import normalize_text
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name) or default)
+    except ValueError:
+        return default
+
+
+PIPELINE_ENABLED     = (os.getenv("TTS_PIPELINE") or "0").lower() in ("1", "true", "yes")
+PIPELINE_MIN_CHARS   = _env_int("TTS_PIPELINE_MIN_CHARS", 200)   # ngắn hơn -> 1 request như cũ
+PIPELINE_MAX_SEGMENT = _env_int("TTS_PIPELINE_MAX_SEGMENT", 250)
+PIPELINE_MIN_SEGMENT = _env_int("TTS_PIPELINE_MIN_SEGMENT", 40)  # câu quá ngắn gộp với câu sau
+PIPELINE_PREFETCH    = _env_int("TTS_PIPELINE_PREFETCH", 2)
+
+_SENTENCE = re.compile(r"(?<=[.!?…。！？])\s+|\n+")
+_CLAUSE = re.compile(r"(?<=[,;:，；、])\s+")
+
+
+class SegmentError(Exception):
+    """
+    Upstream trả lỗi cho 1 segment.
+    """
+
+    def __init__(self, status, text):
+        self.status = status
+        super().__init__(f"TTS upstream status={status}: {text}")
+
+
+def wants_pipeline(flag, text):
+    """
+    flag: giá trị "pipeline" của request (None = theo TTS_PIPELINE).
+    """
+    if flag is None:
+        enabled = PIPELINE_ENABLED
+    elif isinstance(flag, str):
+        enabled = flag.lower() in ("1", "true", "yes")
+    else:
+        enabled = bool(flag)
+    return enabled and len(text) >= PIPELINE_MIN_CHARS
+
+
+def _wrap(piece, max_chars):
+    # câu quá dài: cắt ở dấu phẩy / chấm phẩy, cuối cùng mới cắt theo khoảng trắng
+    if len(piece) <= max_chars:
+        return [piece]
+    out = []
+    for clause in _CLAUSE.split(piece):
+        while len(clause) > max_chars:
+            cut = clause.rfind(" ", 0, max_chars)
+            if cut <= 0:
+                cut = max_chars
+            out.append(clause[:cut].strip())
+            clause = clause[cut:].strip()
+        if clause:
+            out.append(clause)
+    return out
+
+
+def split_text(text, max_chars=PIPELINE_MAX_SEGMENT, min_chars=PIPELINE_MIN_SEGMENT):
+    """
+    -> list segment theo thứ tự. Gộp các mảnh ngắn liên tiếp (tới max_chars) để
+    không tốn request cho từng câu 2-3 chữ và giữ ngữ điệu tự nhiên hơn.
+    """
+    pieces = []
+    for sentence in _SENTENCE.split(text):
+        sentence = normalize_text(sentence)
+        if sentence:
+            pieces.extend(_wrap(sentence, max_chars))
+
+    segments = []
+    for piece in pieces:
+        if segments and (len(segments[-1]) < min_chars or len(piece) < min_chars) \
+                and len(segments[-1]) + 1 + len(piece) <= max_chars:
+            segments[-1] = f"{segments[-1]} {piece}"
+        else:
+            segments.append(piece)
+    return segments
+
+
+# =========================================================
+# SYNC (Flask / WSGI)
+# =========================================================
+def buffered(response, read_size=RELAY_READ_SIZE):
+    """
+    Đọc requests.Response (stream=True) vào queue trên thread nền ngay lập tức
+    -> segment prefetch tải xong trong lúc segment trước còn đang phát.
+    close() (kể cả trước lần đọc đầu) -> dừng reader, đóng response.
+    """
+    q = queue.Queue()
+    stop = threading.Event()
+
+    def reader():
+        try:
+            for chunk in response.iter_content(read_size):
+                if stop.is_set():
+                    return
+                if chunk:
+                    q.put(chunk)
+            q.put(None)
+        except Exception as e:
+            q.put(e)
+        finally:
+            response.close()
+
+    threading.Thread(target=reader, name="tts-segment", daemon=True).start()
+
+    def chunks():
+        while True:
+            item = q.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def close():
+        stop.set()
+        response.close()
+
+    return Chunks(chunks(), close)
+
+
+def pipelined(segments, start, executor, prefetch=PIPELINE_PREFETCH):
+    """
+    start(segment) -> iterable bytes (đã bắt đầu synthesize); chạy trên executor.
+    Tối đa 1 + prefetch segment chạy cùng lúc; yield audio đúng thứ tự.
+    """
+    todo = iter(segments)
+    pending = deque()
+
+    def top_up():
+        while len(pending) < 1 + prefetch:
+            seg = next(todo, None)
+            if seg is None:
+                return
+            pending.append(executor.submit(start, seg))
+
+    try:
+        top_up()
+        while pending:
+            chunks = pending.popleft().result()
+            top_up()
+            try:
+                yield from chunks
+            finally:
+                _close(chunks)
+    finally:
+        # client ngắt / segment lỗi: bỏ các segment đang prefetch
+        for fut in pending:
+            if not fut.cancel():
+                fut.add_done_callback(_close_result)
+
+
+def _close(chunks):
+    close = getattr(chunks, "close", None)
+    if close:
+        close()
+
+
+def _close_result(fut):
+    if not fut.cancelled() and fut.exception() is None:
+        _close(fut.result())
+
+
+# =========================================================
+# ASYNC (ASGI)
+# =========================================================
+def abuffered(response, read_size=RELAY_READ_SIZE):
+    """
+    Như buffered() cho httpx.Response (stream=True); reader là asyncio.Task.
+    """
+    q = asyncio.Queue()
+
+    async def reader():
+        try:
+            async for chunk in response.aiter_bytes(read_size):
+                if chunk:
+                    q.put_nowait(chunk)
+            q.put_nowait(None)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            q.put_nowait(e)
+        finally:
+            await response.aclose()
+
+    task = asyncio.ensure_future(reader())
+
+    async def chunks():
+        while True:
+            item = await q.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    async def close():
+        task.cancel()
+        await response.aclose()
+
+    return AsyncChunks(chunks(), close)
+
+
+async def apipelined(segments, astart, prefetch=PIPELINE_PREFETCH):
+    """
+    astart(segment) -> coroutine trả async iterable bytes.
+    """
+    todo = iter(segments)
+    pending = deque()
+
+    def top_up():
+        while len(pending) < 1 + prefetch:
+            seg = next(todo, None)
+            if seg is None:
+                return
+            pending.append(asyncio.ensure_future(astart(seg)))
+
+    try:
+        top_up()
+        while pending:
+            chunks = await pending.popleft()
+            top_up()
+            try:
+                async for chunk in chunks:
+                    yield chunk
+            finally:
+                await _aclose(chunks)
+    finally:
+        for task in pending:
+            task.cancel()
+        for task in pending:
+            try:
+                await _aclose(await task)
+            except BaseException:
+                pass
+
+
+async def _aclose(chunks):
+    aclose = getattr(chunks, "aclose", None)
+    if aclose:
+        await aclose()
@@ -0,0 +1,499 @@
+# upstream.py
+# Pooled keep-alive HTTP client dùng chung cho mọi upstream (ElevenLabs, n8n).
+#
+# Mỗi host có 1 connection pool riêng (urllib3 PoolManager), nên các request
+# tới api.elevenlabs.io / webhook n8n tái sử dụng kết nối TCP+TLS thay vì bắt
+# tay lại từ đầu mỗi lần.
+
+import asyncio
+import os
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+import tracing
+from breaker import BreakerRegistry, CircuitOpenError
+from metrics import Counter, Gauge, Histogram
+from shared_state import shared
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name) or default)
+    except ValueError:
+        return default
+
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name) or default)
+    except ValueError:
+        return default
+
+
+POOL_CONNECTIONS = _env_int("UPSTREAM_POOL_CONNECTIONS", 10)    # số host pool giữ trong cache
+POOL_MAXSIZE     = _env_int("UPSTREAM_POOL_MAXSIZE", 32)        # số kết nối keep-alive / host
+POOL_BLOCK       = (os.getenv("UPSTREAM_POOL_BLOCK") or "").lower() in ("1", "true", "yes")
+CONNECT_TIMEOUT  = _env_float("UPSTREAM_CONNECT_TIMEOUT", 3.05)
+READ_TIMEOUT     = _env_float("UPSTREAM_READ_TIMEOUT", 20)
+
+# label "upstream" = op=... của caller (agents, voices, tts, n8n, ...), không có thì dependency
+upstream_requests = Counter("upstream_requests_total", "Call upstream theo kết quả",
+                            labelnames=("upstream", "status"))
+upstream_ttfb = Histogram("upstream_ttfb_seconds", "Thời gian tới khi nhận header upstream",
+                          labelnames=("upstream",))
+upstream_duration = Histogram("upstream_duration_seconds",
+                              "Tổng thời gian call upstream (stream: tới khi đóng response)",
+                              labelnames=("upstream",))
+upstream_inflight = Gauge("upstream_inflight", "Call upstream đang chạy / stream đang mở",
+                          labelnames=("upstream",))
+
+
+# =========================================================
+# POOL METRICS
+# =========================================================
+class PoolStats:
+    """
+    Đếm theo host: số request, số kết nối mới (TCP connect thật),
+    pool hits (request chạy trên kết nối có sẵn) và thời gian chờ lấy kết nối.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    def _host(self, host):
+        h = self._hosts.get(host)
+        if h is None:
+            h = self._hosts[host] = {
+                "requests": 0,
+                "new_connections": 0,
+                "wait_seconds_total": 0.0,
+                "wait_seconds_max": 0.0,
+            }
+        return h
+
+    def record_checkout(self, host, waited):
+        with self._lock:
+            h = self._host(host)
+            h["requests"] += 1
+            h["wait_seconds_total"] += waited
+            if waited > h["wait_seconds_max"]:
+                h["wait_seconds_max"] = waited
+
+    def record_connect(self, host):
+        with self._lock:
+            self._host(host)["new_connections"] += 1
+
+    def snapshot(self):
+        with self._lock:
+            out = {}
+            for host, h in self._hosts.items():
+                reqs = h["requests"]
+                out[host] = {
+                    **h,
+                    "pool_hits": max(0, reqs - h["new_connections"]),
+                    "wait_seconds_avg": (h["wait_seconds_total"] / reqs) if reqs else 0.0,
+                }
+            return out
+
+
+pool_stats = PoolStats()
+
+
+class _CountingHTTPConnection(HTTPConnection):
+    def connect(self):
+        pool_stats.record_connect(self.host)
+        return super().connect()
+
+
+class _CountingHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        pool_stats.record_connect(self.host)
+        return super().connect()
+
+
+class _InstrumentedHTTPPool(HTTPConnectionPool):
+    ConnectionCls = _CountingHTTPConnection
+
+    def _get_conn(self, timeout=None):
+        t0 = time.perf_counter()
+        conn = super()._get_conn(timeout=timeout)
+        pool_stats.record_checkout(self.host, time.perf_counter() - t0)
+        return conn
+
+
+class _InstrumentedHTTPSPool(HTTPSConnectionPool):
+    ConnectionCls = _CountingHTTPSConnection
+
+    def _get_conn(self, timeout=None):
+        t0 = time.perf_counter()
+        conn = super()._get_conn(timeout=timeout)
+        pool_stats.record_checkout(self.host, time.perf_counter() - t0)
+        return conn
+
+
+class _PooledAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _InstrumentedHTTPPool,
+            "https": _InstrumentedHTTPSPool,
+        }
+
+
+# =========================================================
+# CLIENT
+# =========================================================
+# 1 breaker / dependency ("n8n", "elevenlabs_convai", "elevenlabs_tts"), dùng chung sync + async
+breakers = BreakerRegistry(ceiling=READ_TIMEOUT, shared=shared)
+
+
+def _healthy(status_code):
+    # 4xx là lỗi của request, không phải của dependency — trừ 429 (quota)
+    return status_code < 500 and status_code != 429
+
+
+class UpstreamClient:
+    """
+    Wrapper mỏng quanh requests.Session: pool theo host, keep-alive,
+    timeout mặc định (connect, read) nếu caller không truyền.
+    dependency=... bật circuit breaker + read timeout thích ứng cho call đó.
+    """
+
+    def __init__(self, pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE,
+                 pool_block=POOL_BLOCK, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)):
+        self.timeout = timeout
+        self.pool_maxsize = pool_maxsize
+        self.session = requests.Session()
+        adapter = _PooledAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block,
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request(self, method, url, dependency=None, op=None, **kwargs):
+        name = op or dependency or "other"
+        sp = _span(name, method, url, kwargs)
+        br = None
+        if dependency is None:
+            kwargs.setdefault("timeout", self.timeout)
+        else:
+            br = _gate(dependency, name, sp)
+            kwargs.setdefault("timeout", (self.timeout[0], br.timeout()))
+
+        finish = _track(name, sp)
+        t0 = time.perf_counter()
+        try:
+            r = self.session.request(method, url, **kwargs)
+        except Exception as e:
+            if br is not None:
+                br.record(False)
+            sp.set(error=type(e).__name__)
+            finish("error")
+            raise
+        if br is not None:
+            br.record(_healthy(r.status_code), time.perf_counter() - t0)
+        # r.elapsed: tới khi parse xong header (kể cả khi stream=True)
+        upstream_ttfb.observe(r.elapsed.total_seconds(), upstream=name)
+        sp.set(ttfb_ms=round(r.elapsed.total_seconds() * 1000, 2))
+        if kwargs.get("stream"):
+            _finish_on_close(r, "close", finish, r.status_code)
+        else:
+            finish(r.status_code)
+        return r
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def preconnect(self, url, n=1):
+        """
+        Mở sẵn n connection (DNS + TCP + TLS) tới host của url và trả vào pool,
+        request đầu tiên tới host đó không phải chờ handshake. -> timing (ms).
+        """
+        adapter = self.session.get_adapter(url)
+        prepared = requests.Request("GET", url).prepare()
+        if hasattr(adapter, "get_connection_with_tls_context"):
+            pool = adapter.get_connection_with_tls_context(prepared, verify=True)
+        else:
+            pool = adapter.get_connection(url)
+        n = max(1, min(n, self.pool_maxsize))
+
+        t0 = time.perf_counter()
+        socket.getaddrinfo(pool.host, pool.port, type=socket.SOCK_STREAM)
+        dns = time.perf_counter() - t0
+
+        conns = [pool._get_conn() for _ in range(n)]
+        try:
+            for conn in conns:
+                if conn.sock is None:
+                    conn.timeout = self.timeout[0]
+                    conn.connect()
+        finally:
+            for conn in conns:
+                pool._put_conn(conn)
+        return {"host": pool.host, "connections": n, "dns_ms": round(dns * 1000, 1),
+                "connect_ms": round((time.perf_counter() - t0 - dns) * 1000, 1)}
+
+    def stats(self):
+        return {
+            "pool_maxsize": self.pool_maxsize,
+            "timeout": {"connect": self.timeout[0], "read": self.timeout[1]},
+            "hosts": pool_stats.snapshot(),
+        }
+
+
+def _span(name, method, url, kwargs):
+    # span "upstream.<op>" + header traceparent / X-Request-Id cho upstream (tracing.py)
+    sp = tracing.start_span(f"upstream.{name}", method=method, host=urlsplit(url).netloc)
+    headers = tracing.outgoing_headers(sp.span_id)
+    if headers:
+        kwargs["headers"] = {**(kwargs.get("headers") or {}), **headers}
+    return sp
+
+
+def _gate(dependency, name, sp=tracing.NOOP):
+    br = breakers.get(dependency)
+    try:
+        br.before()
+    except CircuitOpenError:
+        upstream_requests.inc(upstream=name, status="circuit_open")
+        sp.end(status="circuit_open")
+        raise
+    return br
+
+
+def _track(name, sp=tracing.NOOP):
+    # -> finish(status): gọi đúng 1 lần khi call xong (stream: khi đóng response)
+    upstream_inflight.inc(upstream=name)
+    t0 = time.perf_counter()
+    done = []
+
+    def finish(status):
+        if done:
+            return
+        done.append(True)
+        upstream_inflight.dec(upstream=name)
+        upstream_duration.observe(time.perf_counter() - t0, upstream=name)
+        upstream_requests.inc(upstream=name, status=str(status))
+        sp.end(status=status)
+
+    return finish
+
+
+def _finish_on_close(r, attr, finish, status):
+    # bọc r.close / r.aclose để đo tổng thời gian stream và giữ inflight tới lúc đóng
+    close = getattr(r, attr)
+    if asyncio.iscoroutinefunction(close):
+        async def wrapped():
+            try:
+                await close()
+            finally:
+                finish(status)
+    else:
+        def wrapped():
+            try:
+                close()
+            finally:
+                finish(status)
+    setattr(r, attr, wrapped)
+
+
+# ✅ CHỈ KHỞI TẠO 1 LẦN — mọi route dùng chung
+http = UpstreamClient()
+
+
+# =========================================================
+# ROUTE RESOLUTION (404 fallback paths)
+# =========================================================
+class UpstreamRoute:
+    """
+    1 endpoint logic có nhiều URL ứng viên (vd /convai/agents/{id} vs /agents/{id}).
+    Lần đầu dùng thì thử lần lượt, nhớ URL không trả 404; các lần sau chỉ gọi
+    đúng URL đó. Chỉ probe lại khi URL đang dùng trả 404.
+    """
+
+    def __init__(self, name, candidates):
+        self.name = name
+        self.candidates = list(candidates)
+        self.active = None           # index trong candidates
+        self.probes = 0
+        self.last_probe_at = None
+        self._lock = threading.Lock()
+        self._alock = None           # asyncio.Lock, tạo lười trong event loop
+
+    def _order(self, failed=None):
+        # thử các ứng viên khác trước, URL vừa hỏng để cuối cùng
+        idx = [i for i in range(len(self.candidates)) if i != failed]
+        return idx + ([failed] if failed is not None else [])
+
+    def _resolved(self, i):
+        self.active = i
+        self.probes += 1
+        self.last_probe_at = time.time()
+
+    def request(self, client, method="GET", **kwargs):
+        active = self.active
+        if active is not None:
+            r = client.request(method, self.candidates[active], **kwargs)
+            if r.status_code != 404:
+                return r
+            r.close()
+
+        with self._lock:
+            if self.active is not None and self.active != active:
+                # thread khác vừa probe xong
+                return client.request(method, self.candidates[self.active], **kwargs)
+            # active None (chưa probe / thread khác probe hỏng) -> tự probe
+
+            r = None
+            for i in self._order(active):
+                r = client.request(method, self.candidates[i], **kwargs)
+                if r.status_code != 404:
+                    self._resolved(i)
+                    return r
+            self.active = None
+            return r
+
+    async def arequest(self, client, method="GET", **kwargs):
+        active = self.active
+        if active is not None:
+            r = await client.request(method, self.candidates[active], **kwargs)
+            if r.status_code != 404:
+                return r
+            await r.aclose()
+
+        if self._alock is None:
+            self._alock = asyncio.Lock()
+        async with self._alock:
+            if self.active is not None and self.active != active:
+                # task khác vừa probe xong
+                return await client.request(method, self.candidates[self.active], **kwargs)
+
+            r = None
+            for i in self._order(active):
+                r = await client.request(method, self.candidates[i], **kwargs)
+                if r.status_code != 404:
+                    self._resolved(i)
+                    return r
+            self.active = None
+            return r
+
+    def info(self):
+        return {
+            "active": self.candidates[self.active] if self.active is not None else None,
+            "variant": self.active,
+            "candidates": self.candidates,
+            "probes": self.probes,
+            "last_probe_at": self.last_probe_at,
+        }
+
+
+class RouteRegistry:
+    def __init__(self):
+        self._routes = {}
+
+    def register(self, name, candidates):
+        route = self._routes[name] = UpstreamRoute(name, candidates)
+        return route
+
+    def info(self):
+        return {name: r.info() for name, r in self._routes.items()}
+
+
+routes = RouteRegistry()
+
+
+# =========================================================
+# ASYNC CLIENT (ASGI mode)
+# =========================================================
+class AsyncUpstreamClient:
+    """
+    Như UpstreamClient nhưng trên httpx.AsyncClient; dùng chung breakers.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def _timeout(self, br):
+        import httpx
+        return httpx.Timeout(br.timeout(), connect=CONNECT_TIMEOUT)
+
+    async def request(self, method, url, dependency=None, op=None, stream=False, **kwargs):
+        name = op or dependency or "other"
+        sp = _span(name, method, url, kwargs)
+        br = None
+        if dependency is not None:
+            br = _gate(dependency, name, sp)
+            kwargs.setdefault("timeout", self._timeout(br))
+
+        finish = _track(name, sp)
+        t0 = time.perf_counter()
+        try:
+            req = self.client.build_request(method, url, **kwargs)
+            r = await self.client.send(req, stream=stream)
+        except asyncio.CancelledError:
+            if br is not None:
+                br.release()
+            finish("cancelled")
+            raise
+        except Exception as e:
+            if br is not None:
+                br.record(False)
+            sp.set(error=type(e).__name__)
+            finish("error")
+            raise
+        if br is not None:
+            br.record(_healthy(r.status_code), time.perf_counter() - t0)
+        # send(stream=True) trả về ngay khi có header
+        ttfb = time.perf_counter() - t0 if stream else r.elapsed.total_seconds()
+        upstream_ttfb.observe(ttfb, upstream=name)
+        sp.set(ttfb_ms=round(ttfb * 1000, 2))
+        if stream:
+            _finish_on_close(r, "aclose", finish, r.status_code)
+        else:
+            finish(r.status_code)
+        return r
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+def make_async_client():
+    """
+    AsyncUpstreamClient trên httpx.AsyncClient với cùng cấu hình pool/timeout.
+    Bật HTTP/2 nếu có package h2 (pip install httpx[http2]).
+    """
+    import httpx
+
+    try:
+        import h2  # noqa: F401
+        http2 = True
+    except ImportError:
+        http2 = False
+
+    return AsyncUpstreamClient(httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=POOL_MAXSIZE * POOL_CONNECTIONS,
+            max_keepalive_connections=POOL_MAXSIZE,
+        ),
+        timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+    ))
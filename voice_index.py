@@ -0,0 +1,205 @@
+# voice_index.py
+# Index voice list phía server cho /api/voices: lọc, tìm theo tên, phân trang, chọn field.
+#
+#   /api/voices                                   # toàn bộ voice, DEFAULT_FIELDS (không có labels)
+#   /api/voices?fields=voice_id,name,language_trained,label     # dropdown (assistant.js)
+#   /api/voices?lang=vi,en&category=cloned&q=pi&limit=50&cursor=...
+#
+# Voice list lấy từ voices_cache (TTL + SWR như cũ). Mỗi lần cache có bản mới (etag đổi) index
+# chỉ cập nhật voice thêm / xoá / đổi nội dung, không dựng lại từ đầu. Kết quả query được memo
+# theo (phiên bản, tham số) -> request dropdown lặp lại chỉ là 1 lookup dict.
+
+import base64
+import bisect
+import hashlib
+import json
+import os
+import threading
+
+import fast_json
+from cache import CacheEntry
+
+VOICES_MAX_LIMIT = int(os.getenv("VOICES_MAX_LIMIT") or 200)   # limit tối đa / trang
+VOICES_MEMO      = 64                                          # số kết quả query giữ lại
+
+FIELDS = ("voice_id", "name", "language_trained", "category", "label", "labels")
+DEFAULT_FIELDS = ("voice_id", "name", "language_trained", "category", "label")   # labels: xin rõ
+
+
+def voice_label(voice):
+    # label dùng cho multi-voice: labels.assistant_voice / labels.voice_label, không có thì name
+    labels = voice.get("labels") or {}
+    return labels.get("assistant_voice") or labels.get("voice_label") or voice.get("name")
+
+
+def _sort_key(voice):
+    return ((voice.get("name") or "").casefold(), voice["voice_id"])
+
+
+def _fingerprint(voice):
+    return hashlib.sha1(fast_json.dumps(voice)).hexdigest()
+
+
+def encode_cursor(key):
+    raw = json.dumps(list(key), separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        name, vid = json.loads(raw)
+        return str(name), str(vid)
+    except Exception:
+        raise ValueError("cursor không hợp lệ")
+
+
+def _csv(value):
+    return tuple(sorted({p.strip().lower() for p in (value or "").split(",") if p.strip()}))
+
+
+def parse_query(args):
+    """
+    request.args -> tuple tham số đã chuẩn hoá (dùng làm key memo). Sai -> ValueError.
+    """
+    fields = tuple(p.strip() for p in (args.get("fields") or "").split(",") if p.strip())
+    unknown = [f for f in fields if f not in FIELDS]
+    if unknown:
+        raise ValueError(f"unknown field(s): {', '.join(unknown)} (có: {', '.join(FIELDS)})")
+
+    limit = args.get("limit")
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ValueError("limit phải là số nguyên")
+        limit = max(1, min(limit, VOICES_MAX_LIMIT))
+
+    cursor = args.get("cursor") or None
+    if cursor is not None:
+        decode_cursor(cursor)
+
+    return (_csv(args.get("lang")), _csv(args.get("category")),
+            (args.get("q") or "").strip().casefold(), fields or DEFAULT_FIELDS, limit, cursor)
+
+
+class VoiceIndex:
+    def __init__(self, memo=VOICES_MEMO):
+        self._lock = threading.Lock()
+        self.version = None
+        self._voices = {}        # voice_id -> record (đã thêm category / label)
+        self._prints = {}        # voice_id -> fingerprint nội dung
+        self._order = []         # [(name.casefold(), voice_id)] đã sort -> prefix search + cursor
+        self._by_lang = {}       # language_trained (lower) -> set(voice_id); "" = không có
+        self._by_category = {}   # category (lower) -> set(voice_id)
+        self._memo = {}          # (version, query) -> CacheEntry
+        self._memo_size = memo
+        self.stats = {"syncs": 0, "added": 0, "removed": 0, "changed": 0,
+                      "memo_hits": 0, "queries": 0}
+
+    # ---------- cập nhật ----------
+    def _add(self, voice):
+        vid = voice["voice_id"]
+        self._voices[vid] = voice
+        bisect.insort(self._order, _sort_key(voice))
+        self._by_lang.setdefault((voice.get("language_trained") or "").lower(), set()).add(vid)
+        self._by_category.setdefault((voice.get("category") or "").lower(), set()).add(vid)
+
+    def _remove(self, vid):
+        voice = self._voices.pop(vid)
+        key = _sort_key(voice)
+        i = bisect.bisect_left(self._order, key)
+        if i < len(self._order) and self._order[i] == key:
+            del self._order[i]
+        for index, value in ((self._by_lang, voice.get("language_trained")),
+                             (self._by_category, voice.get("category"))):
+            bucket = index.get((value or "").lower())
+            if bucket is not None:
+                bucket.discard(vid)
+                if not bucket:
+                    del index[(value or "").lower()]
+
+    def sync(self, version, voices):
+        """
+        Đồng bộ với voice list phiên bản version (etag của voices_cache). Cùng phiên bản -> no-op.
+        """
+        if version == self.version:
+            return
+        with self._lock:
+            if version == self.version:
+                return
+            seen = set()
+            for v in voices:
+                vid = v.get("voice_id")
+                if not vid or vid in seen:
+                    continue
+                seen.add(vid)
+                record = {**v, "label": voice_label(v)}
+                fp = _fingerprint(record)
+                old = self._prints.get(vid)
+                if old == fp:
+                    continue
+                if old is not None:
+                    self._remove(vid)
+                    self.stats["changed"] += 1
+                else:
+                    self.stats["added"] += 1
+                self._add(record)
+                self._prints[vid] = fp
+            for vid in [vid for vid in self._voices if vid not in seen]:
+                self._remove(vid)
+                del self._prints[vid]
+                self.stats["removed"] += 1
+            self._memo.clear()
+            self.version = version
+            self.stats["syncs"] += 1
+
+    # ---------- query ----------
+    def query(self, params):
+        """
+        params từ parse_query() -> CacheEntry({"voices", "total", "next_cursor"}) (có etag riêng).
+        """
+        with self._lock:
+            memo_key = (self.version, params)
+            self.stats["queries"] += 1
+            entry = self._memo.get(memo_key)
+            if entry is not None:
+                self.stats["memo_hits"] += 1
+                return entry
+            entry = CacheEntry(self._run(*params))
+            self._memo[memo_key] = entry
+            while len(self._memo) > self._memo_size:
+                self._memo.pop(next(iter(self._memo)))
+            return entry
+
+    def _run(self, langs, categories, prefix, fields, limit, cursor):
+        # tập ứng viên: giao các index lang / category (None = không lọc)
+        allowed = None
+        for index, wanted in ((self._by_lang, langs), (self._by_category, categories)):
+            if wanted:
+                ids = set().union(*(index.get(w, ()) for w in wanted))
+                allowed = ids if allowed is None else allowed & ids
+
+        # khoảng trong _order có tên bắt đầu bằng prefix (đã sort nên là 1 đoạn liền)
+        lo = bisect.bisect_left(self._order, (prefix, ""))
+        hi = bisect.bisect_left(self._order, (prefix + "\U0010ffff", "")) if prefix else len(self._order)
+        matched = [key for key in self._order[lo:hi] if allowed is None or key[1] in allowed]
+
+        # cursor = sort key của item cuối trang trước -> vẫn đúng nếu item đó đã bị xoá
+        start = bisect.bisect_right(matched, decode_cursor(cursor)) if cursor is not None else 0
+        page = matched[start:] if limit is None else matched[start:start + limit]
+        more = limit is not None and start + limit < len(matched)
+
+        out = []
+        for _, vid in page:
+            voice = self._voices[vid]
+            out.append({f: voice.get(f) for f in fields})
+        return {"voices": out, "total": len(matched),
+                "next_cursor": encode_cursor(page[-1]) if more else None}
+
+    def info(self):
+        with self._lock:
+            return {"version": self.version, "voices": len(self._voices),
+                    "languages": {k or "-": len(v) for k, v in self._by_lang.items()},
+                    "categories": {k or "-": len(v) for k, v in self._by_category.items()},
+                    **self.stats}
@@ -0,0 +1,100 @@
+# warmup.py
+# Warm-up nền lúc khởi động + trạng thái cho /readyz.
+#
+# Server nhận kết nối ngay (khởi động nhanh), các bước warm-up chạy song song phía sau:
+#   assets      build asset có hash / nén sẵn
+#   connections DNS + TCP + TLS tới từng upstream host, để sẵn connection trong pool
+#   agent       prefetch agent config vào cache
+#   voices      prefetch voice list vào cache
+# /readyz trả 503 tới khi mọi bước xong (ok hoặc lỗi) hoặc quá WARMUP_TIMEOUT giây
+# -> orchestrator chỉ route traffic tới instance đã warm. /healthz chỉ báo process còn sống.
+
+import asyncio
+import os
+import threading
+import time
+
+WARMUP_TIMEOUT     = float(os.getenv("WARMUP_TIMEOUT") or 20)
+WARMUP_CONNECTIONS = int(os.getenv("WARMUP_CONNECTIONS") or 2)   # connection mở sẵn / host
+
+STARTED_AT = time.monotonic()
+
+
+class Warmup:
+    def __init__(self, timeout=WARMUP_TIMEOUT):
+        self.timeout = timeout
+        self._steps = {}              # name -> {"state", "ms", ...}
+        self._fns = []
+        self._lock = threading.Lock()
+        self._started_at = None
+
+    def add(self, name, fn):
+        """
+        fn() sync -> chạy trong thread riêng; coroutine function -> task trên event loop đang chạy.
+        Giá trị trả về (nếu có) được ghi vào "detail".
+        """
+        self._steps[name] = {"state": "pending"}
+        self._fns.append((name, fn))
+
+    def start(self):
+        if self._started_at is not None:
+            return
+        self._started_at = time.monotonic()
+        for name, fn in self._fns:
+            if asyncio.iscoroutinefunction(fn):
+                asyncio.ensure_future(self._arun(name, fn))
+            else:
+                threading.Thread(target=self._run, args=(name, fn), name=f"warmup-{name}",
+                                 daemon=True).start()
+
+    def _begin(self, name):
+        with self._lock:
+            self._steps[name] = {"state": "running"}
+        return time.perf_counter()
+
+    def _end(self, name, t0, detail=None, error=None):
+        step = {"state": "error" if error else "ok",
+                "ms": round((time.perf_counter() - t0) * 1000, 1)}
+        if error:
+            step["error"] = error
+        elif detail is not None:
+            step["detail"] = detail
+        with self._lock:
+            self._steps[name] = step
+
+    def _run(self, name, fn):
+        t0 = self._begin(name)
+        try:
+            detail = fn()
+        except Exception as e:
+            self._end(name, t0, error=str(e))
+        else:
+            self._end(name, t0, detail)
+
+    async def _arun(self, name, fn):
+        t0 = self._begin(name)
+        try:
+            detail = await fn()
+        except Exception as e:
+            self._end(name, t0, error=str(e))
+        else:
+            self._end(name, t0, detail)
+
+    def ready(self):
+        if self._started_at is None:
+            return False
+        with self._lock:
+            done = all(s["state"] in ("ok", "error") for s in self._steps.values())
+        return done or time.monotonic() - self._started_at > self.timeout
+
+    def info(self):
+        with self._lock:
+            steps = {name: dict(s) for name, s in self._steps.items()}
+        elapsed = time.monotonic() - self._started_at if self._started_at is not None else 0.0
+        return {"ready": self.ready(), "elapsed": round(elapsed, 2), "timeout": self.timeout,
+                "steps": steps}
+
+
+def health():
+    # /healthz: process còn sống và phục vụ được request
+    return {"status": "ok", "uptime": round(time.monotonic() - STARTED_AT, 1), "pid": os.getpid()}